@@ -0,0 +1,193 @@
+"""
+Asyncio API: runs the CPU-bound scan and deobf of a sample on a managed executor, so an
+event loop stays responsive while large samples are deobfuscated
+
+    result = await deobfuscate(data, types='blankobf,pyobfuscate')
+
+or, to choose the executor and limits,
+
+    async with AsyncDeobfService(jobs=4, max_waiting=64) as service:
+        result = await service.deobfuscate(data)
+
+Nothing here configures logging; records from the deobfuscators go wherever the host sends them
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Literal
+
+from typing_extensions import Self
+
+from vipyr_deobf.batch import deobf_sample, load_worker_deobfs, supervised_sample
+from vipyr_deobf.deobf_base import DEOBFS, parse_deobf_types
+from vipyr_deobf.exceptions import ServerBusyError
+from vipyr_deobf.result import DeobfResult
+from vipyr_deobf.supervise import Limits
+
+logger = logging.getLogger('deobf')
+
+
+class AsyncDeobfService:
+    """
+    Deobfuscates samples on a pool of worker processes (or threads), at most jobs at a time
+    Callers past that wait for a slot, which is how backpressure reaches the producer; with
+    max_waiting, callers that would have to wait behind that many others are rejected instead
+    Cancelling a caller frees its slot as soon as its sample stops running. Samples that have not
+    started yet are dropped, samples already running are stopped by timeout at the latest
+    :param executor: 'process' isolates samples from the host and enforces timeout inside the worker,
+        'thread' avoids the cost of sending samples to another process but holds the GIL while it works,
+        and a thread cannot be stopped, so timeout only stops waiting for it
+    :param timeout: Per-sample time limit in seconds, 0 to disable
+    :param limits: If given, each sample runs in its own forked child under these limits (process only)
+    :raises DeobfLoadingError: If types names a schema or version that does not exist
+    """
+
+    def __init__(
+        self,
+        types: str = 'auto',
+        jobs: int | None = None,
+        max_waiting: int | None = None,
+        timeout: float = 60,
+        executor: Literal['process', 'thread'] = 'process',
+        limits: Limits | None = None,
+    ):
+        if executor not in ('process', 'thread'):
+            raise ValueError(f'Unknown executor {executor!r}, choose process or thread')
+        if executor == 'thread' and limits is not None:
+            raise ValueError('limits need the process executor')
+        # Fail here rather than in every worker's initializer
+        parse_deobf_types(types)
+        if executor == 'thread' and not DEOBFS:
+            load_worker_deobfs(types)
+        self.types = types
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.kind = executor
+        self.limits = limits
+        self.executor = self.new_executor()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.slots = asyncio.Semaphore(self.jobs)
+        self.waiting = 0
+
+    def new_executor(self) -> Executor:
+        if self.kind == 'thread':
+            return ThreadPoolExecutor(self.jobs, thread_name_prefix='vipyr-deobf')
+        # The host is likely threaded, and forking a threaded process is unsafe,
+        # so workers come from a forkserver and load the deobfuscators once on startup
+        start_methods = multiprocessing.get_all_start_methods()
+        return ProcessPoolExecutor(
+            self.jobs,
+            mp_context=multiprocessing.get_context(
+                'forkserver' if 'forkserver' in start_methods else 'spawn'
+            ),
+            initializer=load_worker_deobfs,
+            initargs=(self.types,),
+        )
+
+    def submit(self, data: str | bytes, skip_scan: bool, label: str) -> 'Future[DeobfResult]':
+        if self.kind == 'thread':
+            # SIGALRM only reaches the main thread, so threads are timed out from the loop instead
+            return self.executor.submit(deobf_sample, label, skip_scan, 0, data)
+        if self.limits is not None:
+            return self.executor.submit(
+                supervised_sample, label, skip_scan, self.timeout, data, limits=self.limits
+            )
+        return self.executor.submit(deobf_sample, label, skip_scan, self.timeout, data)
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Semaphores belong to the loop that first waits on them
+            self.loop, self.slots = loop, asyncio.Semaphore(self.jobs)
+        if self.max_waiting is not None and self.slots.locked() and self.waiting >= self.max_waiting:
+            raise ServerBusyError()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+    async def deobfuscate(self, data: str | bytes, skip_scan: bool = False, label: str = '<source>') -> DeobfResult:
+        """
+        Scans and deobfuscates a sample, never raising for a sample that fails
+        :param label: Name of the sample in the result
+        :raises ServerBusyError: If max_waiting callers are already waiting for a slot
+        """
+        await self.acquire()
+        loop, slots, executor = asyncio.get_running_loop(), self.slots, self.executor
+        try:
+            future = self.submit(data, skip_scan, label)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(partial(_release_from_thread, loop, slots))
+        try:
+            if self.kind == 'thread' and self.timeout > 0:
+                return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            return await asyncio.wrap_future(future)
+        except asyncio.TimeoutError:
+            return DeobfResult(label, 'timeout', error=f'Exceeded time limit of {self.timeout}s')
+        except BrokenProcessPool:
+            logger.exception('A worker died, restarting the pool')
+            if self.executor is executor:
+                self.executor = self.new_executor()
+                executor.shutdown(wait=False)
+            return DeobfResult(label, 'error', error='Worker process died')
+
+    def close(self) -> None:
+        """
+        Stops the workers, dropping samples that have not started
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *_: object) -> None:
+        self.close()
+
+
+def _release_from_thread(
+    loop: asyncio.AbstractEventLoop,
+    slots: asyncio.Semaphore,
+    _future: 'Future[Any]',
+) -> None:
+    # Done callbacks run on the executor's thread, or the caller's when a pending future is cancelled
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        # The loop has closed, nothing can be waiting for the slot
+        pass
+
+
+_services: dict[str, AsyncDeobfService] = {}
+
+
+async def deobfuscate(
+    data: str | bytes,
+    types: str = 'auto',
+    skip_scan: bool = False,
+    label: str = '<source>',
+) -> DeobfResult:
+    """
+    Scans and deobfuscates a sample on a process pool shared by every call with the same types,
+    started on first use with one worker per CPU, see AsyncDeobfService
+    """
+    service = _services.get(types)
+    if service is None:
+        service = _services[types] = AsyncDeobfService(types)
+    return await service.deobfuscate(data, skip_scan, label)
+
+
+def shutdown() -> None:
+    """
+    Stops the pools started by deobfuscate
+    """
+    while _services:
+        _services.popitem()[1].close()
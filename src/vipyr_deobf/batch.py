@@ -0,0 +1,407 @@
+"""
+Batch mode: deobfuscates many samples at once over a pool of worker processes
+Deobfuscators are loaded once in the parent before the pool forks, so every worker
+starts with a warm registry instead of paying for a cold launch per sample
+"""
+
+import base64
+import binascii
+import glob
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Any
+
+from typing_extensions import Self
+
+from vipyr_deobf.cache import ResultCache, registry_fingerprint
+from vipyr_deobf.deobf_base import (
+    DEOBFS,
+    Deobfuscator,
+    ScanContext,
+    iter_deobfs,
+    load_all_deobfs,
+    load_deobfs,
+    open_sample,
+    scan_deobfs,
+)
+from vipyr_deobf.deobf_utils import (
+    merge_layer_entries,
+    observe_layers,
+    record_layer_entries,
+    render_layer,
+)
+from vipyr_deobf.exceptions import (
+    DeobfuscationFailError,
+    SampleTimeoutError,
+    WorkerDiedError,
+)
+from vipyr_deobf.result import DeobfResult, extract_iocs
+from vipyr_deobf.supervise import NO_LIMITS, Limits, run_isolated, time_limit
+
+logger = logging.getLogger('deobf')
+
+GLOB_CHARS = frozenset('*?[')
+
+
+@dataclass(slots=True)
+class Progress:
+    """
+    Follows the schema currently running on a sample through the layers it reports
+    The last layer is kept as partial output in case the sample runs out of time or memory
+    """
+    deobf: Deobfuscator[Any] | None = None
+    layer: Any = None
+    layer_timings: list[float] = field(default_factory=list)
+    mark: float = 0.0
+
+    def start(self, deobf: Deobfuscator[Any]) -> None:
+        self.deobf, self.layer, self.layer_timings = deobf, None, []
+        self.mark = time.perf_counter()
+
+    def observe(self, layer: Any) -> None:
+        now = time.perf_counter()
+        self.layer_timings.append(now - self.mark)
+        self.mark = now
+        self.layer = layer
+
+    def fill(self, result: DeobfResult) -> None:
+        if self.deobf is not None:
+            result.schema, result.version = self.deobf.name, self.deobf.version
+        result.layers = len(self.layer_timings)
+        result.layer_timings = self.layer_timings
+
+
+def collect_paths(spec: str) -> list[Path]:
+    """
+    Expands a batch spec into sample paths
+    :param spec: A directory (walked recursively), a glob pattern, or a list file with one path per line
+    """
+    path = Path(spec)
+    if path.is_dir():
+        return sorted(file for file in path.rglob('*') if file.is_file())
+    if GLOB_CHARS.intersection(spec):
+        return sorted(
+            file for match in glob.iglob(spec, recursive=True)
+            if (file := Path(match)).is_file()
+        )
+    if path.is_file():
+        with open(path, 'r') as file:
+            return [
+                Path(line)
+                for raw_line in file
+                if (line := raw_line.strip()) and not line.startswith('#')
+            ]
+    raise FileNotFoundError(f'{spec} is not a directory, glob or list file')
+
+
+def parse_request(request: Any) -> tuple[str, str | bytes | None]:
+    """
+    Reads the sample out of a request record
+    :return: The sample's label, and its inline source, as bytes if it was base64 encoded so it is decoded
+        like a file, or None if it should be read from the label as a path
+    :raises ValueError: If the record is malformed
+    """
+    match request:
+        case {'source': str(source)}:
+            return '<source>', source
+        case {'content': str(content)}:
+            try:
+                return '<content>', base64.b64decode(content, validate=True)
+            except binascii.Error as exc:
+                raise ValueError(f'content is not valid base64: {exc}')
+        case {'path': str(path)}:
+            return path, None
+        case dict():
+            raise ValueError('Request must contain one of source, content or path')
+        case _:
+            raise ValueError('Request must be a JSON object')
+
+
+def load_worker_deobfs(types: str) -> None:
+    """
+    Pool initializer; a no-op for forked workers, which inherit the parent's registry
+    """
+    if DEOBFS:
+        return
+    if types == 'auto':
+        load_all_deobfs()
+    else:
+        load_deobfs(types)
+
+
+def deobf_sample(
+    path: Path | str,
+    skip_scan: bool = False,
+    timeout: float = 0,
+    source: str | bytes | None = None,
+    cache: ResultCache | None = None,
+) -> DeobfResult:
+    """
+    Worker entry point: reads, scans and deobfuscates a single sample
+    Never raises, so one broken sample cannot take down the pool
+    A sample that runs out of time or memory keeps the last layer its schema peeled as output
+    The timeout is a SIGALRM in the calling thread, which Python only handles between bytecodes, so a sample
+    stuck in a single C call (a huge regex, decompression or int conversion) overruns it; only
+    supervised_sample can stop those
+    :param source: Inline source to deobfuscate instead of reading path, which is then only a label
+    :param cache: Result cache to check before, and fill after, deobfuscating
+    """
+    start = time.perf_counter()
+    result = DeobfResult(str(path), 'fail')
+    progress = Progress()
+    try:
+        # The alarm is armed and disarmed within the try, so it cannot fire where nothing catches it
+        with time_limit(timeout), ExitStack() as stack, observe_layers(progress.observe):
+            ctx = ScanContext(source if source is not None else stack.enter_context(open_sample(path)))
+            result.size = len(memoryview(ctx.data))
+            result.timings['read'] = time.perf_counter() - start
+            _deobf_context(result, path, ctx, skip_scan, cache, progress)
+    except SampleTimeoutError as exc:
+        result.status = 'timeout'
+        result.error = str(exc) or f'Exceeded time limit of {timeout}s'
+    except MemoryError:
+        result.status = 'oom'
+        result.error = 'Exceeded memory limit'
+    # Schemas run on hostile input, where any exception can surface, and one sample's failure must
+    # become its result rather than take down the worker. SampleTimeoutError is a BaseException, so
+    # this cannot swallow the time limit
+    except Exception as exc:  # noqa: BLE001
+        result.status = 'error'
+        result.error = f'{type(exc).__name__}: {exc}'
+    finally:
+        result.elapsed = time.perf_counter() - start
+    # Outside the except blocks, so the failed call's frames have been freed
+    if result.status in ('timeout', 'oom') and progress.layer is not None:
+        try:
+            result.output = render_layer(progress.layer)
+            progress.fill(result)
+        except MemoryError:
+            pass
+    return result
+
+
+def supervised_sample(
+    path: Path | str,
+    skip_scan: bool = False,
+    timeout: float = 0,
+    source: str | bytes | None = None,
+    cache: ResultCache | None = None,
+    limits: Limits = NO_LIMITS,
+) -> DeobfResult:
+    """
+    Runs deobf_sample in a forked child under limits, so a hostile sample can only exhaust
+    its own process. Falls back to deobf_sample where fork is unavailable
+    """
+    if not hasattr(os, 'fork'):
+        return deobf_sample(path, skip_scan, timeout, source, cache)
+    start = time.perf_counter()
+    try:
+        result, layer_entries = run_isolated(
+            partial(record_layer_entries, partial(deobf_sample, path, skip_scan, timeout, source, cache)),
+            timeout,
+            limits,
+        )
+    except SampleTimeoutError as exc:
+        return DeobfResult(str(path), 'timeout', elapsed=time.perf_counter() - start, error=str(exc))
+    except WorkerDiedError as exc:
+        return DeobfResult(str(path), 'error', elapsed=time.perf_counter() - start, error=str(exc))
+    # Keep what the child peeled for later samples in this process
+    merge_layer_entries(layer_entries)
+    return result
+
+
+def _deobf_context(
+    result: DeobfResult,
+    path: Path | str,
+    ctx: ScanContext,
+    skip_scan: bool,
+    cache: ResultCache | None,
+    progress: Progress,
+) -> None:
+    """
+    Runs the cache lookup, scan and deobf phases of deobf_sample, filling in result
+    """
+    timings = result.timings
+    if cache is not None:
+        cache_key, input_sha256 = cache.key(
+            ctx.data,
+            registry_fingerprint([*iter_deobfs()]),
+            skip_scan,
+        )
+        entry = cache.get(cache_key)
+        if entry is not None:
+            result.status = 'success'
+            result.schema, result.version = entry.schema, entry.version
+            result.output = entry.output
+            result.iocs = extract_iocs(entry.output)
+            result.cached = True
+            return
+    mark = time.perf_counter()
+    deobfs: list[Deobfuscator[Any]]
+    deobfs = [*iter_deobfs()] if skip_scan else scan_deobfs(ctx)
+    timings['scan'] = time.perf_counter() - mark
+    timings['deobf'] = 0.0
+    for deobf in deobfs:
+        progress.start(deobf)
+        mark = progress.mark
+        try:
+            results = deobf.deobf(ctx)
+            deobf_end = time.perf_counter()
+            output = deobf.format_results(results)
+        except DeobfuscationFailError:
+            timings['deobf'] += time.perf_counter() - mark
+            logger.warning(f'Deobfuscation of {path} with schema {deobf.name} failed')
+        else:
+            timings['deobf'] += deobf_end - mark
+            timings['format'] = time.perf_counter() - deobf_end
+            result.status = 'success'
+            progress.fill(result)
+            result.output = output
+            result.iocs = extract_iocs(output)
+            if cache is not None:
+                cache.put(cache_key, deobf.name, deobf.version, output, input_sha256)
+            break
+
+
+class SamplePool:
+    """
+    Process pool running deobf_sample on each sample, or supervised_sample if there are limits
+    Unlike multiprocessing.Pool, it notices a worker killed outside Python: every sample left in
+    the broken pool fails with an error result, and the pool is replaced on the next submit
+    """
+
+    def __init__(self, types: str, jobs: int, limits: Limits | None = None):
+        self.types = types
+        self.jobs = jobs
+        self.limits = limits
+        self.executor = self.new_executor()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_exc_info: object) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+    def new_executor(self) -> ProcessPoolExecutor:
+        # Forked workers inherit the parent's registry, spawned ones load it on startup
+        start_methods = multiprocessing.get_all_start_methods()
+        return ProcessPoolExecutor(
+            self.jobs,
+            mp_context=multiprocessing.get_context('fork' if 'fork' in start_methods else 'spawn'),
+            initializer=load_worker_deobfs,
+            initargs=(self.types,),
+        )
+
+    def submit(
+        self,
+        path: Path | str,
+        skip_scan: bool = False,
+        timeout: float = 0,
+        source: str | bytes | None = None,
+        cache: ResultCache | None = None,
+    ) -> Future[DeobfResult]:
+        args = (path, skip_scan, timeout, source, cache)
+        try:
+            return self._submit(args)
+        except BrokenProcessPool:
+            logger.error('A worker died, restarting the pool')
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = self.new_executor()
+            return self._submit(args)
+
+    def _submit(self, args: tuple[Any, ...]) -> Future[DeobfResult]:
+        if self.limits is None:
+            return self.executor.submit(deobf_sample, *args)
+        return self.executor.submit(supervised_sample, *args, limits=self.limits)
+
+    @staticmethod
+    def result(future: Future[DeobfResult], label: Path | str) -> DeobfResult:
+        """
+        Result of a finished submit, or an error result if its worker died
+        """
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            return DeobfResult(str(label), 'error', error='Worker process died')
+        # deobf_sample never raises, so anything else is the pool failing to pass the sample or its
+        # result along, e.g. an unpicklable one, which must not leave the caller waiting for it forever
+        except Exception as exc:  # noqa: BLE001
+            return DeobfResult(str(label), 'error', error=f'{type(exc).__name__}: {exc}')
+
+
+def run_batch(
+    paths: list[Path],
+    types: str = 'auto',
+    jobs: int | None = None,
+    skip_scan: bool = False,
+    timeout: float = 0,
+    cache: ResultCache | None = None,
+    limits: Limits | None = None,
+) -> Iterator[DeobfResult]:
+    """
+    Deobfuscates every path over a process pool, yielding results as they complete
+    :param timeout: Per-sample time limit in seconds, 0 to disable
+    :param limits: If given, each sample runs in its own forked child under these limits
+    """
+    if not DEOBFS:
+        load_worker_deobfs(types)
+    jobs = jobs or os.cpu_count() or 1
+    logger.info(f'Starting batch of {len(paths)} samples over {jobs} workers')
+    remaining = iter(paths)
+    pending: dict[Future[DeobfResult], Path] = {}
+    with SamplePool(types, jobs, limits) as pool:
+        while True:
+            # Keep every worker busy without queueing the whole batch up front
+            for path in islice(remaining, 2 * jobs - len(pending)):
+                pending[pool.submit(path, skip_scan, timeout, cache=cache)] = path
+            if not pending:
+                break
+            for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                yield pool.result(future, pending.pop(future))
+
+
+@dataclass(slots=True)
+class BatchStats:
+    samples: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    out_of_memory: int = 0
+    errored: int = 0
+    total_bytes: int = 0
+    elapsed: float = 0.0
+
+    def add(self, result: DeobfResult) -> None:
+        self.samples += 1
+        self.total_bytes += result.size
+        match result.status:
+            case 'success':
+                self.succeeded += 1
+            case 'timeout':
+                self.timed_out += 1
+            case 'oom':
+                self.out_of_memory += 1
+            case 'error':
+                self.errored += 1
+            case _:
+                self.failed += 1
+
+    def summary(self) -> str:
+        elapsed = self.elapsed or float('nan')
+        return (
+            f'{self.samples} samples in {self.elapsed:.2f}s: '
+            f'{self.succeeded} succeeded, {self.failed} failed, '
+            f'{self.timed_out} timed out, {self.out_of_memory} out of memory, {self.errored} errored\n'
+            f'Throughput: {self.samples / elapsed:.2f} samples/s, '
+            f'{self.total_bytes / elapsed / 1e6:.2f} MB/s'
+        )
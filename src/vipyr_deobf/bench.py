@@ -0,0 +1,404 @@
+"""
+Benchmarks: times scan, deobf and format of the schema that handles each sample, and the cold start
+of a fresh interpreter, then reports throughput and compares against a saved baseline
+
+    python -m vipyr_deobf.bench 'tests/**/*.obf' --save baseline.json
+    python -m vipyr_deobf.bench 'tests/**/*.obf' --compare baseline.json
+
+    python -m vipyr_deobf.bench --synthetic 10000,100000,1000000 --memory
+
+Every phase is repeated and the best time kept, which is the least noisy estimate of its cost
+Layer caches are cleared before every repetition, so each one peels every layer again
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import platform
+import subprocess
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from vipyr_deobf.deobf_base import (
+    DEOBFS,
+    Deobfuscator,
+    ScanContext,
+    load_all_deobfs,
+    load_deobfs,
+    scan_deobfs,
+)
+from vipyr_deobf.deobf_utils import clear_layer_caches
+from vipyr_deobf.exceptions import DeobfuscationFailError
+
+logger = logging.getLogger('deobf')
+
+BASELINE_FORMAT = 1
+
+# Growth exponent above which the report flags a schema, leaving room for noise and constant overheads
+SUPERLINEAR = 1.25
+
+COLD_START_SNIPPETS = {
+    'interpreter': 'pass',
+    'import': 'import vipyr_deobf.cli',
+    'load': 'import vipyr_deobf.cli; from vipyr_deobf.deobf_base import load_all_deobfs; load_all_deobfs()',
+}
+
+
+@dataclass(slots=True)
+class SampleTiming:
+    """
+    Best times in seconds of each phase on one sample
+    """
+    schema: str
+    size: int
+    scan: float
+    deobf: float
+    format: float
+    peak_memory: int | None = None
+
+    @property
+    def total(self) -> float:
+        return self.scan + self.deobf + self.format
+
+
+@dataclass(slots=True)
+class Regression:
+    name: str
+    phase: str
+    old: float
+    new: float
+
+    def __str__(self) -> str:
+        # A phase the baseline timed at 0 can still regress past min_delta, with no ratio to report
+        change = f'{self.new / self.old - 1:+.1%}' if self.old else 'new'
+        return f'{self.name} {self.phase}: {self.old:.6f}s -> {self.new:.6f}s ({change})'
+
+
+def find_schema(data: bytes) -> Deobfuscator[Any] | None:
+    """
+    :return: The schema that deobfuscates data in a normal run, i.e. the first match that succeeds
+    """
+    for deobf in scan_deobfs(data):
+        try:
+            deobf.format_results(deobf.deobf(data))
+        except DeobfuscationFailError:
+            continue
+        except Exception:
+            logger.exception(f'Schema {deobf.name}v{deobf.version} crashed')
+            continue
+        return deobf
+    return None
+
+
+def time_sample(deobf: Deobfuscator[Any], data: bytes, repeat: int = 5) -> SampleTiming:
+    """
+    Times scan, deobf and format of deobf on data, keeping the best of repeat runs of each
+    Every phase starts from a fresh ScanContext, so decoding and parsing are counted where a normal run pays for them
+    """
+    scan = deobf_time = format_time = float('inf')
+    for _ in range(repeat):
+        clear_layer_caches()
+        start = time.perf_counter()
+        deobf.scan(ScanContext(data))
+        scanned = time.perf_counter()
+        results = deobf.deobf(ScanContext(data))
+        deobfuscated = time.perf_counter()
+        deobf.format_results(results)
+        formatted = time.perf_counter()
+        scan = min(scan, scanned - start)
+        deobf_time = min(deobf_time, deobfuscated - scanned)
+        format_time = min(format_time, formatted - deobfuscated)
+    return SampleTiming(f'{deobf.name}v{deobf.version}', len(data), scan, deobf_time, format_time)
+
+
+def measure_memory(deobf: Deobfuscator[Any], data: bytes) -> int:
+    """
+    :return: Peak bytes allocated by a deobf and format of data, traced in a separate untimed run
+    """
+    import tracemalloc
+
+    clear_layer_caches()
+    tracemalloc.start()
+    try:
+        deobf.format_results(deobf.deobf(ScanContext(data)))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def read_samples(paths: Iterable[Path]) -> Iterator[tuple[str, bytes]]:
+    for path in paths:
+        data = path.read_bytes()
+        if data.strip():
+            yield str(path), data
+
+
+def synthetic_samples(
+    sizes: Iterable[int],
+    layers: int = 1,
+    depth: int = 1,
+    schemas: Iterable[str] | None = None,
+) -> Iterator[tuple[str, bytes]]:
+    """
+    Generates a sample of every payload size for each schema, named schema:size
+    Schemas that only have a single layer get one whatever layers is
+    """
+    from vipyr_deobf.generate import GENERATORS, SINGLE_LAYER, generate
+
+    for schema in GENERATORS if schemas is None else schemas:
+        for size in sizes:
+            sample = generate(schema, size, 1 if schema in SINGLE_LAYER else layers, depth)
+            yield f'{schema}:{size}', sample.encode()
+
+
+def time_samples(
+    samples: Iterable[tuple[str, bytes]],
+    repeat: int = 5,
+    memory: bool = False,
+) -> Iterator[tuple[str, SampleTiming]]:
+    """
+    Times every sample some loaded schema can deobfuscate, skipping the rest
+    :param samples: Pairs of a name and the sample
+    :param memory: Whether to measure peak memory as well, see measure_memory
+    """
+    for name, data in samples:
+        deobf = find_schema(data)
+        if deobf is None:
+            logger.error(f'No schema deobfuscates {name}, skipping')
+            continue
+        timing = time_sample(deobf, data, repeat)
+        if memory:
+            timing.peak_memory = measure_memory(deobf, data)
+        yield name, timing
+
+
+def growth(samples: dict[str, SampleTiming]) -> dict[str, tuple[float, float | None]]:
+    """
+    Estimates how time and peak memory grow with input size for each schema, from its smallest and
+    largest sample, as the exponent k in cost ~ size ** k. Linear growth is 1, quadratic is 2
+    :return: Schema -> time exponent, and memory exponent if memory was measured
+    """
+    by_schema: dict[str, list[SampleTiming]] = {}
+    for timing in samples.values():
+        by_schema.setdefault(timing.schema, []).append(timing)
+    exponents: dict[str, tuple[float, float | None]] = {}
+    for schema, timings in by_schema.items():
+        small = min(timings, key=lambda timing: timing.size)
+        large = max(timings, key=lambda timing: timing.size)
+        if large.size <= small.size * 2:
+            continue
+        scale = math.log(large.size / small.size)
+        memory = None
+        if small.peak_memory and large.peak_memory:
+            memory = math.log(large.peak_memory / small.peak_memory) / scale
+        exponents[schema] = math.log(large.total / small.total) / scale, memory
+    return exponents
+
+
+def time_cold_start(repeat: int = 5) -> dict[str, float]:
+    """
+    Best wall time of a fresh interpreter, then of importing the CLI and of loading every deobfuscator on top of it
+    """
+    best = {}
+    for name, snippet in COLD_START_SNIPPETS.items():
+        best[name] = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', snippet], check=True)
+            best[name] = min(best[name], time.perf_counter() - start)
+    return {
+        name: seconds if name == 'interpreter' else seconds - best['interpreter']
+        for name, seconds in best.items()
+    }
+
+
+def make_baseline(samples: dict[str, SampleTiming], cold_start: dict[str, float]) -> dict[str, Any]:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        package_version = version('vipyr-deobf')
+    except PackageNotFoundError:
+        package_version = None
+    return {
+        'format': BASELINE_FORMAT,
+        'package': package_version,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'samples': {name: asdict(timing) for name, timing in samples.items()},
+        'cold_start': cold_start,
+    }
+
+
+def compare(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+    threshold: float = 0.25,
+    min_delta: float = 0.001,
+) -> list[Regression]:
+    """
+    Finds phases that got slower than in baseline, only comparing what both runs measured
+    :param threshold: Relative slowdown that counts as a regression, e.g. 0.25 for 25%
+    :param min_delta: Slowdowns of fewer seconds are noise whatever their relative size
+    """
+    pairs = [
+        (name, phase, old[phase], new[phase])
+        for name, new in current['samples'].items()
+        if (old := baseline['samples'].get(name)) is not None and old['schema'] == new['schema']
+        for phase in ('scan', 'deobf', 'format')
+    ]
+    pairs += [
+        ('cold start', phase, baseline['cold_start'][phase], seconds)
+        for phase, seconds in current['cold_start'].items()
+        if phase in baseline.get('cold_start', {})
+    ]
+    return [
+        Regression(name, phase, old, new)
+        for name, phase, old, new in pairs
+        if new - old > max(old * threshold, min_delta)
+    ]
+
+
+def format_report(samples: dict[str, SampleTiming], cold_start: dict[str, float]) -> str:
+    width = max((len(name) for name in samples), default=6)
+    lines = [
+        (
+            f'{"Sample":<{width}}  {"Schema":<14} {"Size":>10} {"Scan":>10} {"Deobf":>10} {"Format":>10} '
+            f'{"Samples/s":>10} {"MB/s":>8}'
+        )
+    ]
+    for name, timing in samples.items():
+        lines.append(
+            f'{name:<{width}}  {timing.schema:<14} {timing.size:>10} {timing.scan:>10.6f} {timing.deobf:>10.6f} '
+            f'{timing.format:>10.6f} {1 / timing.total:>10.2f} {timing.size / timing.total / 1e6:>8.2f}'
+        )
+    if samples:
+        total = sum(timing.total for timing in samples.values())
+        size = sum(timing.size for timing in samples.values())
+        lines.append(
+            f'{len(samples)} samples, {size} bytes in {total:.6f}s: '
+            f'{len(samples) / total:.2f} samples/s, {size / total / 1e6:.2f} MB/s'
+        )
+    if any(timing.peak_memory is not None for timing in samples.values()):
+        lines.append('Peak memory: ' + ', '.join(
+            f'{name} {timing.peak_memory / 1e6:.2f} MB'
+            for name, timing in samples.items() if timing.peak_memory is not None
+        ))
+    for schema, (time_exponent, memory_exponent) in growth(samples).items():
+        line = f'Growth of {schema}: time ~ size^{time_exponent:.2f}'
+        if memory_exponent is not None:
+            line += f', memory ~ size^{memory_exponent:.2f}'
+        if max(time_exponent, memory_exponent or 0) > SUPERLINEAR:
+            line += ' (superlinear)'
+        lines.append(line)
+    if cold_start:
+        lines.append(
+            'Cold start: ' + ', '.join(f'{name} {seconds:.6f}s' for name, seconds in cold_start.items())
+        )
+    return '\n'.join(lines)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='Vipyr Deobfuscator Benchmarks',
+        description='Times each schema on a set of samples, and compares the results against a baseline',
+    )
+    parser.add_argument(
+        'samples',
+        nargs='*',
+        help='directories, globs or list files of samples, as in batch mode',
+    )
+    parser.add_argument(
+        '-t',
+        '--type',
+        default='auto',
+        type=str,
+        help='deobfuscators to load, see vipyr-deobf --help for options (defaults to auto)',
+    )
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type=int,
+        default=5,
+        help='times to run each phase, keeping the best (defaults to 5)',
+    )
+    parser.add_argument(
+        '--synthetic',
+        metavar='SIZES',
+        help='also time generated samples of every schema with these comma separated payload sizes in bytes, '
+        'and report how time grows with size',
+    )
+    parser.add_argument(
+        '--schemas',
+        help='comma separated schemas to generate samples of with --synthetic (defaults to all)',
+    )
+    parser.add_argument('--layers', type=int, default=1, help='layers of generated samples (defaults to 1)')
+    parser.add_argument('--depth', type=int, default=1, help='nesting depth of generated samples (defaults to 1)')
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory of each sample')
+    parser.add_argument('--no-cold-start', action='store_true', help='skip timing fresh interpreter starts')
+    parser.add_argument('--save', metavar='FILE', help='write the results to FILE as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results against the baseline in FILE')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=25,
+        metavar='PERCENT',
+        help='slowdown over the baseline that counts as a regression (defaults to 25)',
+    )
+    parser.add_argument(
+        '--min-delta',
+        type=float,
+        default=0.001,
+        metavar='SECONDS',
+        help='ignore slowdowns smaller than this, as noise (defaults to 0.001)',
+    )
+    return parser
+
+
+def run():
+    from vipyr_deobf.batch import collect_paths
+
+    args = get_parser().parse_args()
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.ERROR)
+    # The schemas log every step, which would be timed as well
+    logging.getLogger('deobf').setLevel(logging.ERROR)
+    logging.getLogger('hyperion').setLevel(logging.CRITICAL)
+
+    if not DEOBFS:
+        if args.type == 'auto':
+            load_all_deobfs()
+        else:
+            load_deobfs(args.type)
+    inputs = read_samples(path for spec in args.samples for path in collect_paths(spec))
+    if args.synthetic is not None:
+        sizes = [int(size) for size in args.synthetic.split(',')]
+        schemas = None if args.schemas is None else args.schemas.split(',')
+        inputs = itertools.chain(inputs, synthetic_samples(sizes, args.layers, args.depth, schemas))
+    samples = dict(time_samples(inputs, args.repeat, args.memory))
+    cold_start = {} if args.no_cold_start else time_cold_start(args.repeat)
+    print(format_report(samples, cold_start))
+
+    current = make_baseline(samples, cold_start)
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump(current, file, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        if baseline.get('format') != BASELINE_FORMAT:
+            sys.exit(f'{args.compare} is not a baseline this version can read')
+        regressions = compare(baseline, current, args.threshold / 100, args.min_delta)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold}% against {args.compare}')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,174 @@
+"""
+Content-addressed on-disk cache of deobfuscation results
+Entries are keyed on the SHA-256 of the input bytes together with the package version, the
+source hash of the shared deobfuscator helpers, and the name, version and source hash of every
+loaded deobfuscator, so editing a deobfuscator module invalidates everything it could have produced. Stale entries are never hit again
+and age out through the size-bounded LRU eviction
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+from vipyr_deobf.deobf_base import Deobfuscator
+
+logger = logging.getLogger('deobf')
+
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+# Modules every deobfuscator builds on, a change to them can change any result
+SHARED_MODULES = ('vipyr_deobf.deobf_base', 'vipyr_deobf.deobf_utils')
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'vipyr-deobf'
+
+
+@cache
+def package_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version('vipyr-deobf')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+@cache
+def module_hash(module_name: str) -> str:
+    module = sys.modules.get(module_name)
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return 'unknown'
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def registry_fingerprint(deobfs: list[Deobfuscator[Any]]) -> str:
+    """
+    Hashes the source of the shared modules, and the name, version and module source of each deobfuscator
+    """
+    digest = hashlib.sha256(package_version().encode())
+    for module_name in SHARED_MODULES:
+        digest.update(f'\0{module_hash(module_name)}'.encode())
+    for deobf in sorted(deobfs, key=lambda deobf: (deobf.name, deobf.version)):
+        digest.update(
+            f'\0{deobf.name}\0{deobf.version}\0{module_hash(deobf.deobf_func.__module__)}'.encode()
+        )
+    return digest.hexdigest()
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    schema: str
+    version: int
+    output: str
+    input_sha256: str
+    created: float
+
+
+@dataclass(slots=True)
+class ResultCache:
+    """
+    Failing to read or write the cache is logged and otherwise treated as a miss, a result is never
+    lost over it
+    Eviction scans the whole directory, so it only runs once the cache may have outgrown max_size:
+    the size found by the last scan plus what this process wrote since. Other processes' writes are
+    picked up by rescanning after every max_size / 64 bytes written
+    """
+    path: Path
+    max_size: int = DEFAULT_CACHE_SIZE
+    # Size of the cache at the last scan, -1 before the first one
+    size: int = field(default=-1, repr=False)
+    written: int = field(default=0, repr=False)
+
+    @staticmethod
+    def key(data: bytes, fingerprint: str, skip_scan: bool = False) -> tuple[str, str]:
+        """
+        :return: The cache key, and the SHA-256 of the input
+        """
+        input_sha256 = hashlib.sha256(data).hexdigest()
+        key = hashlib.sha256(f'{input_sha256}\0{fingerprint}\0{skip_scan}'.encode()).hexdigest()
+        return key, input_sha256
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / f'{key}.json'
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, 'r') as file:
+                entry = CacheEntry(**json.load(file))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError):
+            logger.warning(f'Corrupt cache entry {entry_path}, removing it')
+            entry_path.unlink(missing_ok=True)
+            return None
+        except OSError as exc:
+            logger.warning(f'Could not read cache entry {entry_path}: {exc}')
+            return None
+        # Bump the mtime so eviction sees this entry as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, schema: str, version: int, output: str, input_sha256: str) -> None:
+        entry_path = self.entry_path(key)
+        entry = CacheEntry(schema, version, output, input_sha256, time.time())
+        data = json.dumps(asdict(entry)).encode()
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+            self.written += len(data)
+            if (
+                self.size < 0
+                or self.size + self.written > self.max_size
+                or self.written > self.max_size // 64
+            ):
+                self.evict()
+        except OSError as exc:
+            logger.warning(f'Could not write cache entry {entry_path}: {exc}')
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in max_size
+        """
+        entries: list[tuple[float, int, str]] = []
+        total = 0
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total > self.max_size:
+            entries.sort()
+            for _, size, path in entries:
+                Path(path).unlink(missing_ok=True)
+                total -= size
+                if total <= self.max_size:
+                    break
+        self.size, self.written = total, 0
@@ -2,17 +2,36 @@
 import argparse
 import importlib.util
 import logging
-from typing import Any
+import os
+import sys
+import time
+from contextlib import ExitStack, closing
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TextIO
 
 from vipyr_deobf.deobf_base import (
     Deobfuscator,
+    ScanContext,
     get_available_deobfs,
     iter_deobfs,
     load_all_deobfs,
     load_deobfs,
+    open_sample,
+    scan_deobfs,
 )
-from vipyr_deobf.exceptions import DeobfuscationFailError
-from vipyr_deobf.utils import Color, setup_logging
+from vipyr_deobf.deobf_utils import observe_layers
+from vipyr_deobf.exceptions import (
+    DeobfuscationFailError,
+    SampleTimeoutError,
+    WorkerDiedError,
+)
+from vipyr_deobf.profiling import RunProfile
+from vipyr_deobf.supervise import run_isolated, time_limit
+from vipyr_deobf.utils import Color, add_limit_arguments, get_limits, setup_logging
+
+if TYPE_CHECKING:
+    from vipyr_deobf.cache import ResultCache
 
 
 def get_parser():
@@ -27,7 +46,12 @@ def get_parser():
         ),
         formatter_class=argparse.RawTextHelpFormatter,
     )
-    parser.add_argument('path', help='path to obfuscated file')
+    parser.add_argument(
+        'path',
+        nargs='?',
+        help='path to obfuscated file, with --batch a directory, glob or list file, '
+        'or with --jsonl a record file (defaults to stdin)',
+    )
     parser.add_argument(
         '-t',
         '--type',
@@ -36,7 +60,9 @@ def get_parser():
         help='type of obfuscation used, see help for options (defaults to auto)',
     )
     parser.add_argument(
-        '-o', '--output', help='file to output deobf result to (defaults to stdout)'
+        '-o',
+        '--output',
+        help='file to output deobf result to, or directory in batch mode (defaults to stdout)',
     )
     parser.add_argument(
         '-s',
@@ -44,6 +70,77 @@ def get_parser():
         action='store_true',
         help='skip scanning phase to identify schema',
     )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='print the result as compact JSON, with the schema, layers peeled, IOCs and timings',
+    )
+    parser.add_argument(
+        '--race',
+        action='store_true',
+        help='run all matching schemas at once in separate processes, keeping the result serial mode would give',
+    )
+    parser.add_argument(
+        '-b',
+        '--batch',
+        action='store_true',
+        help='deobfuscate every sample in a directory, glob or list file over a process pool',
+    )
+    parser.add_argument(
+        '--jsonl',
+        action='store_true',
+        help='read JSON Lines sample records and write one JSON result per line as each finishes',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=os.cpu_count(),
+        help='number of worker processes in batch and jsonl mode (defaults to cpu count)',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=60,
+        help='per-sample time limit in seconds, 0 to disable (defaults to 60)',
+    )
+    add_limit_arguments(parser, 'in every mode but --profile, per schema with --race')
+    parser.add_argument(
+        '--cache',
+        nargs='?',
+        const='',
+        metavar='DIR',
+        help='reuse results of previous runs on identical input, stored in DIR (defaults to ~/.cache/vipyr-deobf)',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=512,
+        help='size limit of the result cache in MB before old entries are evicted (defaults to 512)',
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='print the time spent on each phase and layer, and the top functions by own time, to stderr',
+    )
+    parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=20,
+        metavar='N',
+        help='number of functions and allocation sites to list with --profile, 0 for phase timings only '
+        '(defaults to 20)',
+    )
+    parser.add_argument(
+        '--profile-dump',
+        metavar='FILE',
+        help='write cProfile statistics of the run to FILE for pstats, implies --profile',
+    )
+    parser.add_argument(
+        '--profile-memory',
+        action='store_true',
+        help='trace allocations and report peak memory, implies --profile (slow)',
+    )
     parser.add_argument('-d', '--debug', action='store_true', help='display debug logs')
     parser.add_argument(
         '--show-expected', action='store_true', help='display expected warnings'
@@ -59,57 +156,297 @@ def run():
         argcomplete.autocomplete(parser)  # type: ignore
 
     args = parser.parse_args()
+    if args.path is None and not args.jsonl:
+        parser.error('the following arguments are required: path')
+    args.profile = args.profile or args.profile_dump is not None or args.profile_memory
+    if args.profile and (args.batch or args.jsonl or args.json or args.race):
+        parser.error('--profile only applies to a single sample run without --batch, --jsonl, --json or --race')
+    if args.race and (args.batch or args.jsonl or args.json):
+        parser.error('--race only applies to a single sample run without --batch, --jsonl or --json')
+    if args.json and (args.batch or args.jsonl):
+        parser.error('--json only applies to a single sample run without --batch or --jsonl')
+    if args.profile and get_limits(args) is not None:
+        parser.error('--profile runs the sample in-process, so it cannot be combined with --isolate, '
+                     '--cpu-limit or --memory-limit')
 
     logger = logging.getLogger('deobf')
+    if args.jsonl or args.json:
+        # stdout carries the results, so it must not carry anything else
+        setup_logging(args, 'ext://sys.stderr')
+        if args.jsonl:
+            run_jsonl_cli(args)
+        else:
+            run_json_cli(args)
+        return
     setup_logging(args)
     logger.info('Logging setup finished')
 
+    if args.batch:
+        run_batch_cli(args)
+        return
+
+    if args.profile:
+        profile = RunProfile(args.profile_top, args.profile_dump, args.profile_memory)
+        with profile.running():
+            run_path(args, profile)
+        profile.report(sys.stderr)
+    else:
+        run_path(args)
+
+
+def run_path(args: argparse.Namespace, profile: RunProfile | None = None):
+    logger = logging.getLogger('deobf')
+    profile = profile or RunProfile()
     logger.info(f'Opening file at {args.path}')
+    with ExitStack() as stack:
+        try:
+            with profile.phase('read'):
+                data = stack.enter_context(open_sample(args.path))
+        except FileNotFoundError:
+            logger.error(f'{args.path} is not a valid path.')
+            return
+        logger.info('Data successfully read from file')
+        ctx = ScanContext(data)
+        limits = get_limits(args)
+        if args.race:
+            # Race mode applies the time and resource limits to each candidate instead
+            run_single(args, ctx, profile)
+        elif limits is None:
+            run_limited(args, ctx, profile)
+        else:
+            try:
+                run_isolated(partial(run_limited, args, ctx), args.timeout, limits)
+            except (SampleTimeoutError, WorkerDiedError) as exc:
+                logger.error(f'Deobfuscation of {args.path} failed: {exc}')
+
+
+def run_limited(args: argparse.Namespace, ctx: ScanContext, profile: RunProfile | None = None):
+    """
+    Runs run_single under the --timeout, logging a sample that runs out of time or memory instead of raising
+    """
+    logger = logging.getLogger('deobf')
     try:
-        with open(args.path, 'r') as file:
-            data = file.read()
-    except FileNotFoundError:
-        logger.error(f'{args.path} is not a valid path.')
-        return
-    logger.info('Data successfully read from file')
+        with time_limit(args.timeout):
+            run_single(args, ctx, profile)
+    except SampleTimeoutError as exc:
+        reason = str(exc) or f'Exceeded time limit of {args.timeout}s'
+        logger.error(f'Deobfuscation of {args.path} ran out of time: {reason}')
+    except MemoryError:
+        logger.error(f'Deobfuscation of {args.path} exceeded the memory limit')
+    finally:
+        # An isolated child exits without flushing its buffers
+        sys.stdout.flush()
 
+
+def run_single(args: argparse.Namespace, ctx: ScanContext, profile: RunProfile | None = None):
+    logger = logging.getLogger('deobf')
+    profile = profile or RunProfile()
     logger.info('Loading deobfuscators...')
-    if args.type == 'auto':
-        load_all_deobfs()
-    else:
-        load_deobfs(args.type)
+    with profile.phase('load'):
+        if args.type == 'auto':
+            load_all_deobfs()
+        else:
+            load_deobfs(args.type)
+
+    cache = get_cache(args)
+    cache_key = input_sha256 = ''
+    if cache is not None:
+        from vipyr_deobf.cache import registry_fingerprint
+
+        with profile.phase('cache lookup'):
+            cache_key, input_sha256 = cache.key(
+                ctx.data,
+                registry_fingerprint([*iter_deobfs()]),
+                args.skip_scan,
+            )
+            entry = cache.get(cache_key)
+        if entry is not None:
+            logger.info(f'Cache hit, results were produced by schema {entry.schema}v{entry.version}')
+            write_output(args, entry.output)
+            return
+        logger.info('Cache miss')
 
     deobfs: list[Deobfuscator[Any]]
     if args.skip_scan:
         deobfs = [*iter_deobfs()]
     else:
         logger.info('Running scanners...')
-        deobfs = []
-        for deobf in iter_deobfs():
-            logger.info(f'Scanning with schema {deobf.name}v{deobf.version}')
-            if deobf.scan(data):
-                logger.info('Scan succeeded, adding to schema list')
-                deobfs.append(deobf)
-            else:
-                logger.info('Scan failed, skipping')
+        scan_timings: dict[str, float] = {}
+        with profile.phase('scan'):
+            deobfs = scan_deobfs(ctx, scan_timings)
+            for name, seconds in scan_timings.items():
+                profile.record(name, seconds)
     logger.info(f'Schema list: {", ".join([deobf.name for deobf in deobfs])}')
 
+    if args.race:
+        race_single(args, ctx, deobfs, cache, cache_key, input_sha256)
+        return
+
     for deobf in deobfs:
         try:
             logger.info(f'Running deobf of {args.path} with schema {deobf.name}')
-            results = deobf.deobf(data)
-            output = deobf.format_results(results)
+            with profile.phase(f'deobf {deobf.name}v{deobf.version}'), observe_layers(profile.observe_layer):
+                results = deobf.deobf(ctx)
+            with profile.phase(f'format {deobf.name}v{deobf.version}'):
+                output = deobf.format_results(results)
         except DeobfuscationFailError as exc:
             logger.exception(
                 f'Deobfuscation of {args.path} with schema {deobf.name} failed:'
             )
-            for var, data in exc.env_vars.items():
-                print(f'{Color.bold_red}{var}{Color.clear}', data, sep='\n', end='\n\n')
+            print_env_vars(exc)
         else:
-            if args.output is None:
-                print(output)
-            else:
-                logger.info(f'Writing results of deobf to file {args.output}')
-                with open(args.output, 'w') as file:
-                    file.write(output)
+            write_output(args, output)
+            if cache is not None:
+                cache.put(cache_key, deobf.name, deobf.version, output, input_sha256)
             break
+
+
+def race_single(
+    args: argparse.Namespace,
+    ctx: ScanContext,
+    deobfs: list[Deobfuscator[Any]],
+    cache: 'ResultCache | None',
+    cache_key: str,
+    input_sha256: str,
+):
+    from vipyr_deobf.race import race_deobfs
+
+    logger = logging.getLogger('deobf')
+    with closing(race_deobfs(deobfs, ctx, get_limits(args), args.timeout)) as outcomes:
+        for deobf, output, exc in outcomes:
+            if exc is None:
+                write_output(args, output)
+                if cache is not None:
+                    cache.put(cache_key, deobf.name, deobf.version, output, input_sha256)
+                break
+            match exc:
+                case DeobfuscationFailError():
+                    logger.error(f'Deobfuscation of {args.path} with schema {deobf.name} failed')
+                    print_env_vars(exc)
+                # Candidates run under their own budgets, so one running out leaves the rest in the race
+                case SampleTimeoutError():
+                    logger.error(f'Schema {deobf.name} exceeded the time limit on {args.path}: {exc}')
+                case MemoryError():
+                    logger.error(f'Schema {deobf.name} exceeded the memory limit on {args.path}')
+                case WorkerDiedError():
+                    logger.error(f'Schema {deobf.name} died on {args.path}: {exc}')
+                case _:
+                    raise exc
+
+
+def print_env_vars(exc: DeobfuscationFailError):
+    for var, value in exc.env_vars.items():
+        print(f'{Color.bold_red}{var}{Color.clear}', value, sep='\n', end='\n\n', file=sys.stderr)
+
+
+def get_cache(args: argparse.Namespace) -> 'ResultCache | None':
+    if args.cache is None:
+        return None
+    from vipyr_deobf.cache import ResultCache, default_cache_dir
+
+    return ResultCache(
+        Path(args.cache) if args.cache else default_cache_dir(),
+        args.cache_size * 1024 * 1024,
+    )
+
+
+def write_output(args: argparse.Namespace, output: str):
+    if args.output is None:
+        print(output)
+    else:
+        logging.getLogger('deobf').info(f'Writing results of deobf to file {args.output}')
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+
+def run_batch_cli(args: argparse.Namespace):
+    from vipyr_deobf.batch import BatchStats, collect_paths, run_batch
+
+    logger = logging.getLogger('deobf')
+    try:
+        paths = collect_paths(args.path)
+    except FileNotFoundError:
+        logger.error(f'{args.path} is not a valid directory, glob or list file.')
+        return
+    if not paths:
+        logger.error(f'No samples found at {args.path}')
+        return
+    root = Path(os.path.commonpath([path.resolve().parent for path in paths]))
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+
+    logger.info('Loading deobfuscators...')
+    if args.type == 'auto':
+        load_all_deobfs()
+    else:
+        load_deobfs(args.type)
+
+    stats = BatchStats()
+    start = time.perf_counter()
+    results = run_batch(
+        paths, args.type, args.jobs, args.skip_scan, args.timeout, get_cache(args), get_limits(args)
+    )
+    for result in results:
+        stats.add(result)
+        if result.status != 'success':
+            logger.error(
+                f'{result.path}: {result.status}'
+                + (f' ({result.error})' if result.error else '')
+            )
+            continue
+        logger.info(
+            f'{result.path}: deobfuscated with schema {result.label}'
+            + (' (cached)' if result.cached else '')
+        )
+        if args.output is None:
+            print(f'{Color.bold_white}== {result.path} ({result.label}) =={Color.clear}')
+            print(result.output)
+        else:
+            out_path = Path(args.output, Path(result.path).resolve().relative_to(root))
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(out_path, 'w') as file:
+                file.write(result.output)
+    stats.elapsed = time.perf_counter() - start
+    print(stats.summary())
+
+
+def run_json_cli(args: argparse.Namespace):
+    from vipyr_deobf.batch import deobf_sample, supervised_sample
+
+    logging.getLogger('deobf').info('Loading deobfuscators...')
+    if args.type == 'auto':
+        load_all_deobfs()
+    else:
+        load_deobfs(args.type)
+    limits = get_limits(args)
+    if limits is None:
+        result = deobf_sample(args.path, args.skip_scan, args.timeout, cache=get_cache(args))
+    else:
+        result = supervised_sample(args.path, args.skip_scan, args.timeout, cache=get_cache(args), limits=limits)
+    write_output(args, result.to_json())
+
+
+def run_jsonl_cli(args: argparse.Namespace):
+    from vipyr_deobf.jsonl import run_jsonl
+
+    logger = logging.getLogger('deobf')
+    logger.info('Loading deobfuscators...')
+    if args.type == 'auto':
+        load_all_deobfs()
+    else:
+        load_deobfs(args.type)
+
+    with ExitStack() as stack:
+        records: TextIO = sys.stdin
+        if args.path is not None and args.path != '-':
+            try:
+                records = stack.enter_context(open(args.path, 'r'))
+            except FileNotFoundError:
+                logger.error(f'{args.path} is not a valid path.')
+                return
+        out = sys.stdout if args.output is None else stack.enter_context(open(args.output, 'w'))
+        stats = run_jsonl(
+            records, out, args.type, args.jobs, args.skip_scan, args.timeout, get_cache(args),
+            limits=get_limits(args),
+        )
+    logger.info(stats.summary())
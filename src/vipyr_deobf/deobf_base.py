@@ -1,15 +1,22 @@
+import ast
 import glob
 import importlib.util
-import inspect
 import logging
+import mmap
+import os
 import re
-from collections.abc import Callable, Iterator
+import sys
+import time
+import tokenize
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from functools import cache
 from pathlib import Path
-import sys
 from typing import Any, Generic, TypeVar
 
+from typing_extensions import Buffer
+
 from vipyr_deobf.exceptions import DeobfLoadingError
 
 R = TypeVar('R')
@@ -18,50 +25,275 @@ deobf_path = Path(__file__).parent / 'deobfuscators'
 logger = logging.getLogger('deobf')
 
 
+MMAP_THRESHOLD = 1024 * 1024
+
+
+@contextmanager
+def open_sample(path: Path | str) -> Iterator[Buffer]:
+    """
+    Opens a sample as raw bytes, memory-mapping it if it is large so it is never copied whole
+    The buffer is only valid inside the with block
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < MMAP_THRESHOLD:
+            yield file.read()
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def decode_source(data: Buffer) -> str:
+    """
+    Decodes source code like the interpreter does, honouring a BOM or coding cookie
+    Undecodable bytes become lone surrogates instead of raising, so they round-trip through
+    encode('utf-8', 'surrogateescape')
+    """
+    view = memoryview(data)
+    try:
+        encoding, _ = tokenize.detect_encoding(iter(bytes(view[:4096]).splitlines(True)).__next__)
+        return str(view, encoding, 'surrogateescape')
+    except (SyntaxError, LookupError, StopIteration):
+        return str(view, 'utf-8', 'surrogateescape')
+
+
+@dataclass(slots=True)
+class ScanContext:
+    """
+    The input handed to every scanner during the scan phase
+    The source is either text or a bytes-like object such as an mmap. Text is decoded from
+    bytes the first time something asks for it and bytes are parsed directly, so a sample
+    only rejected on its bytes is never decoded at all
+    The code is parsed the first time a scanner asks for the tree, and the tree (or the
+    SyntaxError) is cached so the scan phase costs one parse however many schemas are loaded
+    Scanners must treat the tree as read-only
+    """
+    source: str | Buffer
+    _code: str | None = field(default=None, init=False, repr=False)
+    _data: bytes | None = field(default=None, init=False, repr=False)
+    _tree: ast.Module | None = field(default=None, init=False, repr=False)
+    _error: SyntaxError | None = field(default=None, init=False, repr=False)
+
+    @property
+    def code(self) -> str:
+        return self.decode()
+
+    def decode(self) -> str:
+        """
+        Decodes the source now instead of on first use of code, and returns it
+        """
+        if self._code is None:
+            source = self.source
+            self._code = source if isinstance(source, str) else decode_source(source)
+        return self._code
+
+    @property
+    def data(self) -> Buffer:
+        if not isinstance(self.source, str):
+            return self.source
+        if self._data is None:
+            self._data = self.source.encode('utf-8', 'surrogateescape')
+        return self._data
+
+    @property
+    def tree(self) -> ast.Module:
+        if self._tree is None:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._tree = ast.parse(self.source)  # pyright: ignore[reportArgumentType]
+            except SyntaxError as exc:
+                self._error = exc
+                raise
+            except ValueError as exc:
+                # Null bytes on older versions, and lone surrogates from undecodable text
+                self._error = SyntaxError(str(exc))
+                raise self._error from exc
+        return self._tree
+
+
+class SchemaScanner:
+    """
+    Base class for scanners that take part in the shared single-pass AST walk
+    Subclasses define visit_<NodeType> methods like an ast.NodeVisitor, minus the recursion,
+    and call matched() or impossible() as soon as they have seen enough to decide
+    The walk ends once every scanner taking part has decided
+    """
+    # Identifiers every input the scanner matches must contain, inputs missing one are ruled out in start
+    requires: tuple[bytes, ...] = ()
+
+    def __init__(self):
+        self.decision: bool | None = None
+
+    @property
+    def decided(self) -> bool:
+        return self.decision is not None
+
+    def matched(self) -> None:
+        self.decision = True
+
+    def impossible(self) -> None:
+        self.decision = False
+
+    def start(self, ctx: ScanContext) -> None:
+        """
+        Called before the walk, text-only scanners can decide here and never need the tree
+        Rules the input out if it lacks any of requires, overrides should call it first
+        """
+        data = ctx.data
+        if not all(re.search(re.escape(literal), data) for literal in self.requires):
+            self.impossible()
+
+    @property
+    def result(self) -> bool:
+        return bool(self.decision)
+
+    @classmethod
+    @cache
+    def visitors(cls) -> tuple[tuple[type[ast.AST], str], ...]:
+        """
+        The node types this scanner is interested in, and the name of the method handling each
+        """
+        return tuple(
+            (node_type, attr)
+            for attr in dir(cls)
+            if attr.startswith('visit_')
+            and isinstance(node_type := getattr(ast, attr[6:], None), type)
+            and issubclass(node_type, ast.AST)
+        )
+
+
+def walk_scanners(tree: ast.AST, scanners: Sequence[SchemaScanner]) -> None:
+    """
+    Walks the tree once in source order, dispatching each node to every undecided scanner
+    that has a visitor for its type, and stops early once all scanners have decided
+    """
+    dispatch: dict[type[ast.AST], list[tuple[SchemaScanner, Callable[[Any], None]]]] = {}
+    for scanner in scanners:
+        for node_type, attr in type(scanner).visitors():
+            dispatch.setdefault(node_type, []).append((scanner, getattr(scanner, attr)))
+    undecided = sum(not scanner.decided for scanner in scanners)
+    if not undecided or not dispatch:
+        return
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        handlers = dispatch.get(type(node))
+        if handlers:
+            for scanner, visitor in handlers:
+                if scanner.decided:
+                    continue
+                visitor(node)
+                if scanner.decided:
+                    undecided -= 1
+            if not undecided:
+                return
+        children = [*ast.iter_child_nodes(node)]
+        children.reverse()
+        stack.extend(children)
+
+
+def run_scanners(ctx: ScanContext, scanners: Sequence[SchemaScanner]) -> list[bool]:
+    """
+    Runs a set of scanners over the input, parsing it at most once and only if a scanner
+    could not decide from the text alone
+    :return: Whether each scanner matched, in the order given
+    """
+    for scanner in scanners:
+        scanner.start(ctx)
+    undecided = [scanner for scanner in scanners if not scanner.decided]
+    if undecided:
+        try:
+            tree = ctx.tree
+        except SyntaxError:
+            logger.warning('Input is not valid python, AST scanners cannot match')
+        else:
+            walk_scanners(tree, undecided)
+    return [scanner.result for scanner in scanners]
+
+
 @dataclass
 class Deobfuscator(Generic[R]):
-    deobf_func: Callable[[str], R]
+    """
+    deobf_func takes the decoded source code, or with takes_bytes the raw bytes-like input,
+    which may be an mmap that must not outlive the call
+    """
+    deobf_func: Callable[[Any], R]
     format_func: Callable[[R], str]
-    scan_func: Callable[[str], bool]
-    name: str = field(init=False)
-    version: int = field(init=False)
-
-    def __post_init__(self):
-        path = Path(inspect.stack()[2].filename)
-        rel_path = path.relative_to(deobf_path)
-        try:
-            module_name, filename = rel_path.parts
-        except ValueError:
-            raise DeobfLoadingError(
-                'Deobfuscator was not initialized in a deobf module: see repo README'
-            )
-        obf_name = normalize_deobf_name(module_name)
-        res = parse_deobf_file_name(filename)
-        if not res:
-            raise DeobfLoadingError(
-                'Filename does not match module name: see repo README'
-            )
-        name, version = res
-        if name != obf_name:
-            raise DeobfLoadingError(
-                'Filename does not match module name: see repo README'
-            )
-        self.name = name
-        self.version = version
+    scan_func: Callable[[ScanContext], bool]
+    scanner: type[SchemaScanner] | None = None
+    signatures: tuple[bytes, ...] = ()
+    name: str = field(kw_only=True)
+    version: int = field(default=1, kw_only=True)
+    takes_bytes: bool = field(default=False, kw_only=True)
 
-    def deobf(self, obf: str) -> R:
-        return self.deobf_func(obf)
+    def deobf(self, obf: str | Buffer | ScanContext) -> R:
+        if not isinstance(obf, ScanContext):
+            obf = ScanContext(obf)
+        return self.deobf_func(obf.data if self.takes_bytes else obf.code)
 
     def format_results(self, res: R) -> str:
         return self.format_func(res)
 
-    def scan(self, obf: str) -> bool:
+    def scan(self, obf: str | Buffer | ScanContext) -> bool:
+        if not isinstance(obf, ScanContext):
+            obf = ScanContext(obf)
         return self.scan_func(obf)
 
 
 DEOBFS: dict[str, dict[int, Deobfuscator[Any]]] = {}
 
 
+class SignaturePrefilter:
+    """
+    Matches the signatures of a set of deobfuscators in a single pass over the input bytes
+    A deobfuscator is a candidate if any of its signatures appear, so signatures must be
+    necessary conditions for its scanner to match. Deobfuscators that declare no signatures
+    cannot be ruled out and are always candidates
+    """
+
+    def __init__(self, deobfs: Sequence[Deobfuscator[Any]]):
+        self.deobfs = [*deobfs]
+        owners: dict[bytes, set[int]] = {}
+        for idx, deobf in enumerate(self.deobfs):
+            for signature in deobf.signatures:
+                owners.setdefault(signature, set()).add(idx)
+        # A match only reports one literal, so credit the owners of any signature inside it too
+        self.owners = {
+            literal: frozenset(
+                idx for signature, idxs in owners.items() if signature in literal for idx in idxs
+            )
+            for literal in owners
+        }
+        self.filtered = frozenset(idx for idxs in owners.values() for idx in idxs)
+        # Longest first so a signature never shadows a longer one starting at the same offset
+        literals = sorted(owners, key=len, reverse=True)
+        self.pattern = re.compile(b'|'.join(map(re.escape, literals))) if literals else None
+
+    def candidates(self, data: bytes) -> list[Deobfuscator[Any]]:
+        missing = set(self.filtered)
+        if self.pattern is not None:
+            pos = 0
+            # Resume right after the start of each match rather than its end, so signatures overlapping it are found
+            while missing and (match := self.pattern.search(data, pos)):
+                missing -= self.owners[match.group()]
+                pos = match.start() + 1
+        return [deobf for idx, deobf in enumerate(self.deobfs) if idx not in missing]
+
+
+_prefilter: SignaturePrefilter | None = None
+
+
+def get_prefilter() -> SignaturePrefilter:
+    """
+    The prefilter over every loaded deobfuscator, compiled once and rebuilt after a register
+    """
+    global _prefilter
+    if _prefilter is None:
+        _prefilter = SignaturePrefilter([*iter_deobfs()])
+    return _prefilter
+
+
 def normalize_deobf_name(name: str) -> str:
     return name.lower().replace(' ', '')
 
@@ -74,6 +306,8 @@ def parse_deobf_file_name(filename: str) -> tuple[str, int] | None:
 
 
 def register(deobf: Deobfuscator[R]) -> None:
+    global _prefilter
+    _prefilter = None
     deobf_versions = DEOBFS.setdefault(deobf.name, {})
     if deobf.version in deobf_versions:
         raise DeobfLoadingError(
@@ -90,21 +324,79 @@ alias_dict = {
 }
 
 
-@cache
-def get_available_deobfs() -> dict[str, dict[int, Path]]:
-    available_deobfs: dict[str, dict[int, Path]] = {}
-    for deobf_dir in deobf_path.iterdir():
+def build_manifest() -> dict[str, dict[int, str]]:
+    """
+    Walks the deobfuscators folder for deobf modules, see repo README for the layout
+    Only used to regenerate deobf_manifest.py, never at runtime
+    :return: Deobf name -> version -> path of the module relative to the deobfuscators folder
+    """
+    manifest: dict[str, dict[int, str]] = {}
+    for deobf_dir in sorted(deobf_path.iterdir()):
+        if not deobf_dir.is_dir():
+            continue
         deobf_name = normalize_deobf_name(deobf_dir.name)
-        available_deobfs[deobf_name] = {
-            res[1]: file
-            for file in deobf_dir.glob(f'{glob.escape(deobf_name)}*.py')
+        manifest[deobf_name] = {
+            res[1]: file.relative_to(deobf_path).as_posix()
+            for file in sorted(deobf_dir.glob(f'{glob.escape(deobf_name)}*.py'))
             if (res := parse_deobf_file_name(file.name)) and res[0] == deobf_name
         }
-    return available_deobfs
+    return manifest
 
 
-def load_deobfs(opt_str: str) -> None:
+def write_manifest() -> None:
+    manifest_path = Path(__file__).parent / 'deobf_manifest.py'
+    with open(manifest_path, 'w') as file:
+        file.write(
+            '"""\n'
+            'Generated by `python -m vipyr_deobf.deobf_base`, rerun it after adding a deobfuscator\n'
+            'Maps deobf name -> version -> path of the module relative to the deobfuscators folder\n'
+            '"""\n\n'
+            'DEOBF_MANIFEST: dict[str, dict[int, str]] = {\n'
+        )
+        file.writelines(f'    {name!r}: {versions!r},\n' for name, versions in build_manifest().items())
+        file.write('}\n')
+
+
+@cache
+def get_available_deobfs() -> dict[str, dict[int, Path]]:
+    from vipyr_deobf.deobf_manifest import DEOBF_MANIFEST
+
+    return {
+        name: {version: deobf_path / rel_path for version, rel_path in versions.items()}
+        for name, versions in DEOBF_MANIFEST.items()
+    }
+
+
+def load_deobf(name: str, version: int, path: Path) -> None:
+    logger.info(f'Loading {path.stem}')
+    full_name = f'{name}.v{version}'
+    spec = importlib.util.spec_from_file_location(full_name, path)
+    if spec is None:
+        raise ValueError(f'Could not find deobf {name} {version}')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[full_name] = module
+    spec.loader.exec_module(module)
+    if version not in DEOBFS.get(name, {}):
+        raise DeobfLoadingError(
+            f'{path.name} did not register version {version} of {name}: see repo README'
+        )
+    logger.info(f'Finished loading {path.stem}')
+
+
+def parse_deobf_types(opt_str: str) -> list[tuple[str, int, Path]]:
+    """
+    :param opt_str: auto, or comma separated schemas with an optional _version suffix
+    :return: Name, version and module path of every deobf selected
+    :raises DeobfLoadingError: If a schema or version does not exist
+    """
     available_deobfs = get_available_deobfs()
+    if opt_str == 'auto':
+        return [
+            (name, version, path)
+            for name, versions in available_deobfs.items()
+            for version, path in versions.items()
+        ]
+    selected: list[tuple[str, int, Path]] = []
     for deobf_type in opt_str.split(','):
         res = re.match(r'([a-zA-Z]+)(?:_(\d+))?$', deobf_type)
         if not res:
@@ -116,32 +408,87 @@ def load_deobfs(opt_str: str) -> None:
             raise DeobfLoadingError(f'{name} is not the name of a deobfuscator')
         elif version not in available_deobfs[name]:
             raise DeobfLoadingError(f'Version {version} of {name} does not exist')
-        full_name = f'{name}.v{version}'
-        spec = importlib.util.spec_from_file_location(
-            full_name,
-            available_deobfs[name][version],
-        )
-        if spec is None:
-            raise ValueError(f'Could not find deobf {name} {version}')
-        module = importlib.util.module_from_spec(spec)
-        sys.modules[full_name] = module
-        spec.loader.exec_module(module)
+        selected.append((name, version, available_deobfs[name][version]))
+    return selected
+
+
+def load_deobfs(opt_str: str) -> None:
+    for name, version, path in parse_deobf_types(opt_str):
+        load_deobf(name, version, path)
 
 
 def load_all_deobfs() -> None:
-    available_deobfs = get_available_deobfs()
-    for name, versions in available_deobfs.items():
-        for version, deobf in versions.items():
-            logger.info(f'Loading {deobf.stem}')
-            full_name = f'{name}.v{version}'
-            spec = importlib.util.spec_from_file_location(full_name, deobf)
-            if spec is None:
-                raise ValueError(f'Could not find deobf {deobf.name}')
-            module = importlib.util.module_from_spec(spec)
-            sys.modules[full_name] = module
-            spec.loader.exec_module(module)
-            logger.info(f'Finished loading {deobf.stem}')
+    load_deobfs('auto')
 
 
 def iter_deobfs() -> Iterator[Deobfuscator[Any]]:
     return (deobf for versions in DEOBFS.values() for deobf in versions.values())
+
+
+def scan_deobfs(
+    data: str | Buffer | ScanContext,
+    timings: dict[str, float] | None = None,
+    prefilter: SignaturePrefilter | None = None,
+) -> list[Deobfuscator[Any]]:
+    """
+    Runs every loaded scanner over data
+    Pass a ScanContext to reuse its decoded text when deobfuscating afterwards
+    The signature prefilter runs first, and deobfuscators whose signatures are absent are
+    never scanned. Deobfuscators with a SchemaScanner share a single walk of the tree,
+    the rest are called one by one with the same ScanContext
+    :param timings: Filled with the seconds spent on the prefilter, the shared walk (including parsing)
+        and each schema scanned on its own
+    :param prefilter: Prefilter over the deobfuscators to scan with, defaults to every loaded one
+    :return: The deobfuscators whose scanners matched, in registration order
+    """
+    ctx = data if isinstance(data, ScanContext) else ScanContext(data)
+    mark = time.perf_counter()
+    if prefilter is None:
+        prefilter = get_prefilter()
+    deobfs = prefilter.candidates(ctx.data)
+    if timings is not None:
+        timings['prefilter'] = time.perf_counter() - mark
+    logger.info(
+        'Prefilter ruled out %d of %d schemas', len(prefilter.deobfs) - len(deobfs), len(prefilter.deobfs)
+    )
+    if not deobfs:
+        return []
+    walked = [deobf for deobf in deobfs if deobf.scanner is not None]
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            'Scanning with schemas %s in a single pass',
+            ', '.join(f'{deobf.name}v{deobf.version}' for deobf in walked),
+        )
+    mark = time.perf_counter()
+    matches = dict(zip(
+        map(id, walked),
+        run_scanners(ctx, [deobf.scanner() for deobf in walked]),
+    ))
+    if timings is not None:
+        timings['walk'] = time.perf_counter() - mark
+
+    scan_results: list[Deobfuscator[Any]] = []
+    for deobf in deobfs:
+        if id(deobf) in matches:
+            matched = matches[id(deobf)]
+        else:
+            logger.info('Scanning with schema %sv%d', deobf.name, deobf.version)
+            mark = time.perf_counter()
+            try:
+                matched = deobf.scan(ctx)
+            except SyntaxError:
+                logger.warning('Input is not valid python, skipping')
+                continue
+            finally:
+                if timings is not None:
+                    timings[f'{deobf.name}v{deobf.version}'] = time.perf_counter() - mark
+        if matched:
+            logger.info('Scan with schema %sv%d succeeded, adding to schema list', deobf.name, deobf.version)
+            scan_results.append(deobf)
+        else:
+            logger.info('Scan with schema %sv%d failed, skipping', deobf.name, deobf.version)
+    return scan_results
+
+
+if __name__ == '__main__':
+    write_manifest()
@@ -0,0 +1,13 @@
+"""
+Generated by `python -m vipyr_deobf.deobf_base`, rerun it after adding a deobfuscator
+Maps deobf name -> version -> path of the module relative to the deobfuscators folder
+"""
+
+DEOBF_MANIFEST: dict[str, dict[int, str]] = {
+    'blankobf': {2: 'BlankObf/blankobf_v2.py'},
+    'fct': {1: 'FCT/fct.py'},
+    'hyperion': {1: 'Hyperion/hyperion.py'},
+    'lzmaspam': {1: 'LzmaSpam/lzmaspam.py'},
+    'pyobfuscate': {1: 'PyObfuscate/pyobfuscate.py'},
+    'vare': {1: 'Vare/vare.py'},
+}
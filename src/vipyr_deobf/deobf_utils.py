@@ -1,11 +1,26 @@
 import ast
 import base64
+import hashlib
+import importlib.util
 import operator
 import re
-from typing_extensions import override
+import sys
+import threading
+import weakref
 import zlib
 from ast import Constant
-from collections.abc import Callable
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Any, Generic, TypeVar
+
+from typing_extensions import override
+
+V = TypeVar('V')
+R = TypeVar('R')
 
 WEBHOOK_REGEX = re.compile(
     r'https?://(?:ptb\.|canary\.)?discord(?:app)?\.com/api(?:/v\d{1,2})?/webhooks/\d{17,21}/[\w-]{68}'
@@ -14,6 +29,252 @@ BYTES_WEBHOOK_REGEX = re.compile(
     br'https?://(?:ptb\.|canary\.)?discord(?:app)?\.com/api(?:/v\d{1,2})?/webhooks/\d{17,21}/[\w-]{68}'
 )
 
+class _LazyModule(ModuleType):
+    """
+    Stands in for a module until one of its attributes is looked up, then imports it and forwards to it
+    Unlike importlib.util.LazyLoader, the stand-in never enters sys.modules, so an import that fails leaves
+    nothing half-initialised behind and is retried on the next lookup, and the import system's own locks
+    make threads racing to the first lookup execute the module once
+    """
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(importlib.import_module(self.__name__), attr)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Imports a module that is only executed on first attribute access
+    Deobfuscators use this for heavy decoding dependencies, so loading a schema to run its
+    scanner doesn't pay for libraries that only its deobf needs
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    return _LazyModule(name)
+
+
+# Context-local, so samples deobfuscated on different threads only see their own layers
+_layer_observers: ContextVar[tuple[Callable[[Any], None], ...]] = ContextVar('layer_observers', default=())
+
+
+@contextmanager
+def observe_layers(observer: Callable[[Any], None]) -> Iterator[None]:
+    """
+    Calls observer with every layer reported by a deobfuscator while the block runs
+    """
+    token = _layer_observers.set((*_layer_observers.get(), observer))
+    try:
+        yield
+    finally:
+        _layer_observers.reset(token)
+
+
+def report_layer(layer: str | bytes | ast.AST) -> None:
+    """
+    Called by multi-layer deobfuscators each time they peel a layer, with the source of the new layer
+    Layers must not be mutated afterwards, observers may keep them as partial output
+    """
+    for observer in _layer_observers.get():
+        observer(layer)
+
+
+def render_layer(layer: str | bytes | ast.AST) -> str:
+    if isinstance(layer, ast.AST):
+        return ast.unparse(layer)
+    if isinstance(layer, bytes):
+        try:
+            return layer.decode()
+        except UnicodeDecodeError:
+            return repr(layer)
+    return layer
+
+
+@dataclass(slots=True, frozen=True)
+class TraceEvent:
+    """
+    A step of a deobfuscator's evaluation of the sample
+    :param op: What was attempted, e.g. call, getitem, getattr or name
+    :param target: Name of the object operated on
+    :param key: Key, attribute or name looked up, None for calls
+    :param outcome: e.g. resolved, missing, uncallable or raised
+    :param node: Node being evaluated, only kept for failures
+    """
+    op: str
+    target: str
+    key: str | None = None
+    outcome: str = 'resolved'
+    node: ast.AST | None = None
+
+    @property
+    def node_type(self) -> str | None:
+        return None if self.node is None else type(self.node).__name__
+
+    @override
+    def __str__(self) -> str:
+        key = '' if self.key is None else f'[{self.key!r}]'
+        node = '' if self.node is None else f' at {ast.unparse(self.node)}'
+        return f'{self.op} {self.target}{key}: {self.outcome}{node}'
+
+
+class Tracer:
+    """
+    Ring buffer of the last capacity trace events, recording 1 in every sample events offered to it
+    :param capacity: Events kept, older events are dropped
+    :param sample: Record every sample-th event, 1 to record all of them
+    """
+    __slots__ = ('events', 'sample', 'seen')
+
+    def __init__(self, capacity: int = 1024, sample: int = 1):
+        if sample < 1:
+            raise ValueError('sample must be at least 1')
+        self.events: deque[TraceEvent] = deque(maxlen=capacity)
+        self.sample = sample
+        self.seen = 0
+
+    def record(self, op: str, target: str, key: str | None = None, outcome: str = 'resolved',
+               node: ast.AST | None = None) -> None:
+        self.seen += 1
+        if self.seen % self.sample == 0:
+            self.events.append(TraceEvent(op, target, key, outcome, node))
+
+
+# Context-local like _layer_observers, so a tracer only sees events of the thread that started it
+# Checked inline by deobfuscators before building an event, so tracing costs nothing while it is empty
+active_tracers: ContextVar[tuple[Tracer, ...]] = ContextVar('active_tracers', default=())
+
+
+@contextmanager
+def tracing(capacity: int = 1024, sample: int = 1) -> Iterator[Tracer]:
+    """
+    Collects the trace events deobfuscators record while the block runs, see Tracer
+    """
+    tracer = Tracer(capacity, sample)
+    token = active_tracers.set((*active_tracers.get(), tracer))
+    try:
+        yield tracer
+    finally:
+        active_tracers.reset(token)
+
+
+def trace(op: str, target: str, key: str | None = None, outcome: str = 'resolved',
+          node: ast.AST | None = None) -> None:
+    """
+    Records an event with every active tracer, callers should check active_tracers.get() first on hot paths
+    """
+    for tracer in active_tracers.get():
+        tracer.record(op, target, key, outcome, node)
+
+
+_layer_caches: 'weakref.WeakSet[LayerCache[Any]]' = weakref.WeakSet()
+_named_layer_caches: 'weakref.WeakValueDictionary[str, LayerCache[Any]]' = weakref.WeakValueDictionary()
+# Cache name, the layers peeled and the result they map to, as recorded by LayerCache.put
+LayerEntries = tuple[str, list[bytes], Any]
+# Entries put in named caches while record_layer_entries runs, None when nothing is recording
+_layer_journal: list[LayerEntries] | None = None
+
+
+def clear_layer_caches() -> None:
+    """
+    Empties every LayerCache, e.g. so a repeated measurement peels every layer again
+    """
+    for cache in _layer_caches:
+        cache.clear()
+
+
+def record_layer_entries(func: Callable[[], R]) -> tuple[R, list[LayerEntries]]:
+    """
+    Runs func, also returning what it put in named layer caches
+    A forked child runs its work through this, so its parent can add them with merge_layer_entries
+    and the results peeled in the child are not lost when it exits
+    """
+    global _layer_journal
+    journal: list[LayerEntries] = []
+    _layer_journal = journal
+    try:
+        return func(), journal
+    finally:
+        _layer_journal = None
+
+
+def merge_layer_entries(entries: Iterable[LayerEntries]) -> None:
+    for name, keys, result in entries:
+        cache = _named_layer_caches.get(name)
+        if cache is not None:
+            cache.put(keys, result)
+
+
+def _result_size(result: Any) -> int:
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    return sys.getsizeof(result)
+
+
+class LayerCache(Generic[V]):
+    """
+    Bounded LRU map from an intermediate layer of a multi-layer schema to its fully unwrapped result
+    Samples from the same kit often share inner layers behind different outer wrappers, so once
+    a sample reaches a layer that has been peeled before, the remaining layers can be skipped
+    Layers are keyed by their digest, so a key costs the same however large the layer was, but results
+    are kept whole; the cache holds at most max_entries keys and max_bytes of results, counting a
+    result once for each layer mapped to it
+    Safe to share between threads
+    :param name: Identifies the cache across forks, so results peeled in a forked child reach it,
+        see record_layer_entries
+    """
+
+    def __init__(self, name: str | None = None, max_entries: int = 4096, max_bytes: int = 256 * 1024 * 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[bytes, tuple[V, int]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        _layer_caches.add(self)
+        if name is not None:
+            _named_layer_caches[name] = self
+
+    @staticmethod
+    def key(layer: bytes | str) -> bytes:
+        if isinstance(layer, str):
+            layer = layer.encode('utf-8', 'surrogateescape')
+        return hashlib.sha256(layer).digest()
+
+    def get(self, key: bytes) -> V | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, keys: Iterable[bytes], result: V) -> None:
+        """
+        Maps every layer peeled on the way to result straight to it
+        """
+        keys = [*keys]
+        if self.name is not None and _layer_journal is not None:
+            _layer_journal.append((self.name, keys, result))
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            for key in keys:
+                old = self.entries.pop(key, None)
+                if old is not None:
+                    self.size -= old[1]
+                self.entries[key] = result, size
+                self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
 known_funcs = {
     ('base64', 'b64decode'): base64.b64decode,
     ('zlib', 'decompress'): zlib.decompress,
@@ -38,6 +299,13 @@ op_dict = {
     ast.USub: operator.neg,
     ast.Not: operator.not_,
     ast.Invert: operator.invert,
+
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
 }
 
 
@@ -8,12 +8,17 @@ from ast import (
     Slice, Subscript, UnaryOp, comprehension, operator, unaryop
 )
 
-from vipyr_deobf.deobf_base import Deobfuscator, register
-from vipyr_deobf.deobf_utils import WEBHOOK_REGEX, known_funcs, op_dict
+from vipyr_deobf.deobf_base import (
+    Deobfuscator, ScanContext, SchemaScanner, register, run_scanners
+)
+from vipyr_deobf.deobf_utils import WEBHOOK_REGEX, LayerCache, known_funcs, op_dict, report_layer
 
 logger = logging.getLogger('deobf')
 MAX_DEOBF_LIMIT = 30
 
+# Maps each layer's source to the source of the final layer
+layer_cache: LayerCache[bytes] = LayerCache('blankobf_v2')
+
 
 class BlankObf2Deobf(ast.NodeTransformer):
     def __init__(self):
@@ -154,7 +159,7 @@ class ImportExtractor(ast.NodeTransformer):
         self.import_list.append(node)
 
 
-def deobf_first_layer(tree: ast.Module):
+def deobf_first_layer(tree: ast.Module) -> bytes | None:
     deobfed_tree = BlankObf2Deobf().visit(tree)
     match deobfed_tree:
         case Module(
@@ -165,10 +170,10 @@ def deobf_first_layer(tree: ast.Module):
                 )
             )]
         ):
-            return ast.parse(payload)
+            return payload
 
 
-def deobf_second_layer(tree: ast.Module):
+def deobf_second_layer(tree: ast.Module) -> bytes | None:
     deobfed_tree = BlankObf2Deobf().visit(tree)
     match deobfed_tree:
         case Module(
@@ -206,10 +211,10 @@ def deobf_second_layer(tree: ast.Module):
             )]
         ):
             pad = num1 ^ num2
-            return ast.parse(zlib.decompress(bytes([pad ^ i for i in payload])))
+            return zlib.decompress(bytes([pad ^ i for i in payload]))
 
 
-def deobf_third_layer(tree: ast.Module):
+def deobf_third_layer(tree: ast.Module) -> bytes | None:
     deobfed_tree = BlankObf2Deobf().visit(tree)
     logging.info(f'Finished transforming third layer')
     match deobfed_tree:
@@ -226,7 +231,7 @@ def deobf_third_layer(tree: ast.Module):
                   ]
         ):
             logging.info(f'Next layer located')
-            return ast.parse(payload)
+            return payload
 
 
 def deobf(code: str) -> tuple[bool, ast.Module]:
@@ -238,6 +243,9 @@ def deobf(code: str) -> tuple[bool, ast.Module]:
     imports = import_ext.import_list
     logger.info(f'{len(imports)} imports found')
 
+    # Trees are transformed in place, so layers are cached by source and re-parsed on a hit
+    peeled = []
+    payload = None
     for iteration in range(MAX_DEOBF_LIMIT):
         logging.info(f'Starting deobfuscation of layer {iteration}')
         match tree:
@@ -248,23 +256,33 @@ def deobf(code: str) -> tuple[bool, ast.Module]:
                 break
             case Module(body=[Assign(), Assign(), Assign(), Assign(), Expr()]):
                 logging.info(f'Identified as first layer')
-                new_tree = deobf_first_layer(tree)
+                new_payload = deobf_first_layer(tree)
             case Module(body=[Assign(), For()]):
                 logging.info(f'Identified as second layer')
-                new_tree = deobf_second_layer(tree)
+                new_payload = deobf_second_layer(tree)
             case Module(body=[Assign(), Assign(), Expr()]):
                 logging.info(f'Identified as third layer')
-                new_tree = deobf_third_layer(tree)
+                new_payload = deobf_third_layer(tree)
             case _:
                 logging.error('Did not recognize layer')
                 return False, tree
-        if not new_tree:
+        if not new_payload:
             logging.error('Next layer not located, ending now')
             return False, tree
-        tree = new_tree
+        payload = new_payload
+        report_layer(payload)
+        layer_key = layer_cache.key(payload)
+        if (cached := layer_cache.get(layer_key)) is not None:
+            logger.info(f'Layer {iteration + 1} was deobfuscated before, reusing its result')
+            layer_cache.put(peeled, cached)
+            return True, ast.parse(cached)
+        peeled.append(layer_key)
+        tree = ast.parse(payload)
     else:
         logging.error(f'Reached layer deobfuscation limit of {MAX_DEOBF_LIMIT}, ending now')
         return False, tree
+    if payload is not None:
+        layer_cache.put(peeled, payload)
     return True, tree
 
 
@@ -284,26 +302,40 @@ def format_results(results: tuple[bool, ast.Module]) -> str:
     return deobfed_code
 
 
-def scan(code: str):
-    tree = ast.parse(code)
-    match tree:
-        case Module(
-            body=[
-                *imports,
-                Assign(),
-                Assign(),
-                Assign(),
-                Assign(),
-                Expr(),
-            ]
-        ) if all(isinstance(imp, Import | ImportFrom) for imp in imports):
-            return True
-        case Module(
-            body=[Assign(), For(body=If(body=[Expr(), Break()]))]
-        ):
-            return True
-    return False
+class BlankObfScanner(SchemaScanner):
+    """
+    BlankObf is recognized purely by the shape of the module body, so this decides on the root node
+    """
+
+    def visit_Module(self, node):
+        match node:
+            case Module(
+                body=[
+                    *imports,
+                    Assign(),
+                    Assign(),
+                    Assign(),
+                    Assign(),
+                    Expr(),
+                ]
+            ) if all(isinstance(imp, Import | ImportFrom) for imp in imports):
+                self.matched()
+            case Module(
+                body=[Assign(), For(body=[If(body=[Expr(), Break()])])]
+            ):
+                self.matched()
+            case _:
+                self.impossible()
 
 
-blankobf_v2_deobf = Deobfuscator(deobf, format_results, scan)
+def scan(ctx: ScanContext):
+    return run_scanners(ctx, [BlankObfScanner()])[0]
+
+
+blankobf_v2_deobf = Deobfuscator(
+    deobf, format_results, scan, BlankObfScanner,
+    # No signatures: the scanner matches on the shape of the module alone, which needs no particular literal
+    name='blankobf',
+    version=2,
+)
 register(blankobf_v2_deobf)
@@ -5,19 +5,38 @@ import logging
 import re
 import zlib
 from ast import (
-    Assign, Attribute, Call, Constant, Expr, Lambda,
-    Name, Slice, Subscript, UnaryOp, USub, arg, arguments
+    Assign,
+    Attribute,
+    Call,
+    Constant,
+    Expr,
+    Lambda,
+    Name,
+    Slice,
+    Subscript,
+    UnaryOp,
+    USub,
+    arg,
+    arguments,
 )
 from io import StringIO
 
-from vipyr_deobf.deobf_base import Deobfuscator, register
-from vipyr_deobf.deobf_utils import BYTES_WEBHOOK_REGEX
+from vipyr_deobf.deobf_base import (
+    Deobfuscator,
+    ScanContext,
+    SchemaScanner,
+    register,
+    run_scanners,
+)
+from vipyr_deobf.deobf_utils import BYTES_WEBHOOK_REGEX, LayerCache, report_layer
 from vipyr_deobf.exceptions import DeobfuscationFailError
 
 logger = logging.getLogger('deobf')
 
 MAX_DEOBF_LIMIT = 1000
 
+layer_cache: LayerCache[bytes] = LayerCache('fct')
+
 
 class ByteStringFinder(ast.NodeVisitor):
     def __init__(self):
@@ -149,9 +168,17 @@ def deobf(code: str) -> bytes:
     """
     obf_bytes = nab_surface_payload(code)
 
+    peeled = []
     for iteration in range(MAX_DEOBF_LIMIT):
+        layer_key = layer_cache.key(obf_bytes)
+        if (cached := layer_cache.get(layer_key)) is not None:
+            logger.info(f'Layer {iteration} was deobfuscated before, reusing its result')
+            layer_cache.put(peeled, cached)
+            return cached
+        peeled.append(layer_key)
         logger.info(f'Deobfuscating bytes (iteration {iteration})')
         marshalled_bytes = deobf_obf(obf_bytes)
+        report_layer(marshalled_bytes)
         if marshalled_bytes.startswith(b'exec((_)(b'):
             logger.debug('Byte string is not marshalled')
             obf_bytes = marshalled_bytes[11:-3]
@@ -160,8 +187,10 @@ def deobf(code: str) -> bytes:
         try:
             obf_bytes = nab_bytes(marshalled_bytes)
         except DeobfuscationFailError:
+            layer_cache.put(peeled, marshalled_bytes)
             return marshalled_bytes
         if not obf_bytes:
+            layer_cache.put(peeled, marshalled_bytes)
             return marshalled_bytes
     logging.warning(f'Reached byte deobfuscation limit of {MAX_DEOBF_LIMIT}, ending now')
     raise DeobfuscationFailError(
@@ -225,11 +254,18 @@ def match_inner_underscore_function(node: ast.Call):
     return False
 
 
-class FCTScanner(ast.NodeVisitor):
+class FCTScanner(SchemaScanner):
+    requires = (b'exec', b'__import__', b'decompress', b'b64decode')
+
     def __init__(self):
+        super().__init__()
         self.underscore_function_found = False
         self.payload_found = False
 
+    def check_found(self):
+        if self.underscore_function_found and self.payload_found:
+            self.matched()
+
     def visit_Assign(self, node):
         match node:
             case Assign(
@@ -249,7 +285,7 @@ class FCTScanner(ast.NodeVisitor):
                 )
             ) if match_inner_underscore_function(body):
                 self.underscore_function_found = True
-                return
+                self.check_found()
 
     def visit_Expr(self, node):
         match node:
@@ -265,17 +301,16 @@ class FCTScanner(ast.NodeVisitor):
                 )
             ) if isinstance(payload, bytes):
                 self.payload_found = True
-                return
+                self.check_found()
 
 
-def scan(code: str):
-    fct_scanner = FCTScanner()
-    fct_scanner.visit(ast.parse(code))
-    return (
-        fct_scanner.underscore_function_found
-        and fct_scanner.payload_found
-    )
+def scan(ctx: ScanContext):
+    return run_scanners(ctx, [FCTScanner()])[0]
 
 
-fct_deobf = Deobfuscator(deobf, format_results, scan)
+fct_deobf = Deobfuscator(
+    deobf, format_results, scan, FCTScanner,
+    signatures=(b'b64decode',),
+    name='fct',
+)
 register(fct_deobf)
@@ -21,6 +21,7 @@ from __future__ import annotations
 import ast
 import base64
 import binascii
+import codecs
 import logging
 import re
 import zlib
@@ -32,15 +33,19 @@ from ast import (
     BinOp,
     BoolOp,
     Call,
+    ClassDef,
+    Compare,
     Constant,
     Expr,
+    If,
+    IfExp,
     Invert,
     Lambda,
     Module,
     Name,
-    NodeVisitor,
     Not,
     Or,
+    Pass,
     Slice,
     Sub,
     Subscript,
@@ -48,104 +53,123 @@ from ast import (
     UAdd,
     UnaryOp,
     USub,
+    While,
     arg,
     arguments,
     keyword,
     stmt,
 )
 from collections import ChainMap
-from collections.abc import Callable, MutableMapping
+from collections.abc import Callable, Iterator, Mapping, MutableMapping, Sequence
 from dataclasses import dataclass, field
-from io import BytesIO
+from types import MappingProxyType
 from typing import Any
 
 from typing_extensions import override
 
-from vipyr_deobf.deobf_base import Deobfuscator, register
+from vipyr_deobf.deobf_base import (
+    Deobfuscator,
+    ScanContext,
+    SchemaScanner,
+    register,
+    run_scanners,
+)
+from vipyr_deobf.deobf_utils import (
+    active_tracers,
+    op_dict,
+    report_layer,
+    trace,
+)
 from vipyr_deobf.exceptions import DeobfuscationFailError
 
 logger = logging.getLogger('hyperion')
 
 
-class FLB64zlib(ast.NodeTransformer):
-    """Collapses __import__('base64').b64decode(__import__('zlib').decompress(...))"""
-
-    @override
-    def visit_Call(self, node: Call):
-        match node:
-            case Call(
-                func=Attribute(
-                    value=Call(
-                        func=Attribute(
-                            value=Call(
-                                func=Name(id='__import__'),
-                                args=[Constant(value='base64')],
-                            ),
-                            attr='b64decode',
+def defrost(node: ast.expr) -> Any:
+    """
+    Value of a constant, undoing __import__('base64').b64decode(__import__('zlib').decompress(...))
+    frosting around it if there is any
+    :return: The value, None if node is neither
+    """
+    match node:
+        case Constant(value=value):
+            return value
+        case Call(
+            func=Attribute(
+                value=Call(
+                    func=Attribute(
+                        value=Call(
+                            func=Name(id='__import__'),
+                            args=[Constant(value='base64')],
                         ),
-                        args=[
-                            Call(
-                                func=Attribute(
-                                    value=Call(
-                                        func=Name(id='__import__'),
-                                        args=[Constant(value='zlib')],
-                                    ),
-                                    attr='decompress',
-                                ),
-                                args=[Constant(value=payload)],
-                            )
-                        ],
+                        attr='b64decode',
                     ),
-                    attr='decode',
-                )
-            ):
-                value = base64.b64decode(zlib.decompress(payload)).decode()
-                return Constant(value=value)
-            case Call(
-                func=Attribute(
-                    value=Call(
-                        func=Name(id='__import__'),
-                        args=[Constant(value='base64')],
-                    ),
-                    attr='b64decode',
-                ),
-                args=[
-                    Call(
-                        func=Attribute(
-                            value=Call(
-                                func=Name(id='__import__'),
-                                args=[Constant(value='zlib')],
+                    args=[
+                        Call(
+                            func=Attribute(
+                                value=Call(
+                                    func=Name(id='__import__'),
+                                    args=[Constant(value='zlib')],
+                                ),
+                                attr='decompress',
                             ),
-                            attr='decompress',
+                            args=[Constant(value=payload)],
+                        )
+                    ],
+                ),
+                attr='decode',
+            )
+        ):
+            return base64.b64decode(zlib.decompress(payload)).decode()
+        case Call(
+            func=Attribute(
+                value=Call(
+                    func=Name(id='__import__'),
+                    args=[Constant(value='base64')],
+                ),
+                attr='b64decode',
+            ),
+            args=[
+                Call(
+                    func=Attribute(
+                        value=Call(
+                            func=Name(id='__import__'),
+                            args=[Constant(value='zlib')],
                         ),
-                        args=[Constant(value=payload)],
-                    )
-                ],
-            ):
-                value = base64.b64decode(zlib.decompress(payload))
-                return Constant(value=value)
-            case _:
-                return self.generic_visit(node)
-
+                        attr='decompress',
+                    ),
+                    args=[Constant(value=payload)],
+                )
+            ],
+        ):
+            return base64.b64decode(zlib.decompress(payload))
+        case _:
+            return None
 
-@dataclass(slots=True)
-class FLNabBytes(NodeVisitor):
-    bytes: BytesIO = field(default_factory=BytesIO)
 
-    @override
-    def visit_Call(self, node: Call):
-        match node:
-            case Call(
-                func=Attribute(),
-                args=[],
-                keywords=[
-                    keyword(value=Constant(value=str())),
-                    keyword(value=Constant(value=bytes(payload))),
-                ],
-            ):
-                _ = self.bytes.write(payload)
-            case _:
-                pass
+def nab_first_layer_bytes(ast_tree: Module) -> Iterator[bytes]:
+    """
+    Yields the byte strings hidden in the first layer, in source order
+    They are the second keyword of calls like _product._modulo(Absolute='...', DetectVar=b'...').
+    Calls that do not look like that are not looked into
+    """
+    stack: list[ast.AST] = [ast_tree]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is Call:
+            match node:
+                case Call(
+                    func=Attribute(),
+                    args=[],
+                    keywords=[keyword(value=first), keyword(value=second)],
+                ) if isinstance(defrost(first), str) and isinstance(payload := defrost(second), bytes):
+                    yield payload
+                case _:
+                    pass
+            continue
+        children = [*ast.iter_child_nodes(node)]
+        children.reverse()
+        stack.extend(children)
 
 
 def deobf_first_layer(ast_tree: Module) -> str:
@@ -153,7 +177,9 @@ def deobf_first_layer(ast_tree: Module) -> str:
     The outer layer just hides some byte strings in some heavily indented
     lines, so we just find these byte strings and zlib.decompress them into
     the second layer. In some samples, these byte strings get b64 encoded
-    and compressed (frosting), so we also run a quick transformer to undo that.
+    and compressed (frosting), which is undone as they are found.
+    Each byte string is decompressed as soon as it is found, so the compressed
+    payload is never copied out of the tree in one piece.
 
     Args:
         ast_tree: ast.parse(code)
@@ -161,44 +187,62 @@ def deobf_first_layer(ast_tree: Module) -> str:
     Returns:
         Second layer as a string
     """
-    logger.info('Running b64+zlib frosting remover')
-    defrosted = FLB64zlib().visit(ast_tree)
-    logger.info('Nabbing first layer bytes')
-    byte_nabber = FLNabBytes()
-    byte_nabber.visit(defrosted)
-    second_layer_bytes = byte_nabber.bytes.getvalue()
-    if not second_layer_bytes:
+    logger.info('Nabbing and decompressing first layer bytes')
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    second_layer: list[str] = []
+    found = False
+    for payload in nab_first_layer_bytes(ast_tree):
+        found = found or bool(payload)
+        second_layer.append(decoder.decode(decompressor.decompress(payload)))
+    if not found:
         logger.error('First layer bytes not found')
         raise DeobfuscationFailError()
-    return zlib.decompress(second_layer_bytes).decode()
+    second_layer.append(decoder.decode(decompressor.flush(), final=True))
+    if not decompressor.eof:
+        logger.error('First layer bytes are truncated')
+        raise DeobfuscationFailError()
+    return ''.join(second_layer)
+
+
+_NO_MEMBERS: Mapping[str, Any] = MappingProxyType({})
 
 
 @dataclass(slots=True)
 class MockObj:
     name: str
     obj: Any = None
-    func: Callable[..., MockObj | None] | None = None
-    items: dict[str, MockObj] = field(default_factory=dict)
-    attrs: dict[str, MockObj] = field(default_factory=dict)
+    func: Callable[..., Any] | None = None
+    # Shared rather than copied per instance; mappingproxy is only hashable (and so a valid plain
+    # default) from 3.12 on
+    items: Mapping[str, Any] = field(default_factory=lambda: _NO_MEMBERS)
+    attrs: Mapping[str, Any] = field(default_factory=lambda: _NO_MEMBERS)
 
     def __call__(self, *args: Any, **kwargs: Any) -> Any:
-        logger.debug(
-            f'Calling {self.name} with {len(args)} args and kwargs {", ".join(kwargs)}'
-        )
         if self.func is None:
+            if active_tracers.get():
+                trace('call', self.name, outcome='uncallable')
             raise ValueError(f'Mock object {self.name} cannot be called')
+        if active_tracers.get():
+            trace('call', self.name)
         return self.func(*args, **kwargs)
 
     def getitem(self, key: str) -> Any:
-        logger.debug(f'Retrieving {key=} from {self.name}')
         if key not in self.items:
+            if active_tracers.get():
+                trace('getitem', self.name, key, 'missing')
             raise ValueError(f'Key {key} not in object {self.name}')
+        if active_tracers.get():
+            trace('getitem', self.name, key)
         return self.items[key]
 
     def getattr(self, attr: str) -> Any:
-        logger.debug(f'Retrieving {attr=} from {self.name}')
         if attr not in self.attrs:
+            if active_tracers.get():
+                trace('getattr', self.name, attr, 'missing')
             raise ValueError(f'Attr {attr} not in object {self.name}')
+        if active_tracers.get():
+            trace('getattr', self.name, attr)
         return self.attrs[attr]
 
     @override
@@ -206,47 +250,74 @@ class MockObj:
         return f'<{self.name}{f": {self.obj}" if self.obj is not None else ""}>'
 
 
-def mock_func(func: Callable[..., Any]) -> Callable[..., MockObj]:
-    def inner(*args: Any, **kwargs: Any) -> MockObj:
+@dataclass(slots=True)
+class MockStrList:
+    """
+    List of strings, as returned by dir, that finds an item with a dict lookup instead of a scan
+    """
+    items: Sequence[str]
+    positions: dict[str, int] | None = None
+
+    def __getitem__(self, idx: int) -> str:
+        return self.items[idx]
+
+    def index(self, item: str) -> int:
+        if self.positions is None:
+            self.positions = {}
+            for idx, name in enumerate(self.items):
+                self.positions.setdefault(name, idx)
+        if item not in self.positions:
+            raise ValueError(f'{item!r} is not in list')
+        return self.positions[item]
+
+
+# Values the evaluator computes with. Strings, numbers and bytes stand for themselves, everything
+# else is mocked
+MockValue = MockObj | MockStrList | str | int | float | bytes
+
+
+def mock_func(func: Callable[..., Any]) -> Callable[..., MockValue]:
+    def inner(*args: Any, **kwargs: Any) -> MockValue:
         return conv_type_to_mock(func(*args, **kwargs))
 
     return inner
 
 
-def make_mock(name: str, type_name: str, *methods: str) -> Callable[[Any], MockObj]:
-    def inner(obj: Any) -> MockObj:
-        return MockObj(
-            name,
-            obj=obj,
-            attrs={
-                method: MockObj(
-                    f'{type_name}.{method}', func=mock_func(getattr(obj, method))
-                )
-                for method in methods
-            },
-        )
+@dataclass(frozen=True, slots=True)
+class MockType:
+    """
+    Methods that can be looked up on every value of a type, shared by all of them
+    A method is only wrapped in a MockObj when it is looked up
+    """
+    name: str
+    type_name: str
+    methods: frozenset[str]
 
-    return inner
+    def getattr(self, value: Any, attr: str) -> MockObj:
+        if attr not in self.methods:
+            if active_tracers.get():
+                trace('getattr', self.name, attr, 'missing')
+            raise ValueError(f'Attr {attr} not in object {self.name}')
+        if active_tracers.get():
+            trace('getattr', self.name, attr)
+        return MockObj(f'{self.type_name}.{attr}', func=mock_func(getattr(value, attr)))
 
 
-MockStrList = make_mock('MockStrList', 'list', '__getitem__', 'index')
-MockStr = make_mock('MockStr', 'str', 'join')
-MockInt = make_mock('MockInt', 'int', '__neg__', '__pos__')
-MockBytes = make_mock('MockBytes', 'bytes', 'decode')
-MockFloat = make_mock('MockFloat', 'float')
-MockCodeObj = make_mock('MockCodeObj', 'code')
+mock_types: dict[type[Any], MockType] = {
+    MockStrList: MockType('MockStrList', 'list', frozenset({'__getitem__', 'index'})),
+    str: MockType('MockStr', 'str', frozenset({'join'})),
+    int: MockType('MockInt', 'int', frozenset({'__neg__', '__pos__'})),
+    bytes: MockType('MockBytes', 'bytes', frozenset({'decode'})),
+    float: MockType('MockFloat', 'float', frozenset()),
+}
+# True and False are ints to the obfuscated code too
+mock_types[bool] = mock_types[int]
 
 
-def conv_type_to_mock(obj: object) -> MockObj:
+def conv_type_to_mock(obj: object) -> MockValue:
     match obj:
-        case str(string):
-            return MockStr(string)
-        case int(num):
-            return MockInt(num)
-        case float(num):
-            return MockFloat(num)
-        case bytes(b):
-            return MockBytes(b)
+        case str() | int() | float() | bytes():
+            return obj
         case [*items] if all(isinstance(item, str) for item in items):  # type: ignore[reportUnknownVariableType]
             items: list[str]
             return MockStrList(items)
@@ -254,7 +325,17 @@ def conv_type_to_mock(obj: object) -> MockObj:
             raise ValueError(f'Unknown constant of type {type(obj)}')
 
 
-def mock_dir(obj: object) -> MockObj:
+def mock_attr(value: MockValue, attr: str) -> MockValue:
+    """
+    Looks up an attribute of a mock value, wrapping the method if value is a plain string, number or bytes
+    :raises ValueError: If value has no such attribute
+    """
+    if isinstance(value, MockObj):
+        return value.getattr(attr)
+    return mock_types[type(value)].getattr(value, attr)
+
+
+def mock_dir(obj: object) -> MockStrList:
     match obj:
         case MockObj():
             return MockStrList([*obj.attrs.keys()])
@@ -266,7 +347,7 @@ def mock_import(lib: str) -> MockObj | None:
     return mock_libs.get(lib)
 
 
-def mock_getattr(obj: object, attr: str) -> MockObj:
+def mock_getattr(obj: object, attr: str) -> MockValue:
     match obj, attr:
         case MockObj(), str():
             return obj.getattr(attr)
@@ -275,7 +356,7 @@ def mock_getattr(obj: object, attr: str) -> MockObj:
 
 
 def mock_compile(code: str, *_: Any, **__: Any) -> MockObj:
-    return MockCodeObj(code)
+    return MockObj('MockCodeObj', obj=code)
 
 
 def mock_vars(obj: object = None) -> MockObj:
@@ -312,52 +393,271 @@ mock_libs: dict[str, MockObj] = {
 
 
 @dataclass(slots=True)
-class SecondLayerTransformer(ast.NodeTransformer):
-    var_dict: MutableMapping[str, MockObj] = field(
+class Evaluate:
+    """
+    Returned by a visit method to have the transformer evaluate tree, a freshly parsed exec or eval
+    payload, and use then(result) in place of the node, without recursing into it
+    """
+    tree: ast.AST
+    then: Callable[[Any], Any]
+
+
+# How a node is visited when its parent is: skipped (nothing to visit), on the spot, or in a frame of its own
+_SKIP, _EAGER, _FRAME = range(3)
+# Marks a frame that applies Evaluate.then to the result of the tree it evaluated
+_THEN: Any = object()
+
+
+# Fields that only ever hold fieldless singletons such as Load() or Add(), by the node kinds they hold
+_TOKEN_FIELDS: dict[str, tuple[type[ast.AST], ...]] = {
+    'ctx': (ast.expr_context,),
+    'op': (ast.operator, ast.unaryop, ast.boolop),
+    'ops': (ast.cmpop,),
+}
+
+
+class _Plans(dict[type[ast.AST], tuple[int, Callable[[Any, Any], Any] | None, tuple[str, ...]]]):
+    """
+    Node class -> how to visit it, its visit method and the fields its children are in,
+    filled in as node classes are met
+    """
+
+    def __init__(self, transformer: type[IterativeTransformer]):
+        super().__init__()
+        self.transformer = transformer
+        # Token fields are left out of the walk unless the transformer visits what they hold
+        self.token_fields = frozenset(
+            name for name, bases in _TOKEN_FIELDS.items()
+            if not any(
+                hasattr(transformer, f'visit_{kind.__name__}')
+                for base in bases for kind in (base, *base.__subclasses__())
+            )
+        )
+
+    def __missing__(self, kind: type[ast.AST]) -> tuple[int, Callable[[Any, Any], Any] | None, tuple[str, ...]]:
+        handler = getattr(self.transformer, f'visit_{kind.__name__}', None)
+        fields = tuple(name for name in kind._fields if name not in self.token_fields)
+        if kind in self.transformer.eager:
+            mode = _SKIP if handler is None else _EAGER
+        elif handler is not None or fields:
+            mode = _FRAME
+        else:
+            mode = _SKIP
+        plan = self[kind] = mode, handler, fields
+        return plan
+
+
+class IterativeTransformer:
+    """
+    ast.NodeTransformer on an explicit stack, so nesting depth is not limited by the recursion limit
+    Like a NodeTransformer, visit_<Class> methods return a replacement for the node, None to remove it,
+    or a list of nodes to splice into a list field, and default to keeping the node. Unlike one, the
+    children of a node have always been visited by the time its visit method is called, which may also
+    return Evaluate to visit a new tree in its place
+    Leaf node types listed in eager have visit methods that only look at the node itself, so they are
+    visited as soon as their parent is reached instead of getting a stack frame of their own, or are
+    not visited at all if they have none
+    """
+    eager: frozenset[type[ast.AST]] = frozenset()
+    _plans: _Plans
+
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        cls._plans = _Plans(cls)
+
+    def visit(self, node: ast.AST) -> Any:
+        result: list[Any] = [None]
+        # Frames are (node, out, idx, values) and write the result of the node to out[idx]. values is None
+        # until the children of node have been pushed, then holds their results; _THEN frames carry
+        # Evaluate.then in place of the node
+        stack: list[tuple[Any, list[Any], int, Any]] = [(node, result, 0, None)]
+        push, pop = stack.append, stack.pop
+        plans = self._plans
+        while stack:
+            node, out, idx, values = pop()
+            if values is None:
+                fields = plans[node.__class__][2]
+                children: list[Any] = []
+                for name in fields:
+                    value = getattr(node, name, None)
+                    if value.__class__ is list:
+                        for item in value:  # type: ignore[reportUnknownVariableType]
+                            if isinstance(item, ast.AST):
+                                children.append(item)
+                    elif isinstance(value, ast.AST):
+                        children.append(value)
+                if children:
+                    # children doubles as the results, which default to the child itself
+                    depth = len(stack)
+                    push((node, out, idx, children))
+                    child_idx = len(children)
+                    changed = False
+                    for child in reversed(children):
+                        child_idx -= 1
+                        mode, handler, _ = plans[child.__class__]
+                        if mode == _FRAME:
+                            push((child, children, child_idx, None))
+                        elif mode == _EAGER:
+                            new = handler(self, child)  # type: ignore[reportOptionalCall]
+                            if new is not child:
+                                children[child_idx] = new
+                                changed = True
+                    if len(stack) > depth + 1:
+                        continue
+                    pop()
+                    if changed:
+                        replace_children(node, children, fields)
+            elif values is _THEN:
+                out[idx] = node(out[idx])
+                continue
+            else:
+                replace_children(node, values, plans[node.__class__][2])
+            handler = plans[node.__class__][1]
+            res = node if handler is None else handler(self, node)
+            if res.__class__ is Evaluate:
+                push((res.then, out, idx, _THEN))
+                push((res.tree, out, idx, None))
+            else:
+                out[idx] = res
+        return result[0]
+
+
+def replace_children(node: ast.AST, values: list[Any], fields: tuple[str, ...]) -> None:
+    """
+    Puts the visited children of node in place of the originals, as NodeTransformer.generic_visit does
+    :param values: Result for each child, in field order
+    :param fields: The fields the children were collected from
+    """
+    pos = 0
+    for name in fields:
+        old = getattr(node, name, None)
+        if old.__class__ is list:
+            new_list: list[Any] | None = None
+            for item_idx, item in enumerate(old):  # type: ignore[reportUnknownVariableType]
+                if not isinstance(item, ast.AST):
+                    if new_list is not None:
+                        new_list.append(item)
+                    continue
+                new = values[pos]
+                pos += 1
+                if new is item:
+                    if new_list is not None:
+                        new_list.append(item)
+                    continue
+                # Only copy once something changed
+                if new_list is None:
+                    new_list = old[:item_idx]
+                if new is None:
+                    continue
+                if isinstance(new, ast.AST):
+                    new_list.append(new)
+                else:
+                    new_list.extend(new)
+            if new_list is not None:
+                old[:] = new_list
+        elif isinstance(old, ast.AST):
+            new = values[pos]
+            pos += 1
+            if new is None:
+                delattr(node, name)
+            elif new is not old:
+                setattr(node, name, new)
+
+
+def _body(tree: Any) -> Any:
+    return tree.body
+
+
+# Hyperion execs and evals the same short strings over and over, so their trees are parsed once.
+# Only short payloads are kept, the long ones are one-offs and would just pin their trees in memory
+_MAX_CACHED_PAYLOAD = 512
+_MAX_CACHED_PAYLOADS = 1024
+
+
+def copy_tree(node: Any) -> Any:
+    """
+    Copies a freshly parsed tree, much faster than copy.deepcopy or parsing again
+    Operator and context nodes are shared, as ast.parse already shares them. Recurses, so only used on
+    trees of short payloads
+    """
+    cls = node.__class__
+    new = cls.__new__(cls)
+    fields = new.__dict__
+    fields.update(node.__dict__)
+    for name in cls._fields:
+        value = fields.get(name)
+        if value.__class__ is list:
+            fields[name] = [
+                copy_tree(item) if isinstance(item, ast.AST) and (item._fields or item._attributes) else item
+                for item in value  # type: ignore[reportUnknownVariableType]
+            ]
+        elif isinstance(value, ast.AST) and (value._fields or value._attributes):
+            fields[name] = copy_tree(value)
+    return new
+
+
+@dataclass(slots=True)
+class SecondLayerTransformer(IterativeTransformer):
+    var_dict: MutableMapping[str, MockValue] = field(
         default_factory=lambda: ChainMap({}, mocks)  # type: ignore[reportAssignmentType]
     )
+    # (mode, code) of short payloads -> their pristine tree, or None if they have only been seen once
+    payloads: dict[tuple[str, str], ast.AST | None] = field(default_factory=dict)
+    # Constants are already mock values. Names read var_dict, which statements visited earlier may
+    # have assigned to
+    eager = frozenset({Constant})
+
+    def parse_payload(self, code: str, mode: str) -> Any:
+        """
+        ast.parse for exec and eval payloads, returning a tree of its own the transformer may edit in place
+        A payload is only kept and copied from its second sighting on, so one-offs cost a single parse
+        """
+        if len(code) > _MAX_CACHED_PAYLOAD:
+            return ast.parse(code, mode=mode)
+        key = mode, code
+        tree = self.payloads.get(key)
+        if tree is not None:
+            return copy_tree(tree)
+        if key not in self.payloads:
+            if len(self.payloads) < _MAX_CACHED_PAYLOADS:
+                self.payloads[key] = None
+            return ast.parse(code, mode=mode)
+        tree = self.payloads[key] = ast.parse(code, mode=mode)
+        return copy_tree(tree)
 
-    @override
-    def visit_Constant(self, node: Constant) -> Constant:
-        try:
-            return Constant(conv_type_to_mock(node.value))
-        except ValueError:
-            logger.info(f'Constant of type {type(node.value)} found')
-            return node
-
-    @override
     def visit_Name(self, node: Name) -> Name | Constant:
-        self.generic_visit(node)
         if node.id in self.var_dict:
+            if active_tracers.get():
+                trace('name', 'globals', node.id)
             return Constant(self.var_dict[node.id])
+        if active_tracers.get():
+            trace('name', 'globals', node.id, 'missing')
         return node
 
-    @override
     def visit_Subscript(self, node: Subscript) -> Subscript | Constant:
-        self.generic_visit(node)
         match node:
             case Subscript(
-                value=Constant(MockObj('MockStr', obj=str(value))),
+                value=Constant(str(value)),
                 slice=Slice(
-                    lower=Constant(MockObj('MockInt', obj=int(lower)))
-                    | (None as lower),
-                    upper=Constant(MockObj('MockInt', obj=int(upper)))
-                    | (None as upper),
-                    step=Constant(MockObj('MockInt', obj=int(step))) | (None as step),
+                    lower=Constant(int(lower)) | (None as lower),
+                    upper=Constant(int(upper)) | (None as upper),
+                    step=Constant(int(step)) | (None as step),
                 ),
             ):
-                return Constant(MockStr(value[lower:upper:step]))
+                return Constant(value[lower:upper:step])
             case Subscript(
                 value=Constant(MockObj('globals' | 'locals' | 'vars')),
-                slice=Constant(MockObj('MockStr', obj=str(key))),
+                slice=Constant(str(key)),
             ):
                 if key not in self.var_dict:
-                    logger.exception(f'Failed getitem {key} from globals')
+                    if active_tracers.get():
+                        trace('getitem', 'globals', key, 'missing', node)
+                    logger.error('Failed getitem %s from globals', key)
                     return node
                 return Constant(self.var_dict[key])
             case Subscript(
                 value=Constant(MockObj() as obj),
-                slice=Constant(MockObj('MockStr', obj=str(key))),
+                slice=Constant(str(key)),
             ):
                 try:
                     return Constant(obj.getitem(key))
@@ -365,21 +665,19 @@ class SecondLayerTransformer(ast.NodeTransformer):
                     logger.exception('Failed getitem')
                     return node
             case Subscript(
-                value=Constant(MockObj('MockStrList', obj=seq)),
-                slice=Constant(MockObj('MockInt', obj=int(idx))),
+                value=Constant(MockStrList() as seq),
+                slice=Constant(int(idx)),
             ):
-                return Constant(MockStr(seq[idx]))
+                return Constant(seq[idx])
             case _:
                 return node
 
-    @override
     def visit_UnaryOp(self, node: UnaryOp) -> UnaryOp | Constant:
-        self.generic_visit(node)
         match node:
             case UnaryOp(
                 op=op,
                 operand=Constant(
-                    MockObj('MockInt', obj=int(num))
+                    int(num)
                     | MockObj('True' | 'False', obj=bool(num))
                 ),
             ):
@@ -394,95 +692,87 @@ class SecondLayerTransformer(ast.NodeTransformer):
                         num = not num
                     case _:
                         return node
-                return Constant(MockInt(num))
+                return Constant(num)
             case _:
                 return node
 
-    @override
     def visit_Attribute(self, node: Attribute) -> Attribute | Constant:
-        self.generic_visit(node)
         match node:
             case Attribute(
-                value=Constant(MockObj() as obj),
+                value=Constant(MockObj() | MockStrList() | str() | int() | float() | bytes() as obj),
                 attr=str(attr),
             ):
                 try:
-                    return Constant(obj.getattr(attr))
+                    return Constant(mock_attr(obj, attr))
                 except ValueError:
                     logger.exception('Failed getattr')
                     return node
             case _:
                 return node
 
-    @override
     def visit_Assign(self, node: Assign) -> Any:
-        self.generic_visit(node)
         match node:
             case Assign(
                 targets=[
                     Subscript(
                         value=Constant(MockObj('globals' | 'locals' | 'vars')),
-                        slice=Constant(MockObj('MockStr', obj=str(name))),
+                        slice=Constant(str(name)),
                     )
                 ],
                 value=Constant(value),
             ):
-                logger.info(f'Assigning {name} = {value!r}')
+                logger.info('Assigning %s = %r', name, value)
                 self.var_dict[name] = value
                 return None
             case Assign(
                 targets=[
                     Subscript(
                         value=Constant(MockObj('globals' | 'locals' | 'vars')),
-                        slice=Constant(MockObj('MockStr', obj=str(name))),
+                        slice=Constant(str(name)),
                     )
                 ],
                 value=Subscript(
                         value=Constant(MockObj('globals' | 'locals' | 'vars')),
-                        slice=Constant(MockObj('MockStr', obj=str(value))),
+                        slice=Constant(str(value)),
             ),
             ):
-                logger.info(f'Assigning {name} = {value}')
+                logger.info('Assigning %s = %s', name, value)
                 self.var_dict[name] = MockObj(value)
                 return None
             case _:
                 return node
 
-    @override
-    def visit_Expr(self, node: Expr) -> Expr | stmt | list[stmt]:
-        self.generic_visit(node)
+    def visit_Expr(self, node: Expr) -> Expr | list[stmt] | Evaluate:
         match node:
             case Expr(
                 Call(
                     func=Constant(MockObj('exec')),
-                    args=[Constant(MockObj('MockStr', obj=code))],
+                    args=[Constant(str(code))],
                 )
             ):
-                return self.visit(ast.parse(code, mode='exec')).body
+                return Evaluate(self.parse_payload(code, 'exec'), _body)
             case Expr(
                 Call(
                     func=Constant(MockObj('exec')),
                     args=[Constant(MockObj('MockCodeObj', obj=code))],
                 )
             ):
-                return self.visit(ast.parse(code, mode='exec')).body
+                return Evaluate(self.parse_payload(code, 'exec'), _body)
             case _:
                 return node
 
-    @override
-    def visit_Call(self, node: Call) -> Call | Constant:
-        self.generic_visit(node)
+    def visit_Call(self, node: Call) -> Call | Constant | Evaluate:
         match node:
             case Call(
                 func=Constant(MockObj('eval')),
-                args=[Constant(MockObj('MockStr', obj=code))],
+                args=[Constant(str(code))],
             ):
-                return self.visit(ast.parse(code, mode='eval')).body
+                return Evaluate(self.parse_payload(code, 'eval'), _body)
             case Call(
                 func=Constant(MockObj('eval')),
                 args=[Constant(MockObj('MockCodeObj', obj=code))],
             ):
-                return self.visit(ast.parse(code, mode='eval')).body
+                return Evaluate(self.parse_payload(code, 'eval'), _body)
             case Call(
                 func=Constant(MockObj() as func),
                 args=[*args_list],
@@ -493,7 +783,9 @@ class SecondLayerTransformer(ast.NodeTransformer):
                     match arg:
                         case Constant(MockObj(obj=None) as value):
                             args.append(value)
-                        case Constant(MockObj(obj=value)):
+                        case Constant(MockObj(obj=value) | MockStrList(items=value)):
+                            args.append(value)
+                        case Constant(str() | int() | float() | bytes() as value):
                             args.append(value)
                         case _:
                             return node
@@ -507,16 +799,22 @@ class SecondLayerTransformer(ast.NodeTransformer):
                             kwargs[key] = value
                         case keyword(
                             arg=str(key),
-                            value=Constant(MockObj(obj=value)),
+                            value=Constant(MockObj(obj=value) | MockStrList(items=value)),
+                        ):
+                            kwargs[key] = value
+                        case keyword(
+                            arg=str(key),
+                            value=Constant(str() | int() | float() | bytes() as value),
                         ):
                             kwargs[key] = value
                         case _:
                             return node
                 try:
                     res = func(*args, **kwargs)
-                except (ValueError, TypeError):
-                    logger.exception('Exception encountered during function evaluation')
-                    logger.error(ast.dump(node, indent=2))
+                except (ValueError, TypeError) as exc:
+                    if active_tracers.get():
+                        trace('call', func.name, outcome=f'raised {type(exc).__name__}', node=node)
+                    logger.exception('Exception encountered during evaluation of %s', func.name)
                     raise
                 else:
                     if res is None:
@@ -525,13 +823,11 @@ class SecondLayerTransformer(ast.NodeTransformer):
             case _:
                 return node
 
-    @override
     def visit_BinOp(self, node: BinOp) -> BinOp | Constant:
-        self.generic_visit(node)
         match node:
             case BinOp(
-                left=Constant(MockObj('MockInt', obj=int(left))),
-                right=Constant(MockObj('MockInt', obj=int(right))),
+                left=Constant(int(left)),
+                right=Constant(int(right)),
                 op=op,
             ):
                 match op:
@@ -541,13 +837,11 @@ class SecondLayerTransformer(ast.NodeTransformer):
                         num = left - right
                     case _:
                         return node
-                return Constant(MockInt(num))
+                return Constant(num)
             case _:
                 return node
 
-    @override
     def visit_BoolOp(self, node: BoolOp) -> Any:
-        self.generic_visit(node)
         match node:
             case BoolOp(
                 op=op,
@@ -558,7 +852,7 @@ class SecondLayerTransformer(ast.NodeTransformer):
                     match value:
                         case Constant(MockObj('True' | 'False', obj=bool(num))):
                             nums.append(num)
-                        case Constant(MockObj('MockInt', obj=int(num))):
+                        case Constant(int(num)):
                             nums.append(num)
                         case _:
                             return node
@@ -569,13 +863,34 @@ class SecondLayerTransformer(ast.NodeTransformer):
                         res = any(nums)
                     case _:
                         return node
-                return Constant(MockInt(res))
+                return Constant(res)
             case _:  # type: ignore[reportUnnecessaryComparison]
                 return node  # type: ignore[reportUnreachable]
 
-    @override
+    def visit_Compare(self, node: Compare) -> Compare | Constant:
+        operands: list[Any] = []
+        for operand in (node.left, *node.comparators):
+            match operand:
+                case Constant(MockObj('True' | 'False', obj=bool(value))):
+                    operands.append(value)
+                case Constant(str() | int() | float() | bytes() as value):
+                    operands.append(value)
+                case _:
+                    return node
+        res: Any = True
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if not isinstance(op, ast.cmpop) or op.__class__ not in op_dict:
+                return node
+            try:
+                res = op_dict[op.__class__](left, right)
+            except TypeError:
+                return node
+            # Chained comparisons stop at the first false one
+            if not res:
+                break
+        return Constant(res)
+
     def visit_Lambda(self, node: Lambda) -> Lambda | Constant:
-        self.generic_visit(node)
         match node:
             case Lambda(
                 args=arguments(args=[arg(arg=str())]),
@@ -590,28 +905,250 @@ class SecondLayerTransformer(ast.NodeTransformer):
                 return node
 
 
-def revert_mocks(obj: MockObj) -> Constant | Name:
+def truth(node: ast.expr) -> bool | None:
+    """
+    Truth value of an evaluated condition
+    :return: None if it is not known, e.g. for mocks standing in for arbitrary globals
+    """
+    match node:
+        case Constant(MockObj('True' | 'False', obj=bool(value))):
+            return value
+        case Constant(MockObj(func=func)):
+            # Functions are always true
+            return True if func is not None else None
+        case Constant(MockStrList(items=items)):
+            return bool(items)
+        case Constant(value):
+            return bool(value)
+        case _:
+            return None
+
+
+# Nodes a class body may be made of for the class to be dropped when nothing uses it. Defining such a
+# class only binds names, it cannot call anything
+_INERT_NODES = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.arguments, ast.arg, Pass, Expr, Assign,
+    Constant, Name, UnaryOp, BinOp, ast.Tuple, ast.expr_context, ast.unaryop, ast.operator,
+)
+_INERT_DECORATORS = frozenset({'property', 'staticmethod', 'classmethod'})
+
+
+def is_inert_class(node: ClassDef) -> bool:
+    if node.bases or node.keywords or node.decorator_list:
+        return False
+    for item in node.body:
+        match item:
+            case ast.FunctionDef() | ast.AsyncFunctionDef():
+                if item.returns is not None:
+                    return False
+                for decorator in item.decorator_list:
+                    match decorator:
+                        case Name(id=str(name)) if name in _INERT_DECORATORS:
+                            pass
+                        case _:
+                            return False
+                # Only the arguments are evaluated on definition, the body is not
+                defined: list[ast.AST] = [item.args]
+            case Assign(targets=[*targets]) if all(isinstance(target, Name) for target in targets):
+                defined = [item]
+            case Pass() | Expr(Constant()):
+                defined = [item]
+            case _:
+                return False
+        for part in defined:
+            for child in ast.walk(part):
+                if not isinstance(child, _INERT_NODES) or (child.__class__ is ast.arg and child.annotation):
+                    return False
+    return True
+
+
+# Nodes that change the function they are in even if they never run: a yield makes it a generator,
+# and await, global and nonlocal change what it may do or which names are its locals
+_SCOPE_MARKERS = (ast.Yield, ast.YieldFrom, ast.Await, ast.Global, ast.Nonlocal)
+_NESTED_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+# Nodes that always bind a name, see binds_name
+_BINDINGS = (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def binds_name(node: ast.AST) -> bool:
+    """
+    Whether node binds a name, which inside a function makes it a local of the whole function,
+    so a read of it elsewhere no longer falls back to the global even if node never runs
+    """
+    match node:
+        case Name(ctx=ast.Store() | ast.Del()):
+            return True
+        case ast.ExceptHandler(name=str()) | ast.MatchAs(name=str()) | ast.MatchStar(name=str()):
+            return True
+        case ast.MatchMapping(rest=str()):
+            return True
+        case _:
+            return isinstance(node, _BINDINGS)
+
+
+def affects_scope(nodes: Sequence[ast.AST], in_function: bool = False) -> bool:
+    """
+    Whether removing nodes could change the scope they are in, so they have to stay even when unreachable
+    The bodies of nested functions, lambdas and classes are their own scopes and are not looked into
+    :param in_function: Whether nodes are inside a function, where any name they bind is one of its locals
+    """
+    stack = [*nodes]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, _SCOPE_MARKERS) or (in_function and binds_name(node)):
+            return True
+        nested = isinstance(node, _NESTED_SCOPES)
+        for name in node._fields:
+            if nested and name == 'body':
+                continue
+            value = getattr(node, name, None)
+            if value.__class__ is list:
+                stack.extend(item for item in value if isinstance(item, ast.AST))  # type: ignore[reportUnknownVariableType]
+            elif isinstance(value, ast.AST):
+                stack.append(value)
+    return False
+
+
+def function_branches(tree: ast.AST) -> set[int]:
+    """
+    ids of the If, While and IfExp nodes in tree that are inside a function or lambda, or a class in one
+    """
+    branches: set[int] = set()
+    stack: list[tuple[ast.AST, bool]] = [(tree, False)]
+    while stack:
+        node, in_function = stack.pop()
+        if in_function and isinstance(node, (If, While, IfExp)):
+            branches.add(id(node))
+        in_function = in_function or isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda))
+        stack.extend((child, in_function) for child in ast.iter_child_nodes(node))
+    return branches
+
+
+@dataclass(slots=True)
+class SecondLayerPrune(IterativeTransformer):
+    """
+    Removes the junk Hyperion pads the code with: branches behind opaque predicates such as
+    if 365101 > 7435378, expression statements that evaluated to a constant, and classes nothing uses
+    Runs before SecondLayerCleanup, while the truth of the mocks is still known
+    """
+    var_dict: MutableMapping[str, MockValue]
+    # Branches inside functions, where dead code still decides which names are locals
+    local_branches: set[int] = field(default_factory=set)
+    eager = frozenset({Name, Constant})
+
+    @override
+    def visit(self, node: ast.AST) -> Any:
+        self.local_branches = function_branches(node)
+        return IterativeTransformer.visit(self, node)
+
+    def visit_If(self, node: If) -> If | list[stmt]:
+        in_function = id(node) in self.local_branches
+        match truth(node.test):
+            case True if not affects_scope(node.orelse, in_function):
+                return node.body
+            case False if not affects_scope(node.body, in_function):
+                return node.orelse
+            case _:
+                return self.fill_body(node)
+
+    def visit_While(self, node: While) -> While | list[stmt]:
+        if truth(node.test) is False and not affects_scope(node.body, id(node) in self.local_branches):
+            return node.orelse
+        return self.fill_body(node)
+
+    def visit_IfExp(self, node: IfExp) -> ast.expr:
+        in_function = id(node) in self.local_branches
+        match truth(node.test):
+            case True if not affects_scope([node.orelse], in_function):
+                return node.body
+            case False if not affects_scope([node.body], in_function):
+                return node.orelse
+            case _:
+                return node
+
+    def visit_Expr(self, node: Expr) -> Expr | None:
+        match node:
+            # Strings may be docstrings
+            case Expr(Constant(str())):
+                return node
+            case Expr(Constant()):
+                return None
+            case _:
+                return node
+
+    def fill_body(self, node: Any) -> Any:
+        """
+        Keeps compound statements valid when every statement in their body was removed
+        """
+        if not node.body:
+            node.body = [Pass()]
+        return node
+
+    def visit_Try(self, node: Try) -> Try:
+        # Without handlers, a try needs its finally block
+        if not node.handlers and not node.finalbody:
+            node.finalbody = [Pass()]
+        return self.fill_body(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = fill_body
+    visit_For = visit_AsyncFor = visit_With = visit_AsyncWith = fill_body
+    visit_TryStar = visit_ExceptHandler = visit_match_case = fill_body
+
+    def visit_Module(self, node: Module) -> Module:
+        """
+        Drops top level classes that nothing outside of them refers to, until none are left
+        """
+        used = [self.names_used(item) for item in node.body]
+        while True:
+            unused = {
+                idx for idx, item in enumerate(node.body)
+                if isinstance(item, ClassDef) and is_inert_class(item)
+                and not any(item.name in names for other, names in enumerate(used) if other != idx)
+            }
+            if not unused:
+                return node
+            for idx in unused:
+                logger.info('Removing unused class %s', node.body[idx].name)  # type: ignore[reportAttributeAccessIssue]
+            node.body = [item for idx, item in enumerate(node.body) if idx not in unused]
+            used = [names for idx, names in enumerate(used) if idx not in unused]
+
+    def names_used(self, tree: ast.AST) -> set[str]:
+        """
+        Every name tree could refer to a global by, including the ones SecondLayerCleanup will put back
+        """
+        names: set[str] = set()
+        for node in ast.walk(tree):
+            match node:
+                case Name(id=str(name)):
+                    names.add(name)
+                    if isinstance(value := self.var_dict.get(name), MockObj):
+                        names.add(value.name)
+                case Attribute(attr=str(name)) | Constant(str(name)) | Constant(MockObj(name)):
+                    names.add(name)
+                case _:
+                    pass
+        return names
+
+
+def revert_mocks(obj: MockValue) -> Constant | Name:
     match obj:
-        case MockObj('MockStr', obj=str(string)):
-            return Constant(string)
-        case MockObj('MockInt', obj=int(num)):
-            return Constant(num)
-        case MockObj('MockFloat', obj=float(num)):
-            return Constant(num)
-        case MockObj('MockBytes', obj=bytes(num)):
-            return Constant(num)
+        case MockStrList():
+            logger.info('Could not identify object MockStrList')
+            return Name(id='MockStrList')
         case MockObj(('str' | 'eval' | 'exec' | '__import__' | 'unhexlify') as name):
             return Name(id=name)
         case MockObj(name):
-            logger.info(f'Could not identify object {name}')
+            logger.info('Could not identify object %s', name)
             return Name(id=name)
+        case _:
+            return Constant(obj)
 
 
 @dataclass(slots=True)
-class SecondLayerCleanup(ast.NodeTransformer):
-    var_dict: MutableMapping[str, MockObj]
+class SecondLayerCleanup(IterativeTransformer):
+    var_dict: MutableMapping[str, MockValue]
+    eager = frozenset({Name, Constant})
 
-    @override
     def visit_Name(self, node: Name) -> Name | Constant:
         match node:
             case Name(id=str(name)) if name in self.var_dict:
@@ -619,10 +1156,9 @@ class SecondLayerCleanup(ast.NodeTransformer):
             case _:
                 return node
 
-    @override
     def visit_Constant(self, node: Constant) -> Any:
         match node:
-            case Constant(MockObj() as obj):
+            case Constant(MockObj() | MockStrList() as obj):
                 return revert_mocks(obj)
             case _:
                 return node
@@ -637,14 +1173,16 @@ def deobf_second_layer(ast_tree: Module) -> str:
             raise DeobfuscationFailError()
     ast_tree.body.pop(0)
     slt = SecondLayerTransformer()
+    slp = SecondLayerPrune(slt.var_dict)
     slc = SecondLayerCleanup(slt.var_dict)
-    payload = slc.visit(slt.visit(ast_tree))
+    payload = slc.visit(slp.visit(slt.visit(ast_tree)))
     return ast.unparse(payload)
 
 
 def full_hyperion_deobf(first_layer: str) -> str:
     logger.info('Deobfuscating first layer')
     second_layer = deobf_first_layer(ast.parse(first_layer))
+    report_layer(second_layer)
     logger.info('First layer successfully deobfuscated, deobfuscating second layer')
     try:
         return deobf_second_layer(ast.parse(second_layer))
@@ -653,17 +1191,34 @@ def full_hyperion_deobf(first_layer: str) -> str:
             'Second layer could not be deobfuscated, returning obfuscated second layer'
         )
         return second_layer
+    except RecursionError:
+        # ast.unparse recurses, so expressions too deep to fold can't be turned back into source
+        logger.error(
+            'Second layer is nested too deeply to unparse, returning obfuscated second layer'
+        )
+        return second_layer
 
 
 def format_results(code: str) -> str:
     return code
 
 
-@dataclass
-class HyperionScanner(ast.NodeVisitor):
-    signature_found: bool = False
+COMMENT_REGEX = re.compile(
+    rb'# sourcery skip: collection-to-bool, remove-redundant-boolean, remove-redundant-except-handler'
+)
+
+
+HYPERION_NAMES_REGEX = re.compile(rb'__obfuscator__|__authors__|__github__')
+
 
+class HyperionScanner(SchemaScanner):
     @override
+    def start(self, ctx: ScanContext):
+        if COMMENT_REGEX.search(ctx.data):
+            self.matched()
+        elif not HYPERION_NAMES_REGEX.search(ctx.data):
+            self.impossible()
+
     def visit_Assign(self, node: Assign):
         match node:
             case (
@@ -677,24 +1232,26 @@ class HyperionScanner(ast.NodeVisitor):
                     targets=[Name(id='__github__')],
                 )
             ):
-                self.signature_found = True
-                return
+                self.matched()
             case _:
-                self.generic_visit(node)
-
-
-COMMENT_REGEX = re.compile(
-    r'# sourcery skip: collection-to-bool, remove-redundant-boolean, remove-redundant-except-handler'
-)
+                pass
 
 
-def scan(code: str):
-    if COMMENT_REGEX.search(code):
-        return True
-    hyp_scanner = HyperionScanner()
-    hyp_scanner.visit(ast.parse(code))
-    return hyp_scanner.signature_found
+def scan(ctx: ScanContext):
+    return run_scanners(ctx, [HyperionScanner()])[0]
 
 
-hyperion_deobf = Deobfuscator(full_hyperion_deobf, format_results, scan)
+hyperion_deobf = Deobfuscator(
+    full_hyperion_deobf,
+    format_results,
+    scan,
+    HyperionScanner,
+    signatures=(
+        COMMENT_REGEX.pattern,
+        b'__obfuscator__',
+        b'__authors__',
+        b'__github__',
+    ),
+    name='hyperion',
+)
 register(hyperion_deobf)
@@ -15,13 +15,22 @@ import lzma
 import re
 from ast import Attribute, Call, Constant, Expr, Import, Name, alias
 
-from vipyr_deobf.deobf_base import Deobfuscator, register
+from typing_extensions import Buffer
+
+from vipyr_deobf.deobf_base import (
+    Deobfuscator,
+    ScanContext,
+    SchemaScanner,
+    register,
+    run_scanners,
+)
 from vipyr_deobf.deobf_utils import WEBHOOK_REGEX
 
 
-def deobf(code: str) -> re.Match:
+def deobf(data: Buffer) -> re.Match:
     """
     Extracts webhook from code
+    Works on the raw bytes, the outer layer is only ever searched for a bytes literal
     """
     code = lzma.decompress(
         ast.literal_eval(
@@ -29,7 +38,7 @@ def deobf(code: str) -> re.Match:
                 r"(b'.+?')\n",
                 lzma.decompress(base64.b64decode(
                     ast.literal_eval(
-                        re.search(r"b'.+?'", code).group(0)
+                        re.search(rb"b'.+?'", data).group(0).decode()
                     )
                 )).decode()
             ).group(1)
@@ -55,20 +64,26 @@ def format_results(webhook_match: re.Match) -> str:
         return "No webhook found."
 
 
-class LZMAScanner(ast.NodeVisitor):
+class LZMAScanner(SchemaScanner):
+    requires = (b'base64', b'lzma', b'print', b'compile', b'decompress', b'b64decode')
+
     def __init__(self):
+        super().__init__()
         self.base64_import_found = False
         self.lzma_import_found = False
         self.payload_found = False
 
+    def check_found(self):
+        if self.base64_import_found and self.lzma_import_found and self.payload_found:
+            self.matched()
+
     def visit_Import(self, node):
         match node:
             case Import(names=[alias(name='base64')]):
                 self.base64_import_found = True
-                return
             case Import(names=[alias(name='lzma')]):
                 self.lzma_import_found = True
-                return
+        self.check_found()
 
     def visit_Expr(self, node):
         match node:
@@ -101,18 +116,17 @@ class LZMAScanner(ast.NodeVisitor):
                 )
             ) if isinstance(payload, bytes):
                 self.payload_found = True
-                return
+                self.check_found()
 
 
-def scan(code: str):
-    lzma_scanner = LZMAScanner()
-    lzma_scanner.visit(ast.parse(code))
-    return (
-        lzma_scanner.base64_import_found
-        and lzma_scanner.lzma_import_found
-        and lzma_scanner.payload_found
-    )
+def scan(ctx: ScanContext):
+    return run_scanners(ctx, [LZMAScanner()])[0]
 
 
-lzmaspam_deobf = Deobfuscator(deobf, format, scan)
+lzmaspam_deobf = Deobfuscator(
+    deobf, format_results, scan, LZMAScanner,
+    signatures=(b'lzma',),
+    name='lzmaspam',
+    takes_bytes=True,
+)
 register(lzmaspam_deobf)
@@ -4,20 +4,41 @@ import hashlib
 import logging
 from ast import Assign, Attribute, Call, Constant, Dict, Lambda, Name, keyword
 
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
-
-from vipyr_deobf.deobf_base import Deobfuscator, register
-from vipyr_deobf.deobf_utils import WEBHOOK_REGEX
+from vipyr_deobf.deobf_base import (
+    Deobfuscator,
+    ScanContext,
+    SchemaScanner,
+    register,
+    run_scanners,
+    walk_scanners,
+)
+from vipyr_deobf.deobf_utils import WEBHOOK_REGEX, lazy_import
 
 logger = logging.getLogger('deobf')
 
+AES = lazy_import('Crypto.Cipher.AES')
+padding = lazy_import('Crypto.Util.Padding')
+
 
-class PayloadExtractor(ast.NodeVisitor):
-    def __init__(self):
+class PayloadExtractor(SchemaScanner):
+    """
+    Scanning stops at the first payload, extracting with last=True walks the whole tree and
+    keeps the last one, as that is the one a sample assigning several would run
+    """
+    requires = (b'obfuscate',)
+
+    def __init__(self, last: bool = False):
+        super().__init__()
+        self.last = last
         self.obf_type = None
         self.payload = None
 
+    def found(self, obf_type, payload):
+        self.obf_type = obf_type
+        self.payload = payload
+        if not self.last:
+            self.matched()
+
     def visit_Assign(self, node):
         match node:
             case Assign(
@@ -59,8 +80,7 @@ class PayloadExtractor(ast.NodeVisitor):
                     ]
                 )
             ):
-                self.obf_type = obf_type
-                self.payload = (payload_00, payload_10, bytes.fromhex(payload_12.replace('\n', '')))
+                self.found(obf_type, (payload_00, payload_10, bytes.fromhex(payload_12.replace('\n', ''))))
             case Assign(
                 targets=[Name(id='obfuscate' as obf_type)],
                 value=Dict(
@@ -68,8 +88,7 @@ class PayloadExtractor(ast.NodeVisitor):
                     values=[Constant(value=value)],
                 )
             ):
-                self.obf_type = obf_type
-                self.payload = (key, value)
+                self.found(obf_type, (key, value))
 
 
 PayloadType1 = tuple[str, str, bytes]
@@ -77,8 +96,8 @@ PayloadType2 = tuple[str, str]
 
 
 def extract_payload(tree: ast.Module) -> None | tuple[str, PayloadType1 | PayloadType2]:
-    extractor = PayloadExtractor()
-    extractor.visit(tree)
+    extractor = PayloadExtractor(last=True)
+    walk_scanners(tree, [extractor])
     if not extractor.obf_type:
         logger.error('Payload not found')
         return None
@@ -101,7 +120,7 @@ def deobf_first_variant(key0: str, value0: str, value2: bytes) -> str:
 def first_variant_decoder(key: bytes, data: bytes) -> str:
     cipher = AES.new(key, AES.MODE_CBC, data[:AES.block_size])
     decrypted_data = cipher.decrypt(data[AES.block_size:])
-    return unpad(decrypted_data, AES.block_size).decode()
+    return padding.unpad(decrypted_data, AES.block_size).decode()
 
 
 def deobf_second_variant(value: str, key: str) -> str:
@@ -141,11 +160,14 @@ def format_results(deobfed_code: str) -> str:
     return deobfed_code
 
 
-def scan(code: str):
-    extractor = PayloadExtractor()
-    extractor.visit(ast.parse(code))
-    return bool(extractor.obf_type)
+def scan(ctx: ScanContext):
+    return run_scanners(ctx, [PayloadExtractor()])[0]
 
 
-pyobfuscate_deobf = Deobfuscator(deobf, format_results, scan)
+pyobfuscate_deobf = Deobfuscator(
+    deobf, format_results, scan, PayloadExtractor,
+    # Covers both the pyobfuscate and obfuscate variable names
+    signatures=(b'obfuscate',),
+    name='pyobfuscate',
+)
 register(pyobfuscate_deobf)
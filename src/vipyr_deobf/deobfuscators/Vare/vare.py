@@ -10,14 +10,22 @@ import logging
 import re
 import zlib
 
-from cryptography.fernet import Fernet
-
+from vipyr_deobf.deobf_base import (
+    Deobfuscator,
+    ScanContext,
+    SchemaScanner,
+    register,
+    run_scanners,
+)
+from vipyr_deobf.deobf_utils import WEBHOOK_REGEX, LayerCache, lazy_import, report_layer
 from vipyr_deobf.exceptions import DeobfuscationFailError
-from vipyr_deobf.deobf_base import Deobfuscator, register
-from vipyr_deobf.deobf_utils import WEBHOOK_REGEX
 
 logger = logging.getLogger('deobf')
 
+fernet = lazy_import('cryptography.fernet')
+
+layer_cache: LayerCache[str] = LayerCache('vare')
+
 
 def deobf_layer(code: str) -> str:
     """
@@ -25,10 +33,10 @@ def deobf_layer(code: str) -> str:
     """
     key = ast.literal_eval(re.search(r'__mikey__\s*=\s*(([\'"]).+\2);mydata', code).group(1))
     data = ast.literal_eval(re.search(r'mydata\s*=\s*(([\'"]).+\2)', code).group(1))
-    fernet = Fernet(base64.b64decode(key))
+    key_fernet = fernet.Fernet(base64.b64decode(key))
     marshalled = zlib.decompress(base64.b32decode(base64.b64decode(
         base64.b64decode(base64.b64decode(base64.b32decode(
-            base64.b64decode(fernet.decrypt(bytes.fromhex(data)))
+            base64.b64decode(key_fernet.decrypt(bytes.fromhex(data)))
         )))[::-1]
     )))
     try:
@@ -39,11 +47,20 @@ def deobf_layer(code: str) -> str:
 
 def deobf(code: str) -> str:
     i = 0
-    while scan(code):
+    peeled = []
+    while scan(ScanContext(code)):
+        layer_key = layer_cache.key(code)
+        if (cached := layer_cache.get(layer_key)) is not None:
+            logger.info(f'Layer {i} was deobfuscated before, reusing its result')
+            code = cached
+            break
+        peeled.append(layer_key)
         logger.info(f'Deobfuscating layer {i}')
         code = deobf_layer(code)
+        report_layer(code)
         i += 1
     logger.info(f'Finished deobfuscating at layer {i}')
+    layer_cache.put(peeled, code)
     return code
 
 
@@ -67,21 +84,37 @@ def format_results(result: str) -> str:
     return result + '\n\n' + '\n'.join(re.findall(WEBHOOK_REGEX, result))
 
 
-VARE_NAME_REGEX = re.compile(r'__VareObfuscator__')
-SAINT_REGEX = re.compile(r'def saint\d+\(\):')
-MIKEY_REGEX = re.compile(r'__mikey__')
+VARE_NAME_REGEX = re.compile(rb'__VareObfuscator__')
+SAINT_REGEX = re.compile(rb'def saint\d+\(\):')
+MIKEY_REGEX = re.compile(rb'__mikey__')
 
 
-def scan(code: str):
-    return any(
-        pattern.search(code)
-        for pattern in (
-            VARE_NAME_REGEX,
-            SAINT_REGEX,
-            MIKEY_REGEX,
-        )
-    )
-
+class VareScanner(SchemaScanner):
+    """
+    Vare is recognized from the raw bytes alone, so this never needs the text or the tree
+    """
 
-vare_deobf = Deobfuscator(deobf, format_results, scan)
+    def start(self, ctx: ScanContext):
+        if any(
+            pattern.search(ctx.data)
+            for pattern in (
+                VARE_NAME_REGEX,
+                SAINT_REGEX,
+                MIKEY_REGEX,
+            )
+        ):
+            self.matched()
+        else:
+            self.impossible()
+
+
+def scan(ctx: ScanContext):
+    return run_scanners(ctx, [VareScanner()])[0]
+
+
+vare_deobf = Deobfuscator(
+    deobf, format_results, scan, VareScanner,
+    signatures=(b'__VareObfuscator__', b'def saint', b'__mikey__'),
+    name='vare',
+)
 register(vare_deobf)
@@ -0,0 +1,99 @@
+"""
+Library API: an Engine loads the selected deobfuscators once and then scans and deobfuscates
+samples in the calling thread, returning results instead of printing them
+
+    engine = Engine('hyperion,blankobf')
+    for data in samples:
+        result = engine.deobfuscate(data)
+        if result.success:
+            store(result.output, result.iocs)
+
+Unlike the CLI it never configures logging: records go to the 'deobf' and per-schema loggers,
+and the host decides whether they are handled
+"""
+
+import logging
+import time
+from collections.abc import Sequence
+from typing import Any
+
+from typing_extensions import Buffer
+
+from vipyr_deobf.deobf_base import (
+    DEOBFS,
+    Deobfuscator,
+    ScanContext,
+    SignaturePrefilter,
+    load_deobf,
+    parse_deobf_types,
+    scan_deobfs,
+)
+from vipyr_deobf.exceptions import DeobfuscationFailError
+from vipyr_deobf.result import DeobfResult, extract_iocs
+
+logger = logging.getLogger('deobf')
+
+
+class Engine:
+    """
+    Scans and deobfuscates samples with a fixed set of deobfuscators
+    Loading happens once, in the constructor; deobfuscators another engine or the CLI already loaded
+    are shared rather than loaded again. Calls keep no state between samples, so one engine can serve
+    a whole process, but it is not meant to be shared between threads running samples at once
+    :param types: auto, or comma separated schemas as for the CLI's --type
+    :raises DeobfLoadingError: If a schema or version does not exist
+    """
+
+    def __init__(self, types: str = 'auto'):
+        deobfs: list[Deobfuscator[Any]] = []
+        for name, version, path in parse_deobf_types(types):
+            if version not in DEOBFS.get(name, {}):
+                load_deobf(name, version, path)
+            deobfs.append(DEOBFS[name][version])
+        self.deobfs: Sequence[Deobfuscator[Any]] = tuple(deobfs)
+        self.prefilter = SignaturePrefilter(self.deobfs)
+
+    def scan(self, data: str | Buffer | ScanContext) -> list[Deobfuscator[Any]]:
+        """
+        :return: The deobfuscators whose scanners match data, see deobf_base.scan_deobfs
+        """
+        return scan_deobfs(data, prefilter=self.prefilter)
+
+    def deobfuscate(
+        self,
+        data: str | Buffer | ScanContext,
+        skip_scan: bool = False,
+        label: str = '<source>',
+    ) -> DeobfResult:
+        """
+        Deobfuscates data with the first matching deobfuscator that succeeds
+        Never raises for a bad sample: a sample no deobfuscator handles has status fail, and one
+        that crashes a deobfuscator has status error
+        :param skip_scan: Try every deobfuscator of the engine instead of only the matching ones
+        :param label: Name of the sample in the result
+        """
+        start = time.perf_counter()
+        ctx = data if isinstance(data, ScanContext) else ScanContext(data)
+        result = DeobfResult(label, 'fail', size=len(memoryview(ctx.data)))
+        try:
+            deobfs = self.deobfs if skip_scan else self.scan(ctx)
+            mark = time.perf_counter()
+            result.timings['scan'] = mark - start
+            for deobf in deobfs:
+                try:
+                    output = deobf.format_results(deobf.deobf(ctx))
+                except DeobfuscationFailError:
+                    continue
+                result.status = 'success'
+                result.schema, result.version = deobf.name, deobf.version
+                result.output = output
+                result.iocs = extract_iocs(output)
+                break
+            result.timings['deobf'] = time.perf_counter() - mark
+        except Exception as exc:
+            # The result only carries the message, the traceback goes to the host's handlers
+            logger.exception(f'Deobfuscation of {label} crashed')
+            result.status = 'error'
+            result.error = f'{type(exc).__name__}: {exc}'
+        result.elapsed = time.perf_counter() - start
+        return result
@@ -24,3 +24,22 @@ class DeobfuscationFailError(Error):
 
 class DeobfLoadingError(Error):
     pass
+
+
+class SampleTimeoutError(BaseException):
+    """
+    Raised inside a worker when a sample exceeds its time budget
+    Not an Exception, so the catch-alls deobfuscators use around hostile code can't swallow it
+    """
+
+
+class WorkerDiedError(Error):
+    """
+    Raised by the supervisor when an isolated worker exits without a result
+    """
+
+
+class ServerBusyError(Error):
+    """
+    Raised when the deobfuscation server's request queue is full
+    """
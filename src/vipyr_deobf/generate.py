@@ -0,0 +1,468 @@
+"""
+Synthetic samples: builds obfuscated inputs of any size for each schema, in the formats the
+deobfuscators parse, so scaling can be measured without checking real malware into the repo
+
+    python -m vipyr_deobf.generate hyperion --size 1000000 --layers 3 -o big_hyperion.py
+
+Every sample wraps a generated payload program of about size bytes, whose blocks are nested depth
+levels deep and which holds a webhook, so IOC extraction has something to find. layers is the number
+of times the schema's obfuscation is applied; schemas whose deobfuscator only peels a fixed structure
+only accept 1. Generation is deterministic for a given seed, except where a cipher insists on a random IV
+"""
+
+import argparse
+import ast
+import base64
+import codecs
+import hashlib
+import lzma
+import random
+import string
+import sys
+import zlib
+from collections.abc import Callable
+
+from vipyr_deobf.deobf_utils import lazy_import
+
+fernet = lazy_import('cryptography.fernet')
+AES = lazy_import('Crypto.Cipher.AES')
+padding = lazy_import('Crypto.Util.Padding')
+
+MAX_DEPTH = 90
+
+# Schemas whose deobfuscator peels a fixed structure instead of looping over layers
+SINGLE_LAYER = frozenset({'lzmaspam', 'pyobfuscate'})
+
+BLANKOBF_BANNER = '""":: You managed to break through BlankOBF v2; Give yourself a pat on your back! ::"""\n'
+
+HYPERION_COMMENT = (
+    '# sourcery skip: collection-to-bool, remove-redundant-boolean, remove-redundant-except-handler'
+)
+
+# Step of -1 the way Hyperion writes it, for reversed strings
+HYPERION_REVERSE = '[::+-+-(-(+1))]'
+
+
+def make_webhook(rng: random.Random) -> str:
+    token = ''.join(rng.choices(string.ascii_letters + string.digits + '_-', k=68))
+    return f'https://discord.com/api/webhooks/{rng.randrange(10 ** 17, 10 ** 18)}/{token}'
+
+
+def make_payload(size: int, depth: int = 1, rng: random.Random | None = None) -> str:
+    """
+    Builds a valid program of at least size bytes out of functions whose blocks nest depth levels deep
+    The payload only calls print, len and range, which no schema resolves or mocks
+    """
+    if not 1 <= depth <= MAX_DEPTH:
+        raise ValueError(f'depth must be between 1 and {MAX_DEPTH}')
+    rng = rng or random.Random(0)
+    parts = [f'WEBHOOK = {make_webhook(rng)!r}\n']
+    total = len(parts[0])
+    index = 0
+    while total < size:
+        lines = [f'def step_{index}(value):']
+        for level in range(depth):
+            indent = '    ' * (level + 1)
+            if level % 2:
+                lines.append(f'{indent}for item in range({rng.randrange(2, 10)}):')
+            else:
+                lines.append(f'{indent}if value > {rng.randrange(1000)}:')
+        indent = '    ' * (depth + 1)
+        text = ''.join(rng.choices(string.ascii_letters, k=rng.randrange(8, 40)))
+        lines.append(f'{indent}value = value * {rng.randrange(2, 100)} + len({text!r})')
+        lines.append('    return value')
+        lines.append(f'print(step_{index}({rng.randrange(1000)}), WEBHOOK)\n')
+        block = '\n'.join(lines)
+        parts.append(block)
+        total += len(block)
+        index += 1
+    return ''.join(parts)
+
+
+def _identifier(rng: random.Random, alphabet: str = 'IlJjLi', length: int = 20) -> str:
+    return rng.choice('IJL') + ''.join(rng.choices(alphabet, k=length - 1))
+
+
+def generate_fct(payload: str, layers: int, rng: random.Random) -> str:
+    """
+    Each layer is zlib, then base64, then reversed, and every inner layer is wrapped as exec((_)(b'...'))
+    """
+    data = payload.encode()
+    for layer in range(layers):
+        if layer:
+            data = b"exec((_)(b'" + data + b"'))"
+        data = base64.b64encode(zlib.compress(data))[::-1]
+    return (
+        "_ = lambda __ : __import__('zlib').decompress(__import__('base64').b64decode(__[::-1]));"
+        f"exec((_)(b'{data.decode()}'))"
+    )
+
+
+def _vare_junk(rng: random.Random) -> str:
+    functions = []
+    for _ in range(rng.randrange(3, 7)):
+        functions.append(
+            f'def saint{rng.randrange(10 ** 6, 10 ** 7)}():\n'
+            f'    if {rng.randrange(10 ** 6, 10 ** 7)} == {rng.randrange(10 ** 6, 10 ** 7)}:\n\n'
+            f'        print({rng.randrange(10 ** 6)})\n'
+            f'        aaa{rng.randrange(10 ** 6)} = {rng.randrange(10 ** 6)}\n\n'
+            f'    elif {rng.randrange(10 ** 6, 10 ** 7)} == {rng.randrange(10 ** 6, 10 ** 7)}:\n\n'
+            f'        print({rng.randrange(10 ** 6)})\n'
+            f'        bbb{rng.randrange(10 ** 6)} = {rng.randrange(10 ** 6)}\n'
+        )
+    return '\n'.join(functions)
+
+
+def generate_vare(payload: str, layers: int, rng: random.Random) -> str:
+    """
+    Each layer marshals its source as a string, compresses and encodes it through Vare's chain of
+    base64 and base32, and encrypts the result with a fresh Fernet key stored next to it
+    """
+    code = payload
+    for _ in range(layers):
+        data = code.encode()
+        marshalled = b's' + len(data).to_bytes(4, 'little') + data
+        encoded = base64.b64encode(base64.b32encode(zlib.compress(marshalled)))[::-1]
+        encoded = base64.b64encode(base64.b32encode(base64.b64encode(base64.b64encode(encoded))))
+        key = base64.urlsafe_b64encode(rng.randbytes(32))
+        token = fernet.Fernet(key).encrypt(encoded)
+        code = (
+            "__VareObfuscator__ = ''\n\n"
+            f'{_vare_junk(rng)}\n'
+            'import base64 as ______;import marshal as ____;import zlib as __________;'
+            'from cryptography.fernet import Fernet;import base64;'
+            f'__mikey__="{base64.b64encode(key).decode()}";mydata="{token.hex()}";'
+            '__vare__ = lambda x: ____.loads(__________.decompress(______.b32decode(______.b64decode(x[::-1]))));'
+            '__mycip__= Fernet(base64.b64decode(__mikey__));__step1__=bytes.fromhex(mydata);'
+            '__step2__=__mycip__.decrypt(__step1__);__decr__=base64.b64decode(__step2__);'
+            f'__decrdata__=__decr__;__gotnew__=base64.b32decode(__decr__);__newdecr__={rng.randrange(10 ** 12)};'
+            '__getnew__=__newdecr__;__myb64code__=base64.b64decode(__gotnew__);'
+            '__myb64codee__=base64.b64decode(__myb64code__);___ = __myb64codee__;exec(__vare__(___))\n'
+        )
+    return code
+
+
+def _bytes_literal(data: bytes) -> str:
+    """
+    A bytes literal without any quote inside it, so a lazy regex up to the closing quote finds all of it
+    """
+    return "b'" + ''.join(
+        chr(byte) if 0x20 <= byte < 0x7f and byte not in b"'\\" else f'\\x{byte:02x}'
+        for byte in data
+    ) + "'"
+
+
+def generate_lzmaspam(payload: str, layers: int, rng: random.Random) -> str:
+    """
+    The payload is split over four variables, one rot13'd and one reversed, then lzma compressed
+    twice with base64 in between
+    """
+    encoded = base64.b64encode(payload.encode()).decode()
+    cuts = sorted(rng.sample(range(1, len(encoded)), 3)) if len(encoded) > 3 else [1, 2, 3]
+    a, b, c, d = (encoded[start:end] for start, end in zip([0, *cuts], [*cuts, None]))
+    code = (
+        f'___="{codecs.encode(a, "rot13")}";____="{b}";_____="{c[::-1]}";______="{d}";'
+        'exec(__import__("base64").b64decode(__import__("codecs").decode(___, "rot13")+____+_____[::-1]+______))'
+    )
+    inner = f'_ = {_bytes_literal(lzma.compress(code.encode()))}\nexec(__import__("lzma").decompress(_))\n'
+    outer = base64.b64encode(lzma.compress(inner.encode())).decode()
+    return (
+        'import base64\n'
+        'import lzma\n'
+        f"print(compile(lzma.decompress(base64.b64decode(b'{outer}')), '<string>', 'exec'))\n"
+    )
+
+
+def generate_pyobfuscate(payload: str, layers: int, rng: random.Random, variant: int = 1) -> str:
+    """
+    :param variant: 1 for the AES-CBC pyobfuscate variable, 2 for the PBKDF2 and AES-CFB obfuscate dict
+    """
+    data = payload.encode()
+    if variant == 1:
+        key0 = _identifier(rng, 'Oo0', 24)
+        value0 = _identifier(rng, 'Oo0', 24)
+        key = hashlib.sha256(f'{key0}{value0}'.encode()).digest()[:24]
+        iv = rng.randbytes(AES.block_size)
+        encrypted = iv + AES.new(key, AES.MODE_CBC, iv).encrypt(padding.pad(data, AES.block_size))
+        hex_lines = '\\n'.join(encrypted[i:i + 64].hex() for i in range(0, len(encrypted), 64))
+        return (
+            'pyobfuscate = (lambda **kwargs: kwargs)(**{'
+            f"'{key0}': '{value0}', 'exec': '', "
+            f"'eval': bytes.fromhex('{hex_lines}'.replace('\\n', ''))}})\n"
+        )
+    if variant == 2:
+        secret = _identifier(rng, 'Oo0', 32)
+        salt = rng.randbytes(8)
+        derived = hashlib.pbkdf2_hmac('sha256', secret.encode(), salt, 100000)
+        encrypted = AES.new(derived[:16], AES.MODE_CFB, derived[16:]).encrypt(data)
+        return f"obfuscate = {{'({secret})': '{base64.b85encode(salt + encrypted).decode()}'}}\n"
+    raise ValueError(f'Unknown pyobfuscate variant {variant}')
+
+
+def _blankobf_str(text: str) -> str:
+    return f'bytes({list(text.encode()[::-1])}[::-1]).decode()'
+
+
+def _blankobf_attr(module: str, name: str) -> str:
+    return f'getattr(__import__({_blankobf_str(module)}), {_blankobf_str(name)})'
+
+
+def _blankobf_builtin(name: str) -> str:
+    return _blankobf_attr('builtins', name)
+
+
+def _blankobf_name(rng: random.Random) -> str:
+    # Mostly CJK identifiers, like the real obfuscator's
+    return ''.join(chr(rng.randrange(0x4E00, 0x9FA5)) for _ in range(12))
+
+
+def _blankobf_exec_layer(payload: bytes, rng: random.Random) -> str:
+    # Four slices of padded strings, joined and decoded into the next layer
+    encoded = base64.b64encode(zlib.compress(payload)).decode()
+    cuts = sorted(rng.sample(range(1, len(encoded)), 3)) if len(encoded) > 3 else [1, 2, 3]
+    names = [_blankobf_name(rng) for _ in range(4)]
+    lines = []
+    for name, start, end in zip(names, [0, *cuts], [*cuts, None]):
+        part = encoded[start:end]
+        pad = ''.join(rng.choices(string.ascii_letters, k=rng.randrange(4, 32)))
+        lines.append(f'{name} = {_blankobf_str(pad + part + pad[::-1])}[{len(pad)}:{len(pad) + len(part)}]')
+    decoded = f'{_blankobf_attr("base64", "b64decode")}({" + ".join(names)})'
+    lines.append(f'{_blankobf_builtin("exec")}({_blankobf_attr("zlib", "decompress")}({decoded}))')
+    return '\n'.join(lines) + '\n'
+
+
+def _blankobf_xor_layer(payload: bytes, rng: random.Random) -> str:
+    # The payload xored with a key the loop finds by brute force, using two marker values in the list
+    key = rng.randrange(1, 256)
+    marker = rng.randrange(256)
+    data = [byte ^ key for byte in zlib.compress(payload)]
+    split = rng.randrange(len(data) + 1)
+    values = data[:split] + [marker, marker ^ key] + data[split:]
+    names = [_blankobf_name(rng) for _ in range(3)]
+    sliced = f'{names[0]}[:{split}] + {names[0]}[{split + 2}:]'
+    decompressed = (
+        f'{_blankobf_attr("zlib", "decompress")}({_blankobf_builtin("bytes")}('
+        f'{_blankobf_builtin("map")}(lambda {names[2]}: {names[2]} ^ {names[1]}, {sliced})))'
+    )
+    return (
+        f'{names[0]} = {values}\n'
+        f'for {names[1]} in {_blankobf_builtin("range")}(1, 256):\n'
+        f'    if {names[0]}[{split}] ^ {names[1]} == {names[0]}[{split + 1}]:\n'
+        f'        {_blankobf_builtin("exec")}({decompressed})\n'
+        '        break\n'
+    )
+
+
+def _blankobf_compile_layer(payload: bytes, rng: random.Random) -> str:
+    # The payload's base64 as fake IPv4 addresses
+    encoded = base64.b64encode(zlib.compress(payload))
+    addresses = ['.'.join(map(str, encoded[i:i + 4])) for i in range(0, len(encoded), 4)]
+    names = [_blankobf_name(rng) for _ in range(5)]
+    split = f'getattr({names[4]}, {_blankobf_str("split")})({_blankobf_str(".")})'
+    numbers = (
+        f'{_blankobf_builtin("list")}([{_blankobf_builtin("int")}({names[2]}) '
+        f'for {names[3]} in [{split} for {names[4]} in {names[0]}] for {names[2]} in {names[3]}])'
+    )
+    decoded = (
+        f'{_blankobf_attr("zlib", "decompress")}({_blankobf_attr("base64", "b64decode")}('
+        f'{_blankobf_builtin("bytes")}({names[1]})))'
+    )
+    return (
+        f'{names[0]} = {addresses}\n'
+        f'{names[1]} = {numbers}\n'
+        f'{_blankobf_builtin("exec")}({_blankobf_builtin("compile")}({decoded}, '
+        f'{_blankobf_str("<string>")}, {_blankobf_str("exec")}))\n'
+    )
+
+
+def generate_blankobf(payload: str, layers: int, rng: random.Random) -> str:
+    """
+    Cycles through BlankObf v2's three layer shapes, the outermost being the xor loop like in real samples
+    """
+    shapes = [_blankobf_xor_layer, _blankobf_exec_layer, _blankobf_compile_layer]
+    code = BLANKOBF_BANNER + payload
+    for layer in reversed(range(layers)):
+        code = shapes[layer % len(shapes)](code.encode(), rng)
+    return code
+
+
+def _hyperion_reversed(text: str) -> str:
+    return f'{text[::-1]!r}{HYPERION_REVERSE}'
+
+
+def _hyperion_second_layer(payload: str, layers: int, rng: random.Random) -> str:
+    names = iter(dict.fromkeys(_identifier(rng) for _ in range(64)))
+    globals_, getattr_, dir_, locals_, import_, vars_, exec_, compile_, unhexlify = (
+        next(names) for _ in range(9)
+    )
+
+    def builtin(module: str, name: str) -> str:
+        # Looks the name up through dir, like Hyperion, rather than naming it
+        module_expr = f'{import_}({_hyperion_reversed(module)})'
+        return (
+            f'{getattr_}({module_expr}, {dir_}({module_expr})'
+            f'[{dir_}({module_expr}).index({_hyperion_reversed(name)})])'
+        )
+
+    def decode(data: str) -> str:
+        return f"{unhexlify}(b'{data.encode().hex()}').decode({_hyperion_reversed('utf8')})"
+
+    lines = [
+        'try:',
+        '    if (',
+        '        __obfuscator__ != "Hyperion" or',
+        '        __authors__ != ("billythegoat356", "BlueRed") or',
+        '        __github__ != "https://github.com/billythegoat356/Hyperion"',
+        '    ):',
+        "        int('skid')",
+        'except:',
+        '    input("Roses are red\\nViolets are blue\\nYou are a skid\\nNobody likes you")',
+        "    __import__('sys').exit()",
+        f"locals()['{globals_}']=globals",
+        f'{globals_}()[{_hyperion_reversed(getattr_)}]=getattr',
+        f'{globals_}()[{_hyperion_reversed(dir_)}]=dir',
+        f"{globals_}()['{locals_}']=locals",
+        f"{locals_}()['{import_}']=__import__",
+        f"{globals_}()['{vars_}']={import_}('builtins').vars",
+        f"{vars_}()['{exec_}']={builtin('builtins', 'exec')}",
+        f"{locals_}()['{compile_}']={builtin('builtins', 'compile')}",
+        f"{globals_}()['{unhexlify}']={builtin('binascii', 'unhexlify')}",
+    ]
+    for stmt in ast.parse(payload).body:
+        source = ast.unparse(stmt)
+        if rng.random() < 0.5:
+            code = f'{exec_}({decode(source)})'
+        else:
+            code = (
+                f'{exec_}({compile_}({decode(source)}, filename={_hyperion_reversed(next(names, "f"))}, '
+                f'mode={_hyperion_reversed("exec")}))'
+            )
+        for _ in range(layers - 1):
+            # Nesting the literal itself would double its escapes every layer, so each layer is
+            # stored in a variable that the next one execs
+            name = _identifier(rng)
+            lines.append(f"{globals_}()['{name}']={code[::-1]!r}")
+            code = f'{exec_}({name}{HYPERION_REVERSE})'
+        lines.append(code)
+        if rng.random() < 0.3:
+            # Opaque predicates, as Hyperion scatters them through its output
+            lines.append(f'if {rng.randrange(10 ** 5, 10 ** 7)} > {rng.randrange(10 ** 5, 10 ** 7)}:')
+            lines.append(f'    {vars_}()')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_hyperion(payload: str, layers: int, rng: random.Random) -> str:
+    """
+    The first layer hides the zlib compressed second layer in bytes keywords, some of them frosted with
+    base64 and zlib again. In the second layer each payload statement is run through exec from hex,
+    and layers nests that exec in further reversed-string execs
+    """
+    second_layer = zlib.compress(_hyperion_second_layer(payload, layers, rng).encode())
+    cls = _identifier(rng, 'Il', 12)
+    calls = []
+    for start in range(0, len(second_layer), 1024):
+        chunk = second_layer[start:start + 1024]
+        if rng.random() < 0.25:
+            frosted = zlib.compress(base64.b64encode(chunk))
+            value = f"__import__('base64').b64decode(__import__('zlib').decompress({frosted!r}))"
+        else:
+            value = repr(chunk)
+        calls.append(f"        {cls}._modulo(Absolute='{_identifier(rng)}', DetectVar={value})")
+        calls.append(
+            f'        if {rng.randrange(10 ** 5, 10 ** 7)} > {rng.randrange(10 ** 5, 10 ** 7)}:\n'
+            f'            {cls}(_positive={rng.randrange(-99999, 99999)}).Run(Power={rng.randrange(1, 99999)})'
+        )
+    body = '\n'.join(calls)
+    return (
+        'from builtins import *\n'
+        'from math import prod as Square\n\n\n'
+        "__obfuscator__ = 'Hyperion'\n"
+        "__authors__ = ('billythegoat356', 'BlueRed')\n"
+        "__github__ = 'https://github.com/billythegoat356/Hyperion'\n"
+        "__discord__ = 'https://discord.gg/plague'\n"
+        "__license__ = 'EPL-2.0'\n\n"
+        '__code__ = \'print("Hello world!")\'\n\n\n'
+        f'class {cls}:\n'
+        '    def __init__(self, _positive):\n'
+        f'        self.Add = Square((_positive, {rng.randrange(-99999, 0)}))\n\n'
+        '    def Run(self, Power = str):\n'
+        f'        {HYPERION_COMMENT}\n'
+        f'        self.Add *= {rng.randrange(-99999, 0)} / Power\n\n'
+        '    def _modulo(Absolute = None, DetectVar = float, Ceil = globals):\n'
+        f'        {HYPERION_COMMENT}\n'
+        '        Ceil()[Absolute] = DetectVar\n\n'
+        "if __name__ == '__main__':\n"
+        '    try:\n'
+        f'{body}\n'
+        '    except Exception as _floor:\n'
+        f'        if {rng.randrange(10 ** 5, 10 ** 7)} > {rng.randrange(10 ** 5, 10 ** 7)}:\n'
+        '            print(_floor)\n'
+    )
+
+
+GENERATORS: dict[str, Callable[..., str]] = {
+    'blankobf': generate_blankobf,
+    'fct': generate_fct,
+    'hyperion': generate_hyperion,
+    'lzmaspam': generate_lzmaspam,
+    'pyobfuscate': generate_pyobfuscate,
+    'vare': generate_vare,
+}
+
+
+def generate(schema: str, size: int, layers: int = 1, depth: int = 1, seed: int = 0, **options: object) -> str:
+    """
+    Builds an obfuscated sample
+    :param schema: One of GENERATORS
+    :param size: Approximate size of the payload in bytes, before obfuscation
+    :param layers: Times the obfuscation is applied, see the generator of the schema
+    :param depth: Nesting depth of the blocks in the payload
+    :param options: Extra parameters of the schema's generator, e.g. variant for pyobfuscate
+    :raises ValueError: For unknown schemas, or parameters the schema cannot express
+    """
+    if schema not in GENERATORS:
+        raise ValueError(f'No generator for {schema}, choose from {", ".join(GENERATORS)}')
+    if layers < 1:
+        raise ValueError('layers must be at least 1')
+    if layers != 1 and schema in SINGLE_LAYER:
+        raise ValueError(f'{schema} only has a single layer')
+    rng = random.Random(seed)
+    return GENERATORS[schema](make_payload(size, depth, rng), layers, rng, **options)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='Vipyr Deobfuscator Sample Generator',
+        description='Generates synthetic obfuscated samples for benchmarks and stress tests',
+    )
+    parser.add_argument('schema', choices=GENERATORS)
+    parser.add_argument('-s', '--size', type=int, default=1024, help='payload size in bytes (defaults to 1024)')
+    parser.add_argument('-l', '--layers', type=int, default=1, help='obfuscation layers (defaults to 1)')
+    parser.add_argument('-d', '--depth', type=int, default=1, help='nesting depth of the payload (defaults to 1)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random parts (defaults to 0)')
+    parser.add_argument(
+        '--variant',
+        type=int,
+        choices=(1, 2),
+        help='pyobfuscate variant (defaults to 1)',
+    )
+    parser.add_argument('-o', '--output', help='file to write the sample to (defaults to stdout)')
+    return parser
+
+
+def run():
+    args = get_parser().parse_args()
+    options = {} if args.variant is None else {'variant': args.variant}
+    try:
+        sample = generate(args.schema, args.size, args.layers, args.depth, args.seed, **options)
+    except (TypeError, ValueError) as exc:
+        sys.exit(str(exc))
+    if args.output is None:
+        sys.stdout.write(sample)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(sample)
+
+
+if __name__ == '__main__':
+    run()
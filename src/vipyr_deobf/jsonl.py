@@ -0,0 +1,96 @@
+"""
+JSON Lines mode: reads sample records from a stream and writes one JSON result per line
+as soon as each sample finishes, so results can be consumed while input is still arriving
+
+A record is a JSON object with one of
+    "path": path to a file readable by this process
+    "content": base64 encoded source code
+    "source": inline source code
+and optionally "id", which is echoed back, and "skip_scan"
+A result is DeobfResult as compact JSON, plus "id" if one was given
+
+Only a bounded window of records is in flight at once, and reading stops while the window
+is full, so memory stays flat however long the input stream is
+"""
+
+import json
+import logging
+import os
+import queue
+import time
+from collections.abc import Iterable
+from typing import Any, TextIO
+
+from vipyr_deobf.batch import (
+    BatchStats,
+    SamplePool,
+    load_worker_deobfs,
+    parse_request,
+)
+from vipyr_deobf.cache import ResultCache
+from vipyr_deobf.deobf_base import DEOBFS
+from vipyr_deobf.result import DeobfResult
+from vipyr_deobf.supervise import Limits
+
+logger = logging.getLogger('deobf')
+
+
+def run_jsonl(
+    records: Iterable[str],
+    out: TextIO,
+    types: str = 'auto',
+    jobs: int | None = None,
+    skip_scan: bool = False,
+    timeout: float = 0,
+    cache: ResultCache | None = None,
+    max_pending: int | None = None,
+    limits: Limits | None = None,
+) -> BatchStats:
+    """
+    Deobfuscates every record over a process pool, writing results to out in completion order
+    Malformed records produce an error result instead of stopping the stream
+    :param max_pending: Records in flight at once (defaults to 2 per worker)
+    :param timeout: Per-sample time limit in seconds, 0 to disable
+    :param limits: If given, each sample runs in its own forked child under these limits
+    """
+    if not DEOBFS:
+        load_worker_deobfs(types)
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = max_pending or 2 * jobs
+    finished: queue.SimpleQueue[tuple[Any, DeobfResult]] = queue.SimpleQueue()
+    stats = BatchStats()
+    start = time.perf_counter()
+
+    def emit(record_id: Any, result: DeobfResult) -> None:
+        stats.add(result)
+        out.write((result.to_json() if record_id is None else result.to_json(id=record_id)) + '\n')
+        out.flush()
+
+    def on_done(record_id: Any, label: str) -> Any:
+        return lambda future: finished.put((record_id, SamplePool.result(future, label)))
+
+    pending = 0
+    with SamplePool(types, jobs, limits) as pool:
+        for line_no, line in enumerate(records, 1):
+            if not line.strip():
+                continue
+            record_id = None
+            try:
+                request = json.loads(line)
+                if isinstance(request, dict):
+                    record_id = request.get('id')
+                label, source = parse_request(request)
+            except ValueError as exc:
+                emit(record_id, DeobfResult(f'<line {line_no}>', 'error', error=f'Bad record: {exc}'))
+                continue
+            while pending >= max_pending:
+                emit(*finished.get())
+                pending -= 1
+            future = pool.submit(label, skip_scan or bool(request.get('skip_scan')), timeout, source, cache)
+            future.add_done_callback(on_done(record_id, label))
+            pending += 1
+        while pending:
+            emit(*finished.get())
+            pending -= 1
+    stats.elapsed = time.perf_counter() - start
+    return stats
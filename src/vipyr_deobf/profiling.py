@@ -0,0 +1,130 @@
+"""
+Profiling mode: times every phase of a single-sample run down to the layers each schema peels,
+and optionally collects cProfile statistics and the tracemalloc peak of the same run, so a slow
+sample can be diagnosed from one command instead of wrapping the CLI by hand
+"""
+
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TextIO
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+
+@dataclass(slots=True)
+class Phase:
+    name: str
+    depth: int
+    seconds: float = 0.0
+
+
+class RunProfile:
+    """
+    Records the phases of a run as a tree, indented by depth
+    Without hotspots, dump or memory this only reads the clock, so it can be kept on unconditionally
+    :param hotspots: Number of functions to list by own time in the report, 0 to skip cProfile
+    :param dump: Path to write the cProfile statistics to, for pstats or snakeviz
+    :param memory: Whether to trace allocations, which slows the run down several times
+    """
+
+    def __init__(self, hotspots: int = 0, dump: Path | str | None = None, memory: bool = False):
+        self.hotspots = hotspots
+        self.dump = dump
+        self.memory = memory
+        self.phases: list[Phase] = []
+        self.depth = 0
+        self.total = 0.0
+        self.layers = 0
+        self.layer_mark = 0.0
+        self.peak_memory: int | None = None
+        self.profiler: cProfile.Profile | None = None
+        self.snapshot: tracemalloc.Snapshot | None = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        """
+        Times the block as a phase, phases and layers recorded inside it are nested under it
+        """
+        phase = Phase(name, self.depth)
+        self.phases.append(phase)
+        self.depth += 1
+        self.layers = 0
+        start = self.layer_mark = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.seconds = time.perf_counter() - start
+            self.depth -= 1
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Adds a phase timed elsewhere, at the current depth
+        """
+        self.phases.append(Phase(name, self.depth, seconds))
+
+    def observe_layer(self, _layer: Any) -> None:
+        """
+        Layer observer, see deobf_utils.observe_layers
+        Times each layer from the previous one, or from the start of the enclosing phase
+        """
+        now = time.perf_counter()
+        self.layers += 1
+        self.record(f'layer {self.layers}', now - self.layer_mark)
+        self.layer_mark = now
+
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        """
+        Wraps the whole run, collecting cProfile statistics and allocations if enabled
+        """
+        if self.memory:
+            import tracemalloc
+
+            tracemalloc.start()
+        if self.hotspots or self.dump is not None:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.total = time.perf_counter() - start
+            if self.profiler is not None:
+                self.profiler.disable()
+            # Before dumping statistics, which allocates far more than a small sample does
+            if self.memory:
+                self.peak_memory = tracemalloc.get_traced_memory()[1]
+                self.snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            if self.profiler is not None and self.dump is not None:
+                self.profiler.dump_stats(self.dump)
+
+    def report(self, file: TextIO) -> None:
+        total = self.total or sum(phase.seconds for phase in self.phases if phase.depth == 0) or float('nan')
+        width = max((2 * phase.depth + len(phase.name) for phase in self.phases), default=0) + 2
+        print(f'Profile: {total:.3f}s total', file=file)
+        for phase in self.phases:
+            name = '  ' * phase.depth + phase.name
+            print(f'  {name:<{width}} {phase.seconds:>10.6f}s {phase.seconds / total:>7.1%}', file=file)
+        if self.profiler is not None:
+            print('Timings include cProfile overhead', file=file)
+            if self.dump is not None:
+                print(f'Statistics written to {self.dump}', file=file)
+        if self.peak_memory is not None:
+            print(f'Peak traced memory: {self.peak_memory / 1e6:.2f} MB', file=file)
+        if self.hotspots and self.profiler is not None:
+            import pstats
+
+            print(f'Top {self.hotspots} functions by own time:', file=file)
+            pstats.Stats(self.profiler, stream=file).sort_stats('tottime').print_stats(self.hotspots)
+        if self.hotspots and self.snapshot is not None:
+            print(f'Top {self.hotspots} allocation sites still live at the end of the run:', file=file)
+            for stat in self.snapshot.statistics('lineno')[:self.hotspots]:
+                print(f'  {stat}', file=file)
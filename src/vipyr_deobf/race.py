@@ -0,0 +1,123 @@
+"""
+Race mode: runs every candidate deobfuscator of a sample at once, each in its own forked process
+Outcomes are still handed back in candidate order, so the result is always the one serial mode
+would produce: a success only wins once every candidate before it has failed, and candidates
+after a success are killed as soon as it arrives, since they can no longer win
+"""
+
+import logging
+import os
+import pickle
+import select
+import time
+from collections.abc import Iterator, Sequence
+from functools import partial
+from typing import Any
+
+from vipyr_deobf.deobf_base import Deobfuscator, ScanContext
+from vipyr_deobf.deobf_utils import (
+    LayerEntries,
+    merge_layer_entries,
+    record_layer_entries,
+)
+from vipyr_deobf.exceptions import SampleTimeoutError, WorkerDiedError
+from vipyr_deobf.supervise import (
+    KILL_GRACE,
+    NO_LIMITS,
+    IsolatedCall,
+    Limits,
+    start_isolated,
+    time_limit,
+)
+
+logger = logging.getLogger('deobf')
+
+Outcome = tuple[str | None, BaseException | None]
+
+
+def attempt(deobf: Deobfuscator[Any], ctx: ScanContext, timeout: float = 0) -> Outcome:
+    """
+    Runs one candidate under timeout, 0 to disable
+    :return: The formatted output, or the exception it raised, including running out of its time budget
+    """
+    try:
+        with time_limit(timeout):
+            return deobf.format_results(deobf.deobf(ctx)), None
+    # Schemas run on hostile input, where any exception can surface, and each one is an outcome
+    # the race has to hand back in order rather than a crash of the child
+    except (Exception, SampleTimeoutError) as exc:  # noqa: BLE001
+        try:
+            pickle.dumps(exc)
+        # Exceptions can carry arbitrary state of the sample, and pickling them may fail in any way
+        except Exception:  # noqa: BLE001
+            exc = RuntimeError(f'{type(exc).__name__}: {exc}')
+        return None, exc
+
+
+def race_deobfs(
+    deobfs: Sequence[Deobfuscator[Any]],
+    ctx: ScanContext,
+    limits: Limits | None = None,
+    timeout: float = 0,
+) -> Iterator[tuple[Deobfuscator[Any], str | None, BaseException | None]]:
+    """
+    Races the candidates, yielding each one's output or exception in candidate order
+    Stops after the first success, use it with contextlib.closing so an early exit kills the rest
+    Falls back to trying the candidates one by one if there is nothing to race or fork is unavailable
+    :param timeout: Time limit of each candidate in seconds, 0 to disable. One that overruns it is reported
+        as a SampleTimeoutError, and killed KILL_GRACE seconds past it if it cannot report
+    """
+    if len(deobfs) < 2 or not hasattr(os, 'fork'):
+        for deobf in deobfs:
+            output, exc = attempt(deobf, ctx, timeout)
+            yield deobf, output, exc
+            if exc is None:
+                return
+        return
+
+    if not all(deobf.takes_bytes for deobf in deobfs):
+        # Decode before forking, so the children share the text instead of each decoding it
+        ctx.decode()
+    logger.info(f'Racing schemas {", ".join(f"{deobf.name}v{deobf.version}" for deobf in deobfs)}')
+    calls: list[IsolatedCall[tuple[Outcome, list[LayerEntries]]]] = [
+        start_isolated(partial(record_layer_entries, partial(attempt, deobf, ctx, timeout)), limits or NO_LIMITS)
+        for deobf in deobfs
+    ]
+    # The candidates all started together, so they share a deadline
+    deadline = time.monotonic() + timeout + KILL_GRACE if timeout > 0 else None
+    outcomes: dict[int, Outcome] = {}
+    running = set(range(len(calls)))
+    try:
+        for idx, deobf in enumerate(deobfs):
+            while idx not in outcomes:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                ready = select.select([calls[i] for i in running], [], [], remaining)[0]
+                if not ready:
+                    for overran in running:
+                        calls[overran].kill()
+                        outcomes[overran] = None, SampleTimeoutError(
+                            f'Killed after exceeding time limit of {timeout}s'
+                        )
+                    running.clear()
+                for call in ready:
+                    # Skip calls killed by a success earlier in this batch
+                    if call.done or not call.read():
+                        continue
+                    finished = calls.index(call)
+                    running.discard(finished)
+                    try:
+                        outcomes[finished], layer_entries = call.result()
+                        merge_layer_entries(layer_entries)
+                    except WorkerDiedError as exc:
+                        outcomes[finished] = None, exc
+                    if outcomes[finished][1] is None:
+                        for later in [i for i in running if i > finished]:
+                            calls[later].kill()
+                            running.discard(later)
+            output, exc = outcomes[idx]
+            yield deobf, output, exc
+            if exc is None:
+                return
+    finally:
+        for call in calls:
+            call.kill()
@@ -0,0 +1,64 @@
+"""
+The result of deobfuscating one sample, shared by every mode that reports on samples
+"""
+
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from vipyr_deobf.deobf_utils import WEBHOOK_REGEX
+
+
+def extract_iocs(output: str) -> dict[str, list[str]]:
+    """
+    :return: IOC kind -> every distinct IOC of that kind in output, in order of appearance
+    """
+    return {'webhooks': [*dict.fromkeys(WEBHOOK_REGEX.findall(output))]}
+
+
+@dataclass(slots=True)
+class DeobfResult:
+    """
+    :param status: success, fail (no schema matched or every schema failed), timeout, oom or error
+    :param schema: Name of the schema that produced the output, which may be partial unless status is success
+    :param layers: Layers the schema peeled, as reported through deobf_utils.report_layer
+    :param timings: Seconds spent reading, scanning, deobfuscating and formatting
+    :param layer_timings: Seconds spent peeling each layer, in order
+    """
+    path: str
+    status: str
+    schema: str | None = None
+    version: int | None = None
+    size: int = 0
+    elapsed: float = 0.0
+    layers: int = 0
+    output: str | None = None
+    iocs: dict[str, list[str]] = field(default_factory=dict)
+    error: str | None = None
+    cached: bool = False
+    timings: dict[str, float] = field(default_factory=dict)
+    layer_timings: list[float] = field(default_factory=list)
+
+    @property
+    def success(self) -> bool:
+        return self.status == 'success'
+
+    @property
+    def label(self) -> str | None:
+        if self.schema is None:
+            return None
+        return f'{self.schema}v{self.version}'
+
+    def to_dict(self) -> dict[str, Any]:
+        return {'success': self.success, **asdict(self)}
+
+    def to_json(self, **extra: Any) -> str:
+        """
+        Compact single-line JSON, with durations rounded to the microsecond
+        :param extra: Fields to put ahead of the result's own, e.g. a request id
+        """
+        data = {**extra, **self.to_dict()}
+        data['elapsed'] = round(self.elapsed, 6)
+        data['timings'] = {phase: round(duration, 6) for phase, duration in self.timings.items()}
+        data['layer_timings'] = [round(duration, 6) for duration in self.layer_timings]
+        return json.dumps(data, separators=(',', ':'))
@@ -0,0 +1,314 @@
+"""
+Long-running deobfuscation server
+Keeps the deobfuscators loaded in a warm pool of worker processes and accepts requests
+over a Unix domain socket (one JSON object per line) or localhost HTTP (POST /deobf)
+
+A request is a JSON object with one of
+    "source": inline source code
+    "content": base64 encoded source code
+    "path": path to a file readable by the server
+and optionally "id", which is echoed back, and "skip_scan"
+The response is DeobfResult as a JSON object, plus "id" if one was given
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import FrameType
+from typing import Any
+
+from vipyr_deobf.batch import (
+    deobf_sample,
+    load_worker_deobfs,
+    parse_request,
+    supervised_sample,
+)
+from vipyr_deobf.deobf_base import DEOBFS
+from vipyr_deobf.exceptions import ServerBusyError
+from vipyr_deobf.supervise import Limits
+from vipyr_deobf.utils import add_limit_arguments, get_limits, setup_logging
+
+logger = logging.getLogger('deobf')
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+
+def init_worker(types: str, log_args: argparse.Namespace | None) -> None:
+    if log_args is not None:
+        setup_logging(log_args)
+    load_worker_deobfs(types)
+
+
+class DeobfService:
+    """
+    Runs deobfuscation requests on a pool of worker processes
+    At most max_pending requests are queued or running at once; past that, requests are
+    rejected with ServerBusyError instead of piling up behind a slow sample
+    With limits, each request runs in its own forked child under them, so a hostile
+    sample cannot exhaust a pooled worker
+    """
+
+    def __init__(
+        self,
+        types: str = 'auto',
+        jobs: int | None = None,
+        max_pending: int | None = None,
+        timeout: float = 60,
+        log_args: argparse.Namespace | None = None,
+        limits: Limits | None = None,
+    ):
+        if not DEOBFS:
+            load_worker_deobfs(types)
+        self.types = types
+        self.log_args = log_args
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.jobs
+        self.timeout = timeout
+        self.limits = limits
+        self.executor = self.new_executor()
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+
+    def new_executor(self) -> ProcessPoolExecutor:
+        # Requests arrive on handler threads, and forking a threaded process is unsafe,
+        # so workers come from a forkserver and load the deobfuscators once on startup
+        start_methods = multiprocessing.get_all_start_methods()
+        return ProcessPoolExecutor(
+            self.jobs,
+            mp_context=multiprocessing.get_context(
+                'forkserver' if 'forkserver' in start_methods else 'spawn'
+            ),
+            initializer=init_worker,
+            initargs=(self.types, self.log_args),
+        )
+
+    def handle(self, request: Any) -> dict[str, Any]:
+        """
+        Runs one request to completion
+        :raises ValueError: If the request is malformed
+        :raises ServerBusyError: If the request queue is full
+        """
+        label, source = parse_request(request)
+        request_id = request.get('id')
+        args = (label, bool(request.get('skip_scan', False)), self.timeout, source)
+
+        if not self.slots.acquire(blocking=False):
+            raise ServerBusyError()
+        with self.lock:
+            self.pending += 1
+        executor = self.executor
+        try:
+            if self.limits is None:
+                future = executor.submit(deobf_sample, *args)
+            else:
+                future = executor.submit(supervised_sample, *args, limits=self.limits)
+            result = future.result()
+        except BrokenProcessPool:
+            logger.exception('A worker died, restarting the pool')
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = self.new_executor()
+            return {'id': request_id, 'status': 'error', 'error': 'Worker process died'}
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.served += 1
+            self.slots.release()
+        response = result.to_dict()
+        if request_id is not None:
+            response['id'] = request_id
+        return response
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                'jobs': self.jobs,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'served': self.served,
+                'schemas': sorted(
+                    f'{name}v{version}' for name, versions in DEOBFS.items() for version in versions
+                ),
+            }
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+
+def handle_line(service: DeobfService, line: bytes) -> dict[str, Any]:
+    try:
+        return service.handle(json.loads(line))
+    except ServerBusyError:
+        return {'status': 'busy', 'error': 'Request queue is full, retry later'}
+    except ValueError as exc:
+        return {'status': 'error', 'error': f'Bad request: {exc}'}
+
+
+class UnixRequestHandler(socketserver.StreamRequestHandler):
+    server: 'DeobfUnixServer'
+
+    def handle(self):
+        while line := self.rfile.readline(MAX_REQUEST_SIZE):
+            if len(line) == MAX_REQUEST_SIZE and not line.endswith(b'\n'):
+                # Skip the rest of the line rather than reading it as a request of its own
+                while (rest := self.rfile.readline(MAX_REQUEST_SIZE)) and not rest.endswith(b'\n'):
+                    pass
+                self.respond({'status': 'error', 'error': 'Request too large'})
+                continue
+            if not line.strip():
+                continue
+            self.respond(handle_line(self.server.service, line))
+
+    def respond(self, response: dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+        self.wfile.flush()
+
+
+class DeobfUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: DeobfService):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.service = service
+        super().__init__(path, UnixRequestHandler)
+
+
+class HTTPRequestHandler(BaseHTTPRequestHandler):
+    server: 'DeobfHTTPServer'
+
+    def send_json(self, status: HTTPStatus, body: dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f'Unknown endpoint {self.path}'})
+            return
+        self.send_json(HTTPStatus.OK, self.server.service.stats())
+
+    def do_POST(self):
+        if self.path != '/deobf':
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f'Unknown endpoint {self.path}'})
+            return
+        header = self.headers.get('Content-Length')
+        if header is None:
+            self.send_json(HTTPStatus.LENGTH_REQUIRED, {'error': 'Content-Length required'})
+            return
+        try:
+            length = int(header)
+            if length < 0:
+                raise ValueError(f'invalid Content-Length {header!r}')
+            if length > MAX_REQUEST_SIZE:
+                self.send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': 'Request too large'})
+                return
+            response = self.server.service.handle(json.loads(self.rfile.read(length)))
+        except ServerBusyError:
+            self.send_json(
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                {'status': 'busy', 'error': 'Request queue is full, retry later'},
+            )
+        except ValueError as exc:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'status': 'error', 'error': f'Bad request: {exc}'})
+        else:
+            self.send_json(HTTPStatus.OK, response)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(format % args)
+
+
+class DeobfHTTPServer(ThreadingHTTPServer):
+    def __init__(self, address: tuple[str, int], service: DeobfService):
+        self.service = service
+        super().__init__(address, HTTPRequestHandler)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='Vipyr Deobfuscator Server',
+        description='Serves deobfuscation requests from a warm pool of worker processes',
+    )
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument('-u', '--unix', help='path of the Unix domain socket to listen on')
+    listen.add_argument(
+        '-p', '--port', type=int, default=8080, help='localhost HTTP port to listen on (defaults to 8080)'
+    )
+    parser.add_argument(
+        '--host', default='127.0.0.1', help='HTTP address to bind to (defaults to 127.0.0.1)'
+    )
+    parser.add_argument(
+        '-t',
+        '--type',
+        default='auto',
+        type=str,
+        help='types of obfuscation to load, see vipyr-deobf --help for options (defaults to all)',
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, help='number of worker processes (defaults to cpu count)'
+    )
+    parser.add_argument(
+        '--max-pending',
+        type=int,
+        help='requests queued or running at once before new ones are rejected (defaults to 4 per worker)',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=60,
+        help='per-request time limit in seconds, 0 to disable (defaults to 60)',
+    )
+    add_limit_arguments(parser)
+    parser.add_argument('-d', '--debug', action='store_true', help='display debug logs')
+    parser.add_argument(
+        '--show-expected', action='store_true', help='display expected warnings'
+    )
+    return parser
+
+
+def _terminate(_signum: int, _frame: FrameType | None) -> None:
+    raise KeyboardInterrupt()
+
+
+def run():
+    args = get_parser().parse_args()
+    setup_logging(args)
+
+    service = DeobfService(
+        args.type, args.jobs, args.max_pending, args.timeout, args, get_limits(args)
+    )
+    server: socketserver.BaseServer
+    if args.unix is not None:
+        server = DeobfUnixServer(args.unix, service)
+        logger.info(f'Listening on unix socket {args.unix}')
+    else:
+        server = DeobfHTTPServer((args.host, args.port), service)
+        logger.info(f'Listening on http://{args.host}:{args.port}')
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Shutting down')
+    finally:
+        server.server_close()
+        service.close()
+        if args.unix is not None and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+
+if __name__ == '__main__':
+    run()
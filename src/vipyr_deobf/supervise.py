@@ -0,0 +1,208 @@
+"""
+Supervised execution: runs a call in a forked child under wall-clock, CPU and memory limits
+The child enforces the limits on itself, so a violation surfaces as an exception inside the
+call and whatever it has produced so far can still be reported. The parent only steps in
+if the child overruns its deadline regardless, or dies outright, e.g. on a C stack overflow
+"""
+
+import logging
+import math
+import os
+import pickle
+import select
+import signal
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import BinaryIO, Generic, TypeVar
+
+from vipyr_deobf.exceptions import SampleTimeoutError, WorkerDiedError
+
+R = TypeVar('R')
+
+logger = logging.getLogger('deobf')
+
+# Time the child gets past its own deadline to report, before it is killed
+KILL_GRACE = 2.0
+
+
+@dataclass(slots=True, frozen=True)
+class Limits:
+    """
+    Per-call budgets, 0 disables a limit
+    :param cpu: CPU seconds, rounded up to whole seconds
+    :param memory: Bytes of address space the call may map on top of what the worker already has,
+        which bounds its RSS. Overruns raise MemoryError inside the call
+    """
+    cpu: float = 0
+    memory: int = 0
+
+
+NO_LIMITS = Limits()
+
+
+def _raise_cpu_timeout(_signum: int, _frame: FrameType | None) -> None:
+    # SIGXCPU repeats every second until the hard limit, give the call that second to report
+    signal.signal(signal.SIGXCPU, signal.SIG_IGN)
+    raise SampleTimeoutError('Exceeded CPU time limit')
+
+
+def _raise_timeout(_signum: int, _frame: FrameType | None) -> None:
+    raise SampleTimeoutError
+
+
+@contextmanager
+def time_limit(timeout: float) -> Iterator[None]:
+    """
+    Raises SampleTimeoutError in the block once timeout seconds have passed, 0 disables it
+    This is a SIGALRM, so it only works in the main thread, and only between bytecodes
+    """
+    if timeout <= 0 or not hasattr(signal, 'setitimer'):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def address_space_size() -> int | None:
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def apply_limits(limits: Limits) -> None:
+    """
+    Limits the rest of the current process' life, only call this in a process that will exit afterwards
+    """
+    import resource
+
+    if limits.cpu:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime + limits.cpu)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        # SIGXCPU at the soft limit lets the call report, SIGKILL at the hard limit if it can't
+        if hard == resource.RLIM_INFINITY or hard > soft + 1:
+            hard = soft + 1
+        signal.signal(signal.SIGXCPU, _raise_cpu_timeout)
+        resource.setrlimit(resource.RLIMIT_CPU, (min(soft, hard), hard))
+    if limits.memory:
+        current = address_space_size()
+        if current is None:
+            logger.warning('Cannot measure address space on this platform, memory limit disabled')
+            return
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        soft = current + limits.memory
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+@dataclass(slots=True)
+class IsolatedCall(Generic[R]):
+    """
+    A call running in a forked child, see start_isolated
+    Its pipe can be passed to select, call read whenever it is readable
+    """
+    pid: int
+    pipe: BinaryIO
+    chunks: list[bytes] = field(default_factory=list)
+    done: bool = False
+    exit_code: int | None = None
+
+    def fileno(self) -> int:
+        return self.pipe.fileno()
+
+    def read(self) -> bool:
+        """
+        Reads what the child has sent so far
+        :return: Whether the child has finished sending
+        """
+        chunk = self.pipe.read(1 << 20)
+        if chunk:
+            self.chunks.append(chunk)
+        else:
+            self.done = True
+        return self.done
+
+    def kill(self) -> None:
+        """
+        Kills the child if it is still running, and reaps it
+        """
+        if not self.done:
+            os.kill(self.pid, signal.SIGKILL)
+            self.done = True
+        self.reap()
+
+    def reap(self) -> int:
+        if self.exit_code is None:
+            self.pipe.close()
+            _, wait_status = os.waitpid(self.pid, 0)
+            self.exit_code = os.waitstatus_to_exitcode(wait_status)
+        return self.exit_code
+
+    def result(self) -> R:
+        """
+        Reaps the child once done, and unpickles its result
+        :raises WorkerDiedError: If the child exited without a result
+        """
+        exit_code = self.reap()
+        if exit_code != 0 or not self.chunks:
+            reason = (
+                f'signal {signal.Signals(-exit_code).name}' if exit_code < 0 else f'exit code {exit_code}'
+            )
+            raise WorkerDiedError(f'Isolated worker died with {reason}')
+        return pickle.loads(b''.join(self.chunks))
+
+
+def start_isolated(func: Callable[[], R], limits: Limits = NO_LIMITS) -> IsolatedCall[R]:
+    """
+    Forks a child that runs func under limits and sends back its result, which must be picklable
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Never return into the caller's stack from the child
+        status = 1
+        try:
+            os.close(read_fd)
+            apply_limits(limits)
+            data = pickle.dumps(func())
+            with os.fdopen(write_fd, 'wb') as pipe:
+                pipe.write(data)
+            status = 0
+        except BaseException:
+            logger.exception('Isolated worker failed')
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    return IsolatedCall(pid, os.fdopen(read_fd, 'rb', buffering=0))
+
+
+def run_isolated(func: Callable[[], R], timeout: float = 0, limits: Limits = NO_LIMITS) -> R:
+    """
+    Runs func in a forked child under limits and returns its result, which must be picklable
+    func should enforce timeout itself, the child is killed KILL_GRACE seconds past it
+    :raises SampleTimeoutError: If the child had to be killed
+    :raises WorkerDiedError: If the child exited without a result
+    """
+    call = start_isolated(func, limits)
+    deadline = time.monotonic() + timeout + KILL_GRACE if timeout > 0 else None
+    try:
+        while not call.done:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None and remaining <= 0) or not select.select([call], [], [], remaining)[0]:
+                call.kill()
+                raise SampleTimeoutError(f'Killed after exceeding time limit of {timeout}s')
+            call.read()
+    finally:
+        call.kill()
+    return call.result()
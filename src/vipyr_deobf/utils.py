@@ -1,6 +1,10 @@
 import argparse
 import logging
 import logging.config
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from vipyr_deobf.supervise import Limits
 
 
 class Color:
@@ -22,7 +26,10 @@ class NoSoftWarning(logging.Filter):
         return not record.msg.endswith('(Expected)')
 
 
-def setup_logging(args: argparse.Namespace | None = None):
+def setup_logging(args: argparse.Namespace | None = None, stream: str = 'ext://sys.stdout'):
+    """
+    :param stream: Where log records go, e.g. ext://sys.stderr when stdout carries results
+    """
     show_expected = True if args is None else args.show_expected
     debug = False if args is None else args.show_expected
     logging_config = {
@@ -39,7 +46,7 @@ def setup_logging(args: argparse.Namespace | None = None):
             'stdout': {
                 'class': 'logging.StreamHandler',
                 'formatter': 'default',
-                'stream': 'ext://sys.stdout',
+                'stream': stream,
                 'filters': [] if show_expected else ['no_soft_warning']
             }
         },
@@ -54,3 +61,37 @@ def setup_logging(args: argparse.Namespace | None = None):
         }
     }
     logging.config.dictConfig(logging_config)
+
+
+def add_limit_arguments(parser: argparse.ArgumentParser, applies_to: str = ''):
+    """
+    :param applies_to: Which of the parser's modes honor the limits, appended to their help
+    """
+    suffix = f', {applies_to}' if applies_to else ''
+    parser.add_argument(
+        '--isolate',
+        action='store_true',
+        help=f'run each sample in its own forked process{suffix}, implied by --cpu-limit and --memory-limit',
+    )
+    parser.add_argument(
+        '--cpu-limit',
+        type=float,
+        default=0,
+        metavar='SECONDS',
+        help=f'per-sample CPU time limit, rounded up to whole seconds{suffix} (defaults to none)',
+    )
+    parser.add_argument(
+        '--memory-limit',
+        type=int,
+        default=0,
+        metavar='MB',
+        help=f'per-sample memory limit{suffix} (defaults to none)',
+    )
+
+
+def get_limits(args: argparse.Namespace) -> 'Limits | None':
+    if not (args.isolate or args.cpu_limit or args.memory_limit):
+        return None
+    from vipyr_deobf.supervise import Limits
+
+    return Limits(args.cpu_limit, args.memory_limit * 1024 * 1024)
@@ -13,3 +13,17 @@ def test_deobf_hello_world():
     with open('tests/blankobf/v2/sample_array.exp', 'r') as file:
         exp = file.read()
     assert ast.dump(res) == ast.dump(ast.parse(f'"{BLANK_OBF_HEADER}"\n{exp}'))
+
+
+def test_deobf_repeat_uses_layer_cache():
+    from vipyr_deobf.deobfuscators.BlankObf import blankobf_v2
+    from vipyr_deobf.generate import generate
+
+    # Generated rather than the bundled sample, whose names only parse from Python 3.12 on
+    obf = generate('blankobf', 2000, layers=3, seed=1)
+    blankobf_v2.layer_cache.clear()
+    _, first = blankobf_v2_deobf.deobf(obf)
+    assert blankobf_v2.layer_cache.entries
+    status, second = blankobf_v2_deobf.deobf(obf)
+    assert status
+    assert ast.dump(second) == ast.dump(first)
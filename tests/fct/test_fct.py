@@ -10,3 +10,32 @@ def test_deobf_hello_world():
     with open('tests/fct/sample_hello_world.exp', 'r') as file:
         exp = file.read()
     assert ast.dump(ast.parse(res)) == ast.dump(ast.parse(exp))
+
+
+def test_deobf_reuses_peeled_layers(monkeypatch):
+    from vipyr_deobf.deobfuscators.FCT import fct
+
+    with open('tests/fct/sample_hello_world.obf', 'r') as file:
+        obf = file.read()
+    fct.layer_cache.clear()
+    first = fct_deobf.deobf(obf)
+
+    def fail(_obf_bytes):
+        raise AssertionError('Layer was peeled again')
+
+    monkeypatch.setattr(fct, 'deobf_obf', fail)
+    assert fct_deobf.deobf(obf) == first
+
+
+def test_deobf_memory_mapped(monkeypatch):
+    from vipyr_deobf import deobf_base
+    from vipyr_deobf.deobf_base import ScanContext, open_sample
+
+    monkeypatch.setattr(deobf_base, 'MMAP_THRESHOLD', 0)
+    with open_sample('tests/fct/sample_hello_world.obf') as data:
+        ctx = ScanContext(data)
+        assert fct_deobf.scan(ctx)
+        res = fct_deobf.deobf(ctx).decode()
+    with open('tests/fct/sample_hello_world.exp', 'r') as file:
+        exp = file.read()
+    assert ast.dump(ast.parse(res)) == ast.dump(ast.parse(exp))
@@ -1,6 +1,24 @@
+import ast
+import base64
+import random
 import re
+import threading
+import zlib
 
-from vipyr_deobf.deobfuscators.Hyperion.hyperion import hyperion_deobf
+import pytest
+
+from vipyr_deobf.deobf_utils import active_tracers, tracing
+from vipyr_deobf.deobfuscators.Hyperion.hyperion import (
+    MockStrList,
+    SecondLayerTransformer,
+    deobf_first_layer,
+    deobf_second_layer,
+    full_hyperion_deobf,
+    hyperion_deobf,
+    mock_attr,
+)
+from vipyr_deobf.exceptions import DeobfuscationFailError
+from vipyr_deobf.generate import generate, make_webhook
 
 
 def test_deobf_hello_world():
@@ -9,3 +27,161 @@ def test_deobf_hello_world():
     code = hyperion_deobf.deobf(obf)
     assert re.search(r'np\.zeros\(10\s?\*\*\s?14\)', code)
     assert re.search(r'print\(\w+\)', code)
+
+
+def test_tracing_records_sampled_events_in_a_ring_buffer():
+    with open('tests/hyperion/sample_array.obf', 'r') as file:
+        obf = file.read()
+    with tracing() as tracer:
+        hyperion_deobf.deobf(obf)
+    ops = {event.op for event in tracer.events}
+    assert {'call', 'getattr', 'name'} <= ops
+    assert all(event.outcome in ('resolved', 'missing') for event in tracer.events)
+
+    with tracing(capacity=8, sample=3) as sampled:
+        hyperion_deobf.deobf(obf)
+    assert sampled.seen == tracer.seen
+    assert len(sampled.events) == 8
+    assert not active_tracers.get()
+
+
+def test_tracing_only_sees_its_own_thread():
+    with open('tests/hyperion/sample_array.obf', 'r') as file:
+        obf = file.read()
+    with tracing() as tracer:
+        thread = threading.Thread(target=hyperion_deobf.deobf, args=(obf,))
+        thread.start()
+        thread.join()
+    assert not tracer.events
+
+
+def test_deeply_nested_layers_do_not_exhaust_the_stack():
+    sample = generate('hyperion', 2000, layers=300, seed=1)
+    output = hyperion_deobf.format_results(hyperion_deobf.deobf(sample))
+    assert make_webhook(random.Random(1)) in output
+
+
+def test_mock_values_wrap_methods_only_when_looked_up():
+    join = mock_attr(', ', 'join')
+    assert join(['a', 'b']) == 'a, b'
+    assert mock_attr(True, '__neg__')() == -1
+    with pytest.raises(ValueError):
+        mock_attr(1.5, 'hex')
+
+    names = MockStrList(['exec', 'eval', 'exec'])
+    assert names.index('exec') == 0
+    assert names.index('eval') == 1
+    assert names[2] == 'exec'
+    with pytest.raises(ValueError):
+        names.index('compile')
+
+
+def test_repeated_payloads_are_parsed_once_and_copied():
+    slt = SecondLayerTransformer()
+    code = "__import__('builtins').getattr(str, 'join')"
+    first = slt.parse_payload(code, 'eval')
+    assert slt.payloads == {('eval', code): None}
+    second = slt.parse_payload(code, 'eval')
+    third = slt.parse_payload(code, 'eval')
+    assert ast.dump(first, include_attributes=True) == ast.dump(second, include_attributes=True)
+    second.body.args[1].value = 'decode'
+    assert third.body.args[1].value == 'join'
+    assert slt.payloads[('eval', code)].body.args[1].value == 'join'
+
+    slt.parse_payload('x' * 1000, 'eval')
+    assert len(slt.payloads) == 1
+
+
+def test_first_layer_is_decompressed_chunk_by_chunk():
+    compressed = zlib.compress('print("Hello world!")'.encode())
+    chunks = [compressed[:5], compressed[5:10], compressed[10:]]
+    frosted = zlib.compress(base64.b64encode(chunks[1]))
+    first_layer = (
+        f"_product._modulo(Absolute='a', DetectVar={chunks[0]!r})\n"
+        f"_product._modulo(Absolute='b', DetectVar=__import__('base64').b64decode("
+        f"__import__('zlib').decompress({frosted!r})))\n"
+        f"_product._modulo(Absolute='c', DetectVar={chunks[2]!r})\n"
+    )
+    assert deobf_first_layer(ast.parse(first_layer)) == 'print("Hello world!")'
+
+    truncated = first_layer.rsplit('\n', 2)[0]
+    with pytest.raises(DeobfuscationFailError):
+        deobf_first_layer(ast.parse(truncated))
+
+
+def test_too_deep_to_unparse_falls_back_to_second_layer():
+    second_layer = 'try:\n    pass\nexcept:\n    pass\nx = ' + '+'.join(['a'] * 2000)
+    compressed = zlib.compress(second_layer.encode())
+    first_layer = f"_product._modulo(Absolute='a', DetectVar={compressed!r})\n"
+    assert full_hyperion_deobf(first_layer) == second_layer
+
+
+def test_opaque_predicates_and_unused_classes_are_pruned():
+    second_layer = """
+try:
+    pass
+except:
+    pass
+class _theory:
+    def execute(code = str):
+        return code
+    @property
+    def _divide(self, Absolute = -66512 - 82658):
+        return (self, _theory._divide)
+class Kept:
+    pass
+if 365101 > 7435378:
+    _theory.execute(code = 1)
+elif 337143 > 2680668:
+    _theory(_modulo = -56047 * -45510)
+else:
+    print(Kept)
+while 3 < 2 < 1:
+    globals
+if input():
+    if 1 == 0:
+        pass
+"""
+    code = deobf_second_layer(ast.parse(second_layer))
+    assert code.split('\n') == ['class Kept:', '    pass', 'print(Kept)', 'if input():', '    pass']
+
+
+def test_pruning_keeps_the_code_valid():
+    junk_try = 'try:\n    pass\nexcept:\n    pass\n'
+    code = deobf_second_layer(ast.parse(junk_try + 'try:\n    print(1)\nfinally:\n    if 1 > 2:\n        print(2)\n'))
+    assert code == 'try:\n    print(1)\nfinally:\n    pass'
+
+    scopes = """
+def g():
+    if 1 > 2:
+        yield 1
+    return 5
+async def h():
+    while 1 > 2:
+        await g()
+def k():
+    if 1 < 2:
+        pass
+    else:
+        global y
+    y = 1
+if 1 > 2:
+    def inner():
+        yield 1
+x = 1
+def n():
+    if 1 > 2:
+        x = 2
+    return x
+if 1 > 2:
+    z = 3
+"""
+    code = deobf_second_layer(ast.parse(junk_try + scopes))
+    compile(code, '<pruned>', 'exec')
+    assert 'yield 1\n    return 5' in code
+    assert 'await g()' in code
+    assert 'global y' in code
+    assert 'def inner' not in code
+    # Assigned in dead code, x is still a local of n, so reading it raises rather than finding the global
+    assert 'x = 2' in code
+    assert 'z = 3' not in code
@@ -0,0 +1,21 @@
+import ast
+
+from vipyr_deobf.deobf_base import ScanContext, run_scanners
+from vipyr_deobf.deobfuscators.PyObfuscate.pyobfuscate import (
+    PayloadExtractor,
+    extract_payload,
+)
+
+
+def test_scan_stops_at_first_payload_and_extraction_keeps_the_last():
+    code = "obfuscate = {'first': 'a'}\nobfuscate = {'last': 'b'}\n"
+    assert extract_payload(ast.parse(code)) == ('obfuscate', ('last', 'b'))
+    scanner = PayloadExtractor()
+    assert run_scanners(ScanContext(code), [scanner]) == [True]
+    assert scanner.payload == ('first', 'a')
+
+
+def test_scan_rules_out_samples_without_the_variable_name():
+    ctx = ScanContext("x = {'first': 'a'}\n")
+    assert run_scanners(ctx, [PayloadExtractor()]) == [False]
+    assert ctx._tree is None
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+
+from vipyr_deobf.aio import AsyncDeobfService
+from vipyr_deobf.deobfuscators.FCT.fct import fct_deobf
+from vipyr_deobf.exceptions import ServerBusyError
+
+with open('tests/fct/sample_hello_world.obf', 'rb') as file:
+    SAMPLE = file.read()
+
+
+def test_deobfuscate_on_process_pool():
+    async def main():
+        async with AsyncDeobfService(jobs=1, timeout=30) as service:
+            return await asyncio.gather(*(service.deobfuscate(SAMPLE, label=str(i)) for i in range(3)))
+
+    results = asyncio.run(main())
+    assert [result.path for result in results] == ['0', '1', '2']
+    assert {(result.status, result.schema) for result in results} == {('success', 'fct')}
+
+
+def test_backpressure_and_cancellation(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_sample(path, *_):
+        started.set()
+        release.wait(10)
+        from vipyr_deobf.result import DeobfResult
+        return DeobfResult(path, 'success')
+
+    monkeypatch.setattr('vipyr_deobf.aio.deobf_sample', blocking_sample)
+
+    async def main():
+        async with AsyncDeobfService(jobs=1, max_waiting=1, executor='thread') as service:
+            running = asyncio.create_task(service.deobfuscate(SAMPLE, label='running'))
+            await asyncio.to_thread(started.wait, 10)
+            waiting = asyncio.create_task(service.deobfuscate(SAMPLE, label='waiting'))
+            await asyncio.sleep(0)
+            with pytest.raises(ServerBusyError):
+                await service.deobfuscate(SAMPLE)
+            waiting.cancel()
+            running.cancel()
+            release.set()
+            await asyncio.gather(running, waiting, return_exceptions=True)
+            # The slot comes back once the cancelled sample stops running
+            return await asyncio.wait_for(service.deobfuscate(SAMPLE, label='after'), 10)
+
+    assert asyncio.run(main()).path == 'after'
+
+
+def test_threads_count_only_their_own_layers():
+    from vipyr_deobf.deobfuscators.FCT import fct
+    from vipyr_deobf.generate import generate
+
+    samples = {layers: generate('fct', 20000, layers=layers, seed=layers) for layers in (1, 2, 3, 4)}
+
+    async def main():
+        async with AsyncDeobfService(jobs=4, timeout=30, executor='thread') as service:
+            return await asyncio.gather(*(
+                service.deobfuscate(sample, label=str(layers))
+                for _ in range(10) for layers, sample in samples.items()
+            ))
+
+    fct.layer_cache.clear()
+    expected = {str(layers): len(fct_deobf_layers(sample)) for layers, sample in samples.items()}
+    fct.layer_cache.clear()
+    results = asyncio.run(main())
+    assert all(result.status == 'success' for result in results)
+    # Later runs of a sample may hit the layer cache and report fewer layers, never more
+    assert all(result.layers <= expected[result.path] for result in results)
+    assert any(result.layers == expected[result.path] for result in results)
+
+
+def fct_deobf_layers(sample):
+    from vipyr_deobf.deobf_utils import observe_layers
+
+    layers = []
+    with observe_layers(layers.append):
+        fct_deobf.deobf(sample)
+    return layers
+
+
+def test_unknown_types_are_rejected_up_front():
+    from vipyr_deobf.exceptions import DeobfLoadingError
+
+    with pytest.raises(DeobfLoadingError):
+        AsyncDeobfService('nosuchschema')
@@ -0,0 +1,117 @@
+import ast
+import base64
+
+from vipyr_deobf.batch import collect_paths, deobf_sample, parse_request
+from vipyr_deobf.deobfuscators.FCT.fct import fct_deobf  # noqa: F401 (registers the schema)
+
+
+def test_collect_paths(tmp_path):
+    for name in ('a.obf', 'b.obf', 'sub/c.obf'):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text('')
+    list_file = tmp_path / 'samples.txt'
+    list_file.write_text(f'# comment\n{tmp_path / "a.obf"}\n\n{tmp_path / "sub/c.obf"}\n')
+
+    assert len(collect_paths(str(tmp_path))) == 4
+    assert [path.name for path in collect_paths(f'{tmp_path}/**/*.obf')] == ['a.obf', 'b.obf', 'c.obf']
+    assert [path.name for path in collect_paths(str(list_file))] == ['a.obf', 'c.obf']
+
+
+def test_deobf_sample():
+    result = deobf_sample('tests/fct/sample_hello_world.obf', timeout=30)
+    assert result.status == 'success'
+    assert result.label == 'fctv1'
+    with open('tests/fct/sample_hello_world.exp', 'r') as file:
+        exp = file.read()
+    assert ast.dump(ast.parse(result.output)) == ast.dump(ast.parse(exp))
+
+
+def test_deobf_sample_missing_file():
+    result = deobf_sample('tests/fct/does_not_exist.obf')
+    assert result.status == 'error'
+
+
+def test_deobf_sample_timeout_keeps_partial_output(monkeypatch):
+    from vipyr_deobf.deobfuscators.FCT import fct
+    from vipyr_deobf.exceptions import SampleTimeoutError
+
+    deobf_obf = fct.deobf_obf
+    calls = []
+
+    def slow_deobf_obf(obf_bytes):
+        calls.append(obf_bytes)
+        if len(calls) > 1:
+            raise SampleTimeoutError()
+        return deobf_obf(obf_bytes)
+
+    fct.layer_cache.clear()
+    monkeypatch.setattr(fct, 'deobf_obf', slow_deobf_obf)
+    result = deobf_sample('tests/fct/sample_hello_world.obf', timeout=30)
+    assert result.status == 'timeout'
+    assert result.label == 'fctv1'
+    assert result.output.startswith('exec((_)(b')
+
+
+def test_timeout_is_not_swallowed_by_catch_alls(monkeypatch):
+    import time
+
+    from vipyr_deobf.deobfuscators.FCT import fct
+
+    def stubborn_deobf_obf(_obf_bytes):
+        while True:
+            try:
+                time.sleep(0.01)
+            except Exception:  # noqa: BLE001, S110 (hostile samples swallow everything)
+                pass
+
+    fct.layer_cache.clear()
+    monkeypatch.setattr(fct, 'deobf_obf', stubborn_deobf_obf)
+    result = deobf_sample('tests/fct/sample_hello_world.obf', timeout=0.2)
+    assert result.status == 'timeout'
+
+
+def test_supervised_sample():
+    from vipyr_deobf.batch import supervised_sample
+    from vipyr_deobf.supervise import Limits
+
+    result = supervised_sample('tests/fct/sample_hello_world.obf', timeout=30, limits=Limits(cpu=10))
+    assert result.status == 'success'
+    assert result.label == 'fctv1'
+
+
+def test_deobf_sample_result_json():
+    import json
+
+    from vipyr_deobf.deobfuscators.FCT import fct
+
+    fct.layer_cache.clear()
+    result = deobf_sample('tests/fct/sample_hello_world.obf', timeout=30)
+    assert result.layers == len(result.layer_timings) > 1
+    data = json.loads(result.to_json(id=7))
+    assert next(iter(data)) == 'id'
+    assert data['success'] and data['iocs'] == {'webhooks': []}
+    assert set(data['timings']) == {'read', 'scan', 'deobf', 'format'}
+
+
+def test_parse_request_keeps_content_bytes():
+    # Left to the schema to decode, like a file read from disk
+    raw = b'\xef\xbb\xbfprint(1)'
+    assert parse_request({'content': base64.b64encode(raw).decode()}) == ('<content>', raw)
+    assert parse_request({'source': 'print(1)'}) == ('<source>', 'print(1)')
+
+
+def test_run_batch_survives_killed_workers(monkeypatch):
+    import os
+    import signal
+    from pathlib import Path
+
+    from vipyr_deobf.batch import run_batch
+    from vipyr_deobf.deobfuscators.FCT import fct
+
+    def killed_deobf_obf(_obf_bytes):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    fct.layer_cache.clear()
+    monkeypatch.setattr(fct, 'deobf_obf', killed_deobf_obf)
+    results = [*run_batch([Path('tests/fct/sample_hello_world.obf')] * 3, 'fct', jobs=1)]
+    assert [result.status for result in results] == ['error'] * 3
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from vipyr_deobf.bench import (
+    compare,
+    growth,
+    make_baseline,
+    read_samples,
+    synthetic_samples,
+    time_samples,
+)
+from vipyr_deobf.deobf_base import DEOBFS, load_all_deobfs
+
+
+def test_time_samples():
+    if not DEOBFS:
+        load_all_deobfs()
+    timings = dict(time_samples(read_samples([Path('tests/fct/sample_hello_world.obf')]), repeat=2))
+    timing = timings['tests/fct/sample_hello_world.obf']
+    assert timing.schema == 'fctv1'
+    assert timing.size == 4034
+    assert 0 < timing.deobf < timing.total
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    baseline = make_baseline({}, {'import': 0.1})
+    baseline['samples'] = {
+        'a.obf': {'schema': 'fctv1', 'size': 10, 'scan': 0.01, 'deobf': 1.0, 'format': 0.0},
+        'b.obf': {'schema': 'fctv1', 'size': 10, 'scan': 0.01, 'deobf': 1.0, 'format': 0.0},
+    }
+    current = make_baseline({}, {'import': 0.11})
+    current['samples'] = {
+        'a.obf': {'schema': 'fctv1', 'size': 10, 'scan': 0.01, 'deobf': 1.5, 'format': 0.0005},
+        'b.obf': {'schema': 'varev1', 'size': 10, 'scan': 0.01, 'deobf': 2.0, 'format': 0.0},
+        'c.obf': {'schema': 'fctv1', 'size': 10, 'scan': 0.01, 'deobf': 2.0, 'format': 0.0},
+    }
+    assert [(r.name, r.phase) for r in compare(baseline, current, threshold=0.25)] == [('a.obf', 'deobf')]
+
+    current['samples']['a.obf']['format'] = 0.01
+    regressions = compare(baseline, current, threshold=0.25)
+    assert [str(r) for r in regressions if r.phase == 'format'] == ['a.obf format: 0.000000s -> 0.010000s (new)']
+
+
+def test_synthetic_growth():
+    if not DEOBFS:
+        load_all_deobfs()
+    samples = dict(time_samples(synthetic_samples([2000, 20000], schemas=['fct']), repeat=1, memory=True))
+    assert [*samples] == ['fct:2000', 'fct:20000']
+    assert all(timing.peak_memory for timing in samples.values())
+    assert [*growth(samples)] == ['fctv1']
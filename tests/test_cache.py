@@ -0,0 +1,70 @@
+import os
+
+from vipyr_deobf.cache import ResultCache
+
+
+def test_round_trip(tmp_path):
+    cache = ResultCache(tmp_path)
+    key, input_sha256 = cache.key(b'print(1)', 'fingerprint')
+    assert cache.get(key) is None
+    cache.put(key, 'fct', 1, 'print(1)', input_sha256)
+    entry = cache.get(key)
+    assert (entry.schema, entry.version, entry.output, entry.input_sha256) == ('fct', 1, 'print(1)', input_sha256)
+
+
+def test_key_depends_on_fingerprint(tmp_path):
+    cache = ResultCache(tmp_path)
+    assert cache.key(b'print(1)', 'a')[0] != cache.key(b'print(1)', 'b')[0]
+    assert cache.key(b'print(1)', 'a')[0] != cache.key(b'print(1)', 'a', skip_scan=True)[0]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path)
+    keys = [cache.key(str(i).encode(), 'fingerprint')[0] for i in range(3)]
+    for age, key in enumerate(keys):
+        cache.put(key, 'fct', 1, 'x' * 100, '')
+        os.utime(cache.entry_path(key), (age, age))
+    cache.get(keys[0])
+
+    cache.max_size = sum(cache.entry_path(key).stat().st_size for key in (keys[0], keys[2]))
+    cache.evict()
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+
+
+def test_put_only_scans_once_the_cache_may_be_full(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path, max_size=4 * 1024 * 1024)
+    scans = []
+    evict = ResultCache.evict
+    monkeypatch.setattr(ResultCache, 'evict', lambda self: (scans.append(1), evict(self)))
+    for i in range(100):
+        cache.put(cache.key(str(i).encode(), 'fingerprint')[0], 'fct', 1, 'x' * 100, '')
+    # The first put measures the cache, the rest are tracked until max_size / 64 has been written
+    assert len(scans) == 1
+    cache.max_size = 2000
+    cache.put(cache.key(b'last', 'fingerprint')[0], 'fct', 1, 'x' * 100, '')
+    assert len(scans) == 2
+    assert cache.size <= 2000
+
+
+def test_unwritable_cache_is_logged(tmp_path, caplog):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    cache = ResultCache(blocker)
+    key, input_sha256 = cache.key(b'print(1)', 'fingerprint')
+    cache.put(key, 'fct', 1, 'print(1)', input_sha256)
+    assert 'Could not write cache entry' in caplog.text
+    assert cache.get(key) is None
+
+
+def test_fingerprint_covers_shared_modules(monkeypatch):
+    from vipyr_deobf import cache as cache_module
+
+    before = cache_module.registry_fingerprint([])
+    monkeypatch.setattr(
+        cache_module, 'module_hash', lambda name: 'changed' if name == 'vipyr_deobf.deobf_utils' else 'same'
+    )
+    changed = cache_module.registry_fingerprint([])
+    monkeypatch.setattr(cache_module, 'module_hash', lambda name: 'same')
+    assert len({before, changed, cache_module.registry_fingerprint([])}) == 3
@@ -0,0 +1,72 @@
+import json
+import sys
+import time
+
+import pytest
+
+from vipyr_deobf import cli
+from vipyr_deobf.deobfuscators.FCT import fct
+
+SAMPLE = 'tests/fct/sample_hello_world.obf'
+
+
+def stubborn_deobf_obf(_obf_bytes):
+    while True:
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('limit_args', [[], ['--isolate']])
+def test_json_mode_applies_timeout_and_limits(monkeypatch, capsys, limit_args):
+    fct.layer_cache.clear()
+    monkeypatch.setattr(fct, 'deobf_obf', stubborn_deobf_obf)
+    # The schema is already registered by the import above
+    monkeypatch.setattr(cli, 'load_deobfs', lambda _types: None)
+    args = cli.get_parser().parse_args([SAMPLE, '--json', '-t', 'fct', '--timeout', '0.2', *limit_args])
+    start = time.monotonic()
+    cli.run_json_cli(args)
+    assert time.monotonic() - start < 10
+    assert json.loads(capsys.readouterr().out)['status'] == 'timeout'
+
+
+def test_race_is_rejected_outside_single_runs(monkeypatch):
+    for mode in ('--json', '--jsonl', '--batch'):
+        monkeypatch.setattr(sys, 'argv', ['vipyr-deobf', SAMPLE, '--race', mode])
+        with pytest.raises(SystemExit):
+            cli.run()
+
+
+def test_jsonl_mode_writes_and_closes_the_output_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(cli, 'load_deobfs', lambda _types: None)
+    records, output = tmp_path / 'records.jsonl', tmp_path / 'results.jsonl'
+    records.write_text(json.dumps({'id': 1, 'path': SAMPLE}) + '\n')
+    cli.run_jsonl_cli(cli.get_parser().parse_args(['--jsonl', str(records), '-o', str(output), '-t', 'fct', '-j', '1']))
+    assert json.loads(output.read_text())['status'] == 'success'
+
+    output.unlink()
+    cli.run_jsonl_cli(cli.get_parser().parse_args(['--jsonl', str(tmp_path / 'missing'), '-o', str(output), '-t', 'fct']))
+    assert not output.exists()
+
+
+@pytest.mark.parametrize('limit_args', [[], ['--isolate']])
+def test_single_mode_applies_timeout_and_limits(monkeypatch, capsys, limit_args):
+    fct.layer_cache.clear()
+    monkeypatch.setattr(fct, 'deobf_obf', stubborn_deobf_obf)
+    monkeypatch.setattr(cli, 'load_deobfs', lambda _types: None)
+    args = cli.get_parser().parse_args([SAMPLE, '-t', 'fct', '--timeout', '0.2', *limit_args])
+    start = time.monotonic()
+    cli.run_path(args)
+    assert time.monotonic() - start < 10
+    assert not capsys.readouterr().out
+
+
+def test_json_is_rejected_outside_single_runs(monkeypatch):
+    for mode in ('--jsonl', '--batch'):
+        monkeypatch.setattr(sys, 'argv', ['vipyr-deobf', SAMPLE, '--json', mode])
+        with pytest.raises(SystemExit):
+            cli.run()
+
+
+def test_profile_rejects_limits(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['vipyr-deobf', SAMPLE, '--profile', '--isolate'])
+    with pytest.raises(SystemExit):
+        cli.run()
@@ -0,0 +1,200 @@
+import ast
+from types import SimpleNamespace
+
+import pytest
+
+from vipyr_deobf import deobf_base
+from vipyr_deobf.deobf_base import (
+    ScanContext,
+    SchemaScanner,
+    SignaturePrefilter,
+    build_manifest,
+    open_sample,
+    run_scanners,
+    walk_scanners,
+)
+from vipyr_deobf.deobf_manifest import DEOBF_MANIFEST
+
+
+def test_scan_context_parses_once(monkeypatch):
+    calls = []
+    parse = ast.parse
+
+    def counting_parse(*args, **kwargs):
+        calls.append(args)
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(ast, 'parse', counting_parse)
+    ctx = ScanContext('print("Hello, World!")')
+    assert ctx.tree is ctx.tree
+    assert len(calls) == 1
+
+
+def test_scan_context_caches_syntax_error():
+    ctx = ScanContext('def (')
+    for _ in range(2):
+        with pytest.raises(SyntaxError):
+            _ = ctx.tree
+
+
+def test_scan_context_decodes_bytes_lazily():
+    ctx = ScanContext(b'# -*- coding: latin-1 -*-\nx = "\xe9"\n')
+    assert ctx._code is None
+    assert ast.literal_eval(ctx.tree.body[0].value) == '\xe9'
+    assert ctx._code is None
+    assert ctx.code.endswith('x = "\xe9"\n')
+
+
+def test_scan_context_survives_undecodable_bytes():
+    ctx = ScanContext(b'x = "\xff"\n')
+    assert ctx.code.encode('utf-8', 'surrogateescape') == ctx.data
+    with pytest.raises(SyntaxError):
+        _ = ctx.tree
+    with pytest.raises(SyntaxError):
+        _ = ScanContext(ctx.code).tree
+
+
+def test_open_sample_maps_large_files(tmp_path, monkeypatch):
+    sample = tmp_path / 'sample.py'
+    sample.write_bytes(b'print(1)\n')
+    with open_sample(sample) as data:
+        assert isinstance(data, bytes)
+    monkeypatch.setattr(deobf_base, 'MMAP_THRESHOLD', 0)
+    with open_sample(sample) as data:
+        assert not isinstance(data, bytes)
+        assert ast.dump(ScanContext(data).tree) == ast.dump(ast.parse('print(1)'))
+
+
+class NameCounter(SchemaScanner):
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.seen = 0
+
+    def visit_Name(self, node):
+        self.seen += 1
+        if self.seen == self.limit:
+            self.matched()
+
+
+def test_walk_scanners_stops_once_decided():
+    tree = ast.parse('a; b; c; d; e')
+    early, late = NameCounter(2), NameCounter(3)
+    walk_scanners(tree, [early, late])
+    assert early.result and late.result
+    assert (early.seen, late.seen) == (2, 3)
+
+
+def test_run_scanners_skips_parse_when_decided():
+    class TextScanner(SchemaScanner):
+        def start(self, ctx):
+            self.impossible()
+
+    assert run_scanners(ScanContext('def ('), [TextScanner()]) == [False]
+    assert run_scanners(ScanContext('def ('), [NameCounter(1)]) == [False]
+
+
+def test_scanners_missing_a_required_identifier_skip_the_walk():
+    class RequiringCounter(NameCounter):
+        requires = (b'exec', b'b64decode')
+
+    ctx = ScanContext('exec(a)')
+    scanner = RequiringCounter(1)
+    assert run_scanners(ctx, [scanner]) == [False]
+    assert scanner.seen == 0
+    assert ctx._tree is None
+    assert run_scanners(ScanContext('exec(b64decode)'), [RequiringCounter(1)]) == [True]
+
+
+def test_signature_prefilter():
+    foo = SimpleNamespace(signatures=(b'__foo__',))
+    foobar = SimpleNamespace(signatures=(b'bar', b'__foobar__'))
+    unfiltered = SimpleNamespace(signatures=())
+    prefilter = SignaturePrefilter([foo, foobar, unfiltered])
+
+    assert prefilter.candidates(b'print(1)') == [unfiltered]
+    assert prefilter.candidates(b'__foobar__ = 1') == [foobar, unfiltered]
+    assert prefilter.candidates(b'__foo__ = bar') == [foo, foobar, unfiltered]
+
+    # Non-overlapping matching would stop at abc and never see bcd
+    abc = SimpleNamespace(signatures=(b'abc',))
+    bcd = SimpleNamespace(signatures=(b'bcd',))
+    assert SignaturePrefilter([abc, bcd]).candidates(b'abcd') == [abc, bcd]
+
+
+def test_manifest_up_to_date():
+    # Rerun `python -m vipyr_deobf.deobf_base` if this fails after adding a deobfuscator
+    assert build_manifest() == DEOBF_MANIFEST
+
+
+def test_layer_cache_maps_every_peeled_layer_and_evicts_lru():
+    from vipyr_deobf.deobf_utils import LayerCache
+
+    layer_cache: LayerCache[str] = LayerCache(max_entries=3)
+    keys = [layer_cache.key(layer) for layer in ('outer', b'middle', 'inner')]
+    layer_cache.put(keys, 'result')
+    assert all(layer_cache.get(key) == 'result' for key in keys)
+    layer_cache.get(keys[0])
+    layer_cache.put([layer_cache.key('other')], 'other')
+    assert layer_cache.get(keys[1]) is None
+    assert layer_cache.get(keys[0]) == 'result'
+
+
+def test_layer_cache_bounds_result_bytes():
+    from vipyr_deobf.deobf_utils import LayerCache
+
+    layer_cache: LayerCache[bytes] = LayerCache(max_bytes=10)
+    layer_cache.put([layer_cache.key('a')], b'x' * 6)
+    layer_cache.put([layer_cache.key('b')], b'y' * 6)
+    assert layer_cache.get(layer_cache.key('a')) is None
+    assert layer_cache.get(layer_cache.key('b')) == b'y' * 6
+    layer_cache.put([layer_cache.key('c')], b'z' * 11)
+    assert layer_cache.get(layer_cache.key('c')) is None
+    assert layer_cache.size == 6
+
+
+def test_supervised_sample_keeps_layers_peeled_in_the_child():
+    from vipyr_deobf.batch import supervised_sample
+    from vipyr_deobf.deobfuscators.FCT import fct
+
+    fct.layer_cache.clear()
+    result = supervised_sample('tests/fct/sample_hello_world.obf', timeout=30)
+    assert result.status == 'success'
+    assert fct.layer_cache.entries
+
+
+def test_lazy_import_is_retried_after_a_failure_and_runs_once_across_threads(tmp_path, monkeypatch):
+    import importlib
+    import sys
+    import threading
+
+    from vipyr_deobf.deobf_utils import lazy_import
+
+    runs = tmp_path / 'runs'
+    module = tmp_path / 'lazy_sample_module.py'
+    module.write_text('raise ImportError("not yet")\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'lazy_sample_module', raising=False)
+
+    lazy = lazy_import('lazy_sample_module')
+    assert 'lazy_sample_module' not in sys.modules
+    with pytest.raises(ImportError):
+        _ = lazy.value
+    assert 'lazy_sample_module' not in sys.modules
+
+    module.write_text(
+        'import pathlib, time\n'
+        f'pathlib.Path({str(runs)!r}).open("a").write("run\\n")\n'
+        'time.sleep(0.1)\n'
+        'value = 42\n'
+    )
+    importlib.invalidate_caches()
+    values = []
+    threads = [threading.Thread(target=lambda: values.append(lazy.value)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert values == [42] * 8
+    assert runs.read_text() == 'run\n'
+    monkeypatch.delitem(sys.modules, 'lazy_sample_module')
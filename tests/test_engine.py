@@ -0,0 +1,31 @@
+import logging
+
+from vipyr_deobf.engine import Engine
+
+
+def test_engine_deobfuscates_without_touching_logging():
+    root_handlers = [*logging.getLogger().handlers]
+    engine = Engine('fct')
+    with open('tests/fct/sample_hello_world.obf', 'rb') as file:
+        data = file.read()
+    assert [deobf.name for deobf in engine.scan(data)] == ['fct']
+    for _ in range(3):
+        result = engine.deobfuscate(data, label='hello')
+        assert (result.path, result.status, result.label) == ('hello', 'success', 'fctv1')
+    assert engine.deobfuscate(b'print(1)\n').status == 'fail'
+    assert logging.getLogger().handlers == root_handlers
+    assert Engine('fct').deobfs == engine.deobfs
+
+
+def test_engine_logs_crashes_with_their_traceback(monkeypatch, caplog):
+    def crash(_code):
+        raise KeyError('boom')
+
+    engine = Engine('fct')
+    monkeypatch.setattr(engine.deobfs[0], 'deobf_func', crash)
+    with caplog.at_level(logging.ERROR, logger='deobf'):
+        result = engine.deobfuscate(b'print(1)\n', skip_scan=True, label='crashy')
+    assert (result.status, result.error) == ('error', "KeyError: 'boom'")
+    [record] = [record for record in caplog.records if record.name == 'deobf']
+    assert 'crashy' in record.getMessage()
+    assert record.exc_info[0] is KeyError
@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+from vipyr_deobf.deobf_base import (
+    DEOBFS,
+    ScanContext,
+    get_available_deobfs,
+    load_deobf,
+    scan_deobfs,
+)
+from vipyr_deobf.generate import GENERATORS, SINGLE_LAYER, generate, make_webhook
+
+CASES = [
+    (schema, layers)
+    for schema in GENERATORS
+    for layers in ((1,) if schema in SINGLE_LAYER else (1, 2))
+]
+
+
+@pytest.mark.parametrize('schema,layers', CASES)
+def test_generated_samples_deobfuscate(schema, layers):
+    for version, path in get_available_deobfs()[schema].items():
+        if version not in DEOBFS.get(schema, {}):
+            load_deobf(schema, version, path)
+    sample = generate(schema, 4000, layers, depth=3, seed=1)
+    deobfs = scan_deobfs(ScanContext(sample))
+    assert deobfs and deobfs[0].name == schema
+    output = deobfs[0].format_results(deobfs[0].deobf(ScanContext(sample)))
+    assert make_webhook(random.Random(1)) in output
+
+
+def test_generate_rejects_layers_the_schema_cannot_express():
+    with pytest.raises(ValueError):
+        generate('lzmaspam', 1000, layers=2)
+    with pytest.raises(ValueError):
+        generate('fct', 1000, layers=0)
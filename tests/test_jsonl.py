@@ -0,0 +1,28 @@
+import base64
+import io
+import json
+
+from vipyr_deobf.deobfuscators.FCT.fct import fct_deobf  # noqa: F401 (registers the schema)
+from vipyr_deobf.jsonl import run_jsonl
+
+
+def test_run_jsonl():
+    with open('tests/fct/sample_hello_world.obf', 'rb') as file:
+        content = base64.b64encode(file.read()).decode()
+    records = [
+        json.dumps({'id': 1, 'path': 'tests/fct/sample_hello_world.obf'}),
+        '',
+        'not json',
+        json.dumps({'id': 'b64', 'content': content}),
+        json.dumps({'id': 3}),
+    ]
+    out = io.StringIO()
+    stats = run_jsonl(records, out, jobs=1, timeout=30, max_pending=1)
+
+    results = {result.get('id'): result for result in map(json.loads, out.getvalue().splitlines())}
+    assert stats.samples == 4
+    assert results[1]['status'] == results['b64']['status'] == 'success'
+    assert (results[1]['schema'], results[1]['version']) == ('fct', 1)
+    assert results[1]['output'] == results['b64']['output']
+    assert set(results[1]['timings']) == {'read', 'scan', 'deobf', 'format'}
+    assert results[3]['status'] == results[None]['status'] == 'error'
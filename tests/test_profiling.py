@@ -0,0 +1,42 @@
+import io
+import pstats
+
+from vipyr_deobf.deobf_base import DEOBFS, ScanContext, load_all_deobfs, scan_deobfs
+from vipyr_deobf.deobf_utils import observe_layers, report_layer
+from vipyr_deobf.profiling import RunProfile
+
+
+def test_profile_nests_phases_and_layers():
+    profile = RunProfile()
+    with profile.running():
+        with profile.phase('scan'):
+            profile.record('prefilter', 0.5)
+        with profile.phase('deobf'), observe_layers(profile.observe_layer):
+            report_layer('first')
+            report_layer('second')
+    assert [(phase.name, phase.depth) for phase in profile.phases] == [
+        ('scan', 0), ('prefilter', 1), ('deobf', 0), ('layer 1', 1), ('layer 2', 1),
+    ]
+    assert profile.profiler is None and profile.peak_memory is None
+
+
+def test_profile_collects_hotspots_memory_and_dump(tmp_path):
+    profile = RunProfile(hotspots=5, dump=tmp_path / 'run.prof', memory=True)
+    with profile.running():
+        with profile.phase('work'):
+            sorted(str(i) for i in range(10000))
+    report = io.StringIO()
+    profile.report(report)
+    assert 'work' in report.getvalue()
+    assert 'Top 5 functions by own time' in report.getvalue()
+    assert profile.peak_memory
+    assert pstats.Stats(str(tmp_path / 'run.prof')).total_calls
+
+
+def test_scan_timings():
+    if not DEOBFS:
+        load_all_deobfs()
+    timings = {}
+    with open('tests/fct/sample_hello_world.obf', 'r') as file:
+        assert scan_deobfs(ScanContext(file.read()), timings)
+    assert {'prefilter', 'walk'} <= timings.keys()
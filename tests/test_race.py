@@ -0,0 +1,83 @@
+import signal
+import time
+from contextlib import closing
+
+import pytest
+
+from vipyr_deobf.deobf_base import Deobfuscator, ScanContext
+from vipyr_deobf.exceptions import DeobfuscationFailError, SampleTimeoutError
+from vipyr_deobf.race import race_deobfs
+
+
+def make_deobf(name, delay, output=None):
+    def deobf(code):
+        time.sleep(delay)
+        if output is None:
+            raise DeobfuscationFailError(code=code)
+        return output
+
+    return Deobfuscator(deobf, str, lambda ctx: True, name=name)
+
+
+def race(*deobfs, timeout=0):
+    with closing(race_deobfs(deobfs, ScanContext('pass'), timeout=timeout)) as outcomes:
+        return [(deobf.name, output, type(exc)) for deobf, output, exc in outcomes]
+
+
+def test_race_keeps_serial_order():
+    assert race(make_deobf('slow', 0.3, 'slow'), make_deobf('fast', 0, 'fast')) == [
+        ('slow', 'slow', type(None)),
+    ]
+
+
+def test_race_reports_failures_before_winner():
+    assert race(make_deobf('broken', 0.1), make_deobf('works', 0, 'works'), make_deobf('late', 0, 'late')) == [
+        ('broken', None, DeobfuscationFailError),
+        ('works', 'works', type(None)),
+    ]
+
+
+def test_race_kills_candidates_that_cannot_win():
+    start = time.monotonic()
+    assert race(make_deobf('fast', 0, 'fast'), make_deobf('stuck', 30, 'stuck'))[0][0] == 'fast'
+    assert time.monotonic() - start < 10
+
+
+def test_race_single_survives_candidates_over_budget(capsys):
+    import argparse
+
+    from vipyr_deobf.cli import race_single
+
+    def over_time(code):
+        raise SampleTimeoutError('Exceeded CPU time limit')
+
+    def over_memory(code):
+        raise MemoryError()
+
+    deobfs = [
+        Deobfuscator(over_time, str, lambda ctx: True, name='slow'),
+        Deobfuscator(over_memory, str, lambda ctx: True, name='big'),
+        make_deobf('works', 0, 'works'),
+    ]
+    args = argparse.Namespace(path='<source>', output=None, isolate=False, cpu_limit=0, memory_limit=0, timeout=0)
+    race_single(args, ScanContext('pass'), deobfs, None, '', '')
+    assert capsys.readouterr().out == 'works\n'
+
+
+def make_deaf_deobf(name, delay):
+    def deobf(code):
+        # Stands in for a candidate stuck in a C call, which its own alarm cannot interrupt
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        time.sleep(delay)
+
+    return Deobfuscator(deobf, str, lambda ctx: True, name=name)
+
+
+@pytest.mark.parametrize('make_stuck', [make_deobf, make_deaf_deobf])
+def test_race_times_out_hung_candidates(make_stuck):
+    start = time.monotonic()
+    assert race(make_stuck('stuck', 30), make_deobf('works', 0, 'works'), timeout=0.3) == [
+        ('stuck', None, SampleTimeoutError),
+        ('works', 'works', type(None)),
+    ]
+    assert time.monotonic() - start < 10
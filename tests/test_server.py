@@ -0,0 +1,75 @@
+import http.client
+import json
+import socket
+import threading
+from http import HTTPStatus
+
+import pytest
+
+from vipyr_deobf import server as server_module
+from vipyr_deobf.deobfuscators.FCT.fct import fct_deobf  # noqa: F401 (registers the schema)
+from vipyr_deobf.server import DeobfHTTPServer, DeobfService, DeobfUnixServer
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = DeobfService(jobs=1, timeout=30)
+    yield service
+    service.close()
+
+
+def test_handle_path(service):
+    response = service.handle({'id': 7, 'path': 'tests/fct/sample_hello_world.obf'})
+    assert response['id'] == 7
+    assert response['status'] == 'success'
+    assert (response['schema'], response['version']) == ('fct', 1)
+
+
+@pytest.mark.parametrize('request_body', [[], {'id': 1}, {'content': 'not base64!'}])
+def test_handle_bad_request(service, request_body):
+    with pytest.raises(ValueError):
+        service.handle(request_body)
+
+
+@pytest.fixture
+def http_server(service):
+    server = DeobfHTTPServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    ('content_length', 'status'),
+    [('abc', HTTPStatus.BAD_REQUEST), ('-1', HTTPStatus.BAD_REQUEST), (None, HTTPStatus.LENGTH_REQUIRED)],
+)
+def test_http_rejects_bad_content_length(http_server, content_length, status):
+    connection = http.client.HTTPConnection(*http_server.server_address, timeout=10)
+    connection.putrequest('POST', '/deobf')
+    if content_length is not None:
+        connection.putheader('Content-Length', content_length)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == status
+    json.loads(response.read())
+    connection.close()
+
+
+def test_unix_rejects_over_long_lines(service, tmp_path, monkeypatch):
+    monkeypatch.setattr(server_module, 'MAX_REQUEST_SIZE', 64)
+    server = DeobfUnixServer(str(tmp_path / 'deobf.sock'), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(str(tmp_path / 'deobf.sock'))
+            request = json.dumps({'id': 1, 'source': 'x' * 200}).encode() + b'\n'
+            client.sendall(request + b'{"id": 2}\n')
+            responses = client.makefile('rb')
+            assert json.loads(responses.readline()) == {'status': 'error', 'error': 'Request too large'}
+            assert json.loads(responses.readline())['error'].startswith('Bad request')
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,47 @@
+import os
+import signal
+import time
+
+import pytest
+
+from vipyr_deobf import supervise
+from vipyr_deobf.exceptions import SampleTimeoutError, WorkerDiedError
+from vipyr_deobf.supervise import Limits, run_isolated
+
+
+def test_run_isolated_returns_result():
+    assert run_isolated(lambda: os.getpid()) != os.getpid()
+
+
+def test_cpu_limit_raises_inside_call():
+    def spin():
+        try:
+            while True:
+                pass
+        except SampleTimeoutError as exc:
+            return str(exc)
+
+    assert run_isolated(spin, limits=Limits(cpu=0.5)) == 'Exceeded CPU time limit'
+
+
+def test_memory_limit_raises_inside_call():
+    def allocate():
+        try:
+            return len(bytearray(512 * 1024 * 1024))
+        except MemoryError:
+            return 'oom'
+
+    assert run_isolated(allocate, limits=Limits(memory=64 * 1024 * 1024)) == 'oom'
+
+
+def test_dead_worker():
+    with pytest.raises(WorkerDiedError, match='SIGKILL'):
+        run_isolated(lambda: os.kill(os.getpid(), signal.SIGKILL))
+
+
+def test_unresponsive_worker_is_killed(monkeypatch):
+    monkeypatch.setattr(supervise, 'KILL_GRACE', 0.1)
+    start = time.monotonic()
+    with pytest.raises(SampleTimeoutError):
+        run_isolated(lambda: time.sleep(10), timeout=0.1)
+    assert time.monotonic() - start < 5